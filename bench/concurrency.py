@@ -0,0 +1,72 @@
+# Benchmark latensi handler dengan N user bersamaan terhadap backend Sheets palsu.
+# Setiap user menjalankan alur "Hapus Data -> SFP -> ketik SN -> Hapus" lewat
+# handle_messages, diawali beberapa pesan menu tanpa I/O. --inline meniru perilaku lama
+# (panggilan Google langsung di event loop) sebagai pembanding.
+#
+#   python bench/concurrency.py --users 50 --latency 150
+import argparse, asyncio, random, time
+from collections import defaultdict
+
+from fakes import FakeBackend, FakeMessage, load_inventaris, percentile, sfp_rows
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Latensi handler dengan N user bersamaan")
+    p.add_argument("--users", type=int, default=50)
+    p.add_argument("--rows", type=int, default=2000, help="jumlah baris sheet SFP")
+    p.add_argument("--latency", type=float, default=150, help="latensi tiap panggilan Google (ms)")
+    p.add_argument("--jitter", type=float, default=100, help="tambahan latensi acak (ms)")
+    p.add_argument("--spread", type=float, default=1.0, help="user mulai acak dalam rentang ini (detik)")
+    p.add_argument("--workers", type=int, default=8, help="GOOGLE_MAX_WORKERS")
+    p.add_argument("--inline", action="store_true", help="jalankan panggilan Google di event loop (tanpa executor)")
+    return p.parse_args()
+
+async def run_user(inv, user_id: int, sn: str, start: float, lat: dict):
+    await asyncio.sleep(start - time.perf_counter())
+    # Pesan berikutnya dianggap dikirim begitu balasan sebelumnya selesai; latensi dihitung
+    # dari saat kirim, jadi waktu menunggu event loop yang sedang terblokir ikut terukur
+    steps = [("menu", inv.BTN_PEMAKAIAN), ("menu", inv.BTN_CANCEL), ("menu", inv.BTN_DELETE),
+             ("menu", "SFP"), ("cari SN", sn), ("hapus", inv.LABEL_CONFIRM_DELETE)]
+    sent = start
+    for kind, text in steps:
+        await inv.handle_messages(None, FakeMessage(user_id, text))
+        done = time.perf_counter()
+        lat[kind].append((done - sent) * 1000)
+        sent = done
+        await asyncio.sleep(0) # Beri giliran ke update user lain, seperti dispatcher Pyrogram
+
+async def main():
+    args = parse_args()
+    inv = load_inventaris(GOOGLE_MAX_WORKERS=args.workers)
+    backend = FakeBackend(latency=args.latency / 1000, jitter=args.jitter / 1000)
+    backend.add_all_sheets(inv, {"SFP": sfp_rows(args.rows)})
+    backend.install(inv)
+    await inv.warm_sn_index()
+    if args.inline:
+        async def gcall(fn, *a, timeout=None, **kw): return fn(*a, **kw)
+        inv.gcall = gcall
+    backend.reset_counters()
+
+    worker = asyncio.create_task(inv.journal_worker())
+    lat = defaultdict(list)
+    rnd = random.Random(1)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(run_user(inv, 1000 + u, f"SN{u + 1:06d}", t0 + rnd.uniform(0, args.spread), lat)
+                           for u in range(args.users)))
+    elapsed = time.perf_counter() - t0
+    worker.cancel()
+    while await asyncio.to_thread(inv.flush_journal, wait=inv.GOOGLE_CALL_TIMEOUT): pass
+
+    mode = "inline (event loop)" if args.inline else f"executor ({args.workers} worker)"
+    print(f"{args.users} user, {args.rows} baris SFP, latensi {args.latency:.0f}+{args.jitter:.0f} ms, mode {mode}")
+    print(f"{'pesan':<10}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    everything = []
+    for kind, xs in lat.items():
+        everything += xs
+        print(f"{kind:<10}{len(xs):>6}{percentile(xs, 50):>10.1f}{percentile(xs, 95):>10.1f}{max(xs):>10.1f}")
+    print(f"{'semua':<10}{len(everything):>6}{percentile(everything, 50):>10.1f}{percentile(everything, 95):>10.1f}{max(everything):>10.1f}")
+    print(f"durasi total {elapsed:.2f}s; panggilan Google: {dict(sorted(backend.calls.items()))}")
+    left = len(backend.spreadsheet.worksheet("SFP").rows) - 1
+    print(f"baris SFP tersisa {left} (harus {args.rows - args.users})")
+
+if __name__ == "__main__":
+    asyncio.run(main())
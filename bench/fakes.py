@@ -0,0 +1,232 @@
+# Backend Google palsu (Sheets + Drive) untuk benchmark & stress test di folder ini.
+# Tidak butuh kredensial maupun jaringan: data disimpan di memori, setiap panggilan API
+# diberi latensi buatan (meniru round-trip ke Google) dan dihitung jumlah & byte-nya.
+import os, re, sys, json, time, random, logging, tempfile, threading
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_inventaris(**env):
+    # Impor inventaris.py dengan konfigurasi dummy; file jurnal/mirror di folder sementara
+    tmp = tempfile.mkdtemp(prefix="gudang-bench-")
+    os.environ.update({
+        "API_ID": "1", "API_HASH": "bench", "BOT_TOKEN": "1:bench", "SPREADSHEET_ID": "bench",
+        "JOURNAL_FILE": os.path.join(tmp, "journal.sqlite3"), "MIRROR_FILE": os.path.join(tmp, "mirror.sqlite3"),
+        "SESSION_FILE": "", "SHEET_CHANGE_POLL_INTERVAL": "0",
+    })
+    os.environ.update({k: str(v) for k, v in env.items()})
+    sys.path.insert(0, ROOT)
+    import inventaris
+    logging.getLogger("gudang").setLevel(logging.WARNING)
+    return inventaris
+
+def headers_for(inv, title: str) -> List[str]:
+    if title == "Log": return ["Waktu", "User ID", "Username", "Action", "Worksheet", "Detail", "Keterangan"]
+    if title == "Pemakaian":
+        return ["Waktu", "User ID", "Username", "Jenis Perangkat", "Detail",
+                "Jumlah Ambil", "Keterangan (Barang)", "Keterangan Pemakaian"]
+    return ["No"] + [q["key"] for q in inv.DEVICE_CONFIG[title]["questions"]]
+
+def sfp_rows(n: int, seed: int = 1) -> List[List[str]]:
+    rnd = random.Random(seed)
+    return [[str(i), rnd.choice(["SFP", "SFP+", "XFP", "XFP+"]), rnd.choice(["1G", "10G", "100G"]),
+             rnd.choice(["10 km", "40 km", "80 km"]), f"SN{i:06d}", f"Rak {rnd.randint(1, 40)}", ""]
+            for i in range(1, n + 1)]
+
+def _cell_value(c: Dict[str, Any]) -> str:
+    (kind, v), = c["userEnteredValue"].items()
+    if kind == "numberValue" and float(v).is_integer(): return str(int(v))
+    return str(v)
+
+def _a1_col(letters: str) -> int:
+    n = 0
+    for ch in letters: n = n * 26 + ord(ch) - 64
+    return n
+
+def _size(obj: Any) -> int:
+    return len(json.dumps(obj, separators=(",", ":")))
+
+class FakeBackend:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, seed: int = 1):
+        self.latency, self.jitter = latency, jitter
+        self.version = 1 # Versi file Drive; naik setiap isi spreadsheet berubah
+        self.calls: Dict[str, int] = {}
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self._rnd = random.Random(seed)
+        self._lock = threading.RLock()
+        self.spreadsheet = FakeSpreadsheet(self)
+        self.drive = FakeDrive(self)
+
+    def call(self, name: str, fn: Callable[[], Any], request: Any = None) -> Any:
+        with self._lock:
+            delay = self.latency + self._rnd.uniform(0, self.jitter)
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if delay: time.sleep(delay)
+        with self._lock:
+            result = fn()
+            if request is not None: self.bytes_up += _size(request)
+            if result is not None: self.bytes_down += _size(result)
+            return result
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls, self.bytes_up, self.bytes_down = {}, 0, 0
+
+    def add_sheet(self, title: str, rows: List[List[Any]]) -> "FakeWorksheet":
+        return self.spreadsheet.add(title, rows)
+
+    def add_all_sheets(self, inv, data: Optional[Dict[str, List[List[Any]]]] = None):
+        # Semua sheet yang dikenal bot (header + isi opsional), urut seperti SCHEMA_SHEETS
+        data = data or {}
+        for title in inv.SCHEMA_SHEETS:
+            self.add_sheet(title, [headers_for(inv, title)] + data.get(title, []))
+
+    def install(self, inv):
+        inv.ss = self.spreadsheet
+        inv.drive_service = self.drive
+        inv.schema.load()
+        inv.google_ready.set()
+
+class FakeWorksheet:
+    def __init__(self, backend: FakeBackend, title: str, sheet_id: int, rows: List[List[Any]]):
+        self._b, self.title, self.id = backend, title, sheet_id
+        self.rows = [[str(v) for v in r] for r in rows]
+
+    def get_all_values(self) -> List[List[str]]:
+        return self._b.call("values.get", lambda: [list(r) for r in self.rows])
+
+    def row_values(self, row: int) -> List[str]:
+        return self._b.call("values.get", lambda: list(self.rows[row - 1]) if row <= len(self.rows) else [])
+
+    def col_values(self, col: int) -> List[str]:
+        return self._b.call("values.get", lambda: [r[col - 1] if len(r) >= col else "" for r in self.rows])
+
+    def get(self, a1: str) -> List[List[str]]:
+        m = re.fullmatch(r"([A-Z]+)(\d+):([A-Z]+)(\d+)", a1)
+        c0, r0, c1, r1 = _a1_col(m[1]), int(m[2]), _a1_col(m[3]), int(m[4])
+        return self._b.call("values.get", lambda: [r[c0 - 1:c1] for r in self.rows[r0 - 1:r1]])
+
+    def find(self, value: str, in_column: int) -> Optional[SimpleNamespace]:
+        def scan():
+            for i, r in enumerate(self.rows):
+                if len(r) >= in_column and r[in_column - 1] == value: return {"row": i + 1}
+            return None
+        hit = self._b.call("values.get", scan)
+        return SimpleNamespace(**hit) if hit else None
+
+    def update(self, range_name: str, values: List[List[Any]], **kwargs):
+        # Hanya bentuk "A2:A10" / "A1:G1" yang dipakai (header & penomoran ulang cara lama)
+        m = re.fullmatch(r"([A-Z]+)(\d+):([A-Z]+)(\d+)", range_name)
+        c0, r0 = _a1_col(m[1]), int(m[2])
+        def apply():
+            for i, row in enumerate(values):
+                self._b.spreadsheet._set(self, r0 + i, c0, row)
+            self._b.version += 1
+            return {"updatedRows": len(values)}
+        return self._b.call("values.update", apply, request={"range": range_name, "values": values})
+
+    def delete_rows(self, row: int):
+        self._b.spreadsheet.batch_update({"requests": [{"deleteDimension": {
+            "range": {"sheetId": self.id, "dimension": "ROWS", "startIndex": row - 1, "endIndex": row}}}]})
+
+class FakeSpreadsheet:
+    def __init__(self, backend: FakeBackend):
+        self._b = backend
+        self._sheets: Dict[str, FakeWorksheet] = {}
+
+    def add(self, title: str, rows: List[List[Any]]) -> FakeWorksheet:
+        ws = self._sheets[title] = FakeWorksheet(self._b, title, len(self._sheets) + 1, rows)
+        return ws
+
+    def worksheets(self) -> List[FakeWorksheet]:
+        self._b.call("spreadsheets.get", lambda: None)
+        return list(self._sheets.values())
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self._b.call("spreadsheets.get", lambda: None)
+        return self._sheets[title]
+
+    def add_worksheet(self, title: str, rows: int, cols: int) -> FakeWorksheet:
+        self._b.call("spreadsheets.batchUpdate", lambda: None)
+        return self.add(title, [])
+
+    def values_batch_get(self, ranges: List[str]) -> Dict[str, Any]:
+        def read():
+            out = []
+            for rng in ranges:
+                m = re.fullmatch(r"'(.+)'(?:!(\d+):(\d+))?", rng)
+                rows = self._sheets[m[1]].rows
+                if m[2]: rows = rows[int(m[2]) - 1:int(m[3])]
+                out.append({"range": rng, "values": [list(r) for r in rows]})
+            return {"valueRanges": out}
+        return self._b.call("values.batchGet", read)
+
+    def _by_id(self, sheet_id: int) -> FakeWorksheet:
+        return next(ws for ws in self._sheets.values() if ws.id == sheet_id)
+
+    def _set(self, ws: FakeWorksheet, row: int, col: int, values: List[Any]):
+        while len(ws.rows) < row: ws.rows.append([])
+        line = ws.rows[row - 1]
+        while len(line) < col - 1 + len(values): line.append("")
+        for j, v in enumerate(values): line[col - 1 + j] = str(v)
+
+    def batch_update(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        def apply():
+            for req in body["requests"]:
+                (kind, v), = req.items()
+                if kind == "appendCells":
+                    self._by_id(v["sheetId"]).rows.append([_cell_value(c) for c in v["rows"][0]["values"]])
+                elif kind == "insertDimension":
+                    self._by_id(v["range"]["sheetId"]).rows.insert(v["range"]["startIndex"], [])
+                elif kind == "deleteDimension":
+                    del self._by_id(v["range"]["sheetId"]).rows[v["range"]["startIndex"]:v["range"]["endIndex"]]
+                elif kind == "pasteData":
+                    ws, start = self._by_id(v["coordinate"]["sheetId"]), v["coordinate"]
+                    for i, line in enumerate(v["data"].split("\n")):
+                        self._set(ws, start["rowIndex"] + 1 + i, start["columnIndex"] + 1, line.split(v["delimiter"]))
+                elif kind == "updateCells":
+                    ws, start = self._by_id(v["start"]["sheetId"]), v["start"]
+                    for i, row in enumerate(v["rows"]):
+                        self._set(ws, start["rowIndex"] + 1 + i, start["columnIndex"] + 1,
+                                  [_cell_value(c) for c in row["values"]])
+            self._b.version += 1
+            return {"replies": []}
+        return self._b.call("spreadsheets.batchUpdate", apply, request=body)
+
+class _Request:
+    def __init__(self, backend: FakeBackend, name: str, fn: Callable[[], Any]):
+        self._b, self._name, self._fn = backend, name, fn
+
+    def execute(self):
+        return self._b.call(self._name, self._fn)
+
+class FakeDrive:
+    def __init__(self, backend: FakeBackend):
+        self._b = backend
+
+    def files(self) -> "FakeDrive":
+        return self
+
+    def get(self, fileId: str, fields: str = "") -> _Request:
+        return _Request(self._b, "drive.files.get", lambda: {"version": str(self._b.version)})
+
+    def delete(self, fileId: str, **kwargs) -> _Request:
+        return _Request(self._b, "drive.files.delete", lambda: {})
+
+class FakeMessage:
+    # Cukup untuk handle_messages: pengirim, teks dan reply_text yang mencatat balasan
+    def __init__(self, user_id: int, text: str):
+        self.from_user = SimpleNamespace(id=user_id, username=f"user{user_id}")
+        self.chat = SimpleNamespace(id=user_id)
+        self.text = text
+        self.replies: List[str] = []
+
+    async def reply_text(self, text: str, **kwargs):
+        self.replies.append(text)
+
+def percentile(values: List[float], p: float) -> float:
+    if not values: return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(p / 100 * (len(s) - 1))))]
@@ -0,0 +1,79 @@
+# Benchmark normalisasi foto (PHOTO_MAX_DIM): ukuran file asli vs hasil, lama encode ulang,
+# dan perkiraan waktu upload ke Drive pada uplink tertentu. Pakai folder foto sendiri
+# (mis. hasil ekspor dari chat bot) atau, tanpa argumen, foto sintetis seukuran kamera HP.
+# Perlu Pillow.
+#
+#   python bench/photo_normalize.py ~/foto-gudang --max-dim 1600 --uplink-mbps 5
+import argparse, io, os, random, sys, time
+
+from fakes import load_inventaris, percentile
+
+try:
+    from PIL import Image
+except ImportError:
+    sys.exit("Pillow belum terpasang: pip install Pillow")
+
+EXTS = (".jpg", ".jpeg", ".png", ".webp", ".heic", ".gif")
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Byte & waktu upload foto, sebelum & sesudah normalisasi")
+    p.add_argument("corpus", nargs="?", help="folder berisi foto; kosong = foto sintetis")
+    p.add_argument("--count", type=int, default=12, help="jumlah foto sintetis")
+    p.add_argument("--max-dim", type=int, default=1600, help="PHOTO_MAX_DIM")
+    p.add_argument("--format", default="jpeg", choices=["jpeg", "webp"], help="PHOTO_FORMAT")
+    p.add_argument("--quality", type=int, default=82, help="PHOTO_QUALITY")
+    p.add_argument("--min-bytes", type=int, default=300000, help="PHOTO_NORMALIZE_MIN_BYTES")
+    p.add_argument("--uplink-mbps", type=float, default=5.0, help="kecepatan upload server bot")
+    return p.parse_args()
+
+def synthetic_photo(rnd: random.Random) -> bytes:
+    # Foto 12 MP berderau (derau sulit dikompresi, seperti foto rak/label asli) + EXIF
+    w, h = rnd.choice([(4032, 3024), (3024, 4032), (4000, 3000)])
+    base = Image.linear_gradient("L").resize((w, h)).convert("RGB")
+    noise = Image.effect_noise((w, h), rnd.uniform(20, 60)).convert("RGB")
+    im = Image.blend(base, noise, 0.5)
+    exif = Image.Exif(); exif[0x0112] = rnd.choice([1, 6]); exif[0x010F] = "bench"
+    out = io.BytesIO()
+    im.save(out, format="JPEG", quality=rnd.choice([90, 95]), exif=exif)
+    return out.getvalue()
+
+def load_corpus(args) -> list:
+    if not args.corpus:
+        rnd = random.Random(1)
+        return [(f"sintetis-{i + 1:02d}.jpg", synthetic_photo(rnd)) for i in range(args.count)]
+    files = sorted(f for f in os.listdir(args.corpus) if f.lower().endswith(EXTS))
+    if not files: sys.exit(f"Tidak ada foto di {args.corpus}")
+    out = []
+    for f in files:
+        with open(os.path.join(args.corpus, f), "rb") as fh: out.append((f, fh.read()))
+    return out
+
+def upload_ms(n: int, mbps: float) -> float:
+    return n * 8 / (mbps * 1e6) * 1000
+
+if __name__ == "__main__":
+    args = parse_args()
+    inv = load_inventaris(PHOTO_MAX_DIM=args.max_dim, PHOTO_FORMAT=args.format,
+                          PHOTO_QUALITY=args.quality, PHOTO_NORMALIZE_MIN_BYTES=args.min_bytes)
+    corpus = load_corpus(args)
+
+    print(f"{len(corpus)} foto, max {args.max_dim}px {args.format} q{args.quality}, "
+          f"ambang {args.min_bytes} byte, uplink {args.uplink_mbps:g} Mbps")
+    print(f"{'foto':<24}{'asli KB':>10}{'hasil KB':>10}{'encode ms':>11}{'upload ms':>11}{'jadi ms':>10}")
+    before, after, total_before, total_after, encode = 0, 0, [], [], []
+    for name, data in corpus:
+        # Sama dengan jalur upload bot: di bawah ambang foto dikirim apa adanya
+        out, ms = data, 0.0
+        if len(data) >= args.min_bytes:
+            t0 = time.perf_counter()
+            out, _ = inv.normalize_image(data)
+            ms = (time.perf_counter() - t0) * 1000
+        up0, up1 = upload_ms(len(data), args.uplink_mbps), upload_ms(len(out), args.uplink_mbps)
+        before += len(data); after += len(out)
+        total_before.append(up0); total_after.append(ms + up1); encode.append(ms)
+        print(f"{name[:23]:<24}{len(data) / 1024:>10.0f}{len(out) / 1024:>10.0f}{ms:>11.0f}{up0:>11.0f}{ms + up1:>10.0f}")
+
+    print(f"total byte {before / 1024:.0f} KB -> {after / 1024:.0f} KB ({after / before:.0%})")
+    print(f"per foto (encode + upload) p50 {percentile(total_before, 50):.0f} -> {percentile(total_after, 50):.0f} ms, "
+          f"p95 {percentile(total_before, 95):.0f} -> {percentile(total_after, 95):.0f} ms; "
+          f"encode p95 {percentile(encode, 95):.0f} ms")
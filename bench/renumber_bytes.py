@@ -0,0 +1,67 @@
+# Benchmark byte yang dikirim/diterima per penghapusan baris (hapus + penomoran ulang
+# kolom No) pada sheet 5.000 baris: cara lama (delete_rows, get_all_values, tulis ulang
+# A2:A{n}) dibandingkan jalur jurnal (satu batchUpdate, hanya baris yang nomornya berubah).
+#
+#   python bench/renumber_bytes.py --rows 5000 --deletes 50
+import argparse, random
+
+from fakes import FakeBackend, load_inventaris, percentile, sfp_rows
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Byte per hapus baris, sebelum & sesudah")
+    p.add_argument("--rows", type=int, default=5000)
+    p.add_argument("--deletes", type=int, default=50)
+    return p.parse_args()
+
+def renumber_legacy(ws):
+    # Salinan renumber_worksheet sebelum penomoran ulang parsial
+    vals = ws.get_all_values()
+    if len(vals) < 2 or vals[0][0] != "No": return
+    ws.update(values=[[i + 1] for i in range(len(vals) - 1)], range_name=f"A2:A{len(vals)}",
+              value_input_option="USER_ENTERED")
+
+def measure(backend, positions: list, delete_one) -> list:
+    per_delete = []
+    for row in positions:
+        backend.reset_counters()
+        delete_one(row)
+        per_delete.append((backend.bytes_up, backend.bytes_down, sum(backend.calls.values())))
+    return per_delete
+
+def report(label: str, per_delete: list):
+    total = [u + d for u, d, _ in per_delete]
+    up = sum(u for u, _, _ in per_delete) / len(per_delete)
+    down = sum(d for _, d, _ in per_delete) / len(per_delete)
+    calls = sum(c for _, _, c in per_delete) / len(per_delete)
+    print(f"{label:<14}{up:>12.0f}{down:>12.0f}{sum(total) / len(total):>12.0f}"
+          f"{percentile(total, 50):>12.0f}{max(total):>12.0f}{calls:>8.1f}")
+
+if __name__ == "__main__":
+    args = parse_args()
+    inv = load_inventaris()
+    rnd = random.Random(1)
+    positions = [rnd.randint(2, args.rows + 1 - i) for i in range(args.deletes)]
+
+    old = FakeBackend()
+    old_ws = old.add_sheet("SFP", [["No", "Detail Perangkat", "BW (SFP)", "Jarak (SFP)", "SN", "Keterangan", "Link Foto"]]
+                           + sfp_rows(args.rows))
+    def delete_legacy(row):
+        old_ws.delete_rows(row); renumber_legacy(old_ws)
+    before = measure(old, positions, delete_legacy)
+
+    new = FakeBackend()
+    new.add_all_sheets(inv, {"SFP": sfp_rows(args.rows)})
+    new.install(inv)
+    new_ws = inv.schema.worksheet("SFP")
+    inv.sheet_cache.snapshot(new_ws) # Cache sudah hangat seperti saat bot berjalan
+    def delete_journal(row):
+        inv.sheet_delete_row(new_ws, row, inv.sheet_cache.row(new_ws, row))
+        inv.renumber_worksheet(new_ws, row)
+        while inv.flush_journal(): pass
+    after = measure(new, positions, delete_journal)
+
+    assert old_ws.rows == new.spreadsheet.worksheet("SFP").rows, "hasil akhir sheet berbeda"
+    print(f"{args.rows} baris, {args.deletes} hapus di posisi acak (byte JSON per hapus)")
+    print(f"{'':<14}{'kirim':>12}{'terima':>12}{'rata2':>12}{'p50':>12}{'max':>12}{'API':>8}")
+    report("cara lama", before)
+    report("jurnal", after)
@@ -0,0 +1,71 @@
+# Benchmark pencarian SN: cara lama (ss.worksheet + row_values + find + row_values per
+# sheet) dibandingkan index SN global, baik dingin (cache kosong, sheet dimuat dulu)
+# maupun hangat (index sudah di memori).
+#
+#   python bench/sn_lookup.py --rows 5000 --latency 150
+import argparse, asyncio, random, time
+
+from fakes import FakeBackend, load_inventaris, percentile, sfp_rows
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Latensi pencarian SN dingin/hangat")
+    p.add_argument("--rows", type=int, default=5000, help="jumlah baris sheet SFP")
+    p.add_argument("--latency", type=float, default=150, help="latensi tiap panggilan Google (ms)")
+    p.add_argument("--lookups", type=int, default=20, help="jumlah SN yang dicari (cara lama & dingin)")
+    p.add_argument("--warm-lookups", type=int, default=100000)
+    return p.parse_args()
+
+def find_sn_legacy(inv, sn_to_find: str):
+    # Salinan find_sn_in_all_sheets sebelum index SN
+    for config in inv.DEVICE_CONFIG.values():
+        try:
+            ws = inv.ss.worksheet(config["worksheet_name"])
+            headers = ws.row_values(1)
+            if "SN" not in headers: continue
+            cell = ws.find(sn_to_find, in_column=headers.index("SN") + 1)
+            if cell:
+                return ws, cell.row, dict(zip(headers, ws.row_values(cell.row)))
+        except (KeyError, ValueError):
+            continue
+    return None, None, None
+
+def timed(fn, *args) -> float:
+    t0 = time.perf_counter(); fn(*args)
+    return (time.perf_counter() - t0) * 1000
+
+def report(label: str, xs, unit: str = "ms"):
+    print(f"{label:<34}{len(xs):>8}{percentile(xs, 50):>12.3f}{percentile(xs, 95):>12.3f}  {unit}")
+
+async def main():
+    args = parse_args()
+    inv = load_inventaris()
+    backend = FakeBackend(latency=args.latency / 1000)
+    backend.add_all_sheets(inv, {"SFP": sfp_rows(args.rows)})
+    backend.install(inv)
+    rnd = random.Random(1)
+    sns = [f"SN{rnd.randint(1, args.rows):06d}" for _ in range(args.lookups - 1)] + ["TIDAK-ADA"]
+
+    print(f"{args.rows} baris SFP, latensi {args.latency:.0f} ms per panggilan")
+    print(f"{'':<34}{'n':>8}{'p50':>12}{'p95':>12}")
+    backend.reset_counters()
+    report("cara lama", [timed(find_sn_legacy, inv, sn) for sn in sns])
+    print(f"{'':<34}panggilan API: {sum(backend.calls.values())} untuk {len(sns)} SN")
+
+    cold = []
+    for sn in sns:
+        inv.sheet_cache.invalidate()
+        cold.append(timed(inv.find_sn_in_all_sheets, sn))
+    report("index, dingin (muat per sheet)", cold)
+    inv.sheet_cache.invalidate()
+    t0 = time.perf_counter()
+    await inv.warm_sn_index()
+    print(f"{'warm-up startup (paralel)':<34}{'':>8}{(time.perf_counter() - t0) * 1000:>12.3f}{'':>12}  ms")
+
+    backend.reset_counters()
+    warm = [timed(inv.find_sn_in_all_sheets, f"SN{rnd.randint(1, args.rows):06d}") * 1000
+            for _ in range(args.warm_lookups)]
+    report("index, hangat", warm, "µs")
+    print(f"{'':<34}panggilan API: {sum(backend.calls.values())}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+# Stress test pengambilan barang: ratusan user menekan "Ambil" Patch Cord bersamaan
+# (permintaan total melebihi stok) sementara user lain menghapus baris pengisi di sheet
+# yang sama sehingga nomor baris terus bergeser. Selama berjalan stok di cache maupun di
+# server tidak boleh negatif; di akhir, stok awal - stok akhir harus sama dengan total
+# jumlah di sheet Pemakaian dan dengan total pengambilan yang dilaporkan berhasil.
+# Keluar dengan kode 1 bila ada yang dilanggar.
+#
+#   python bench/stress_take.py --users 300 --items 4 --stock 60
+import argparse, asyncio, random, sys
+from collections import Counter
+
+from fakes import FakeBackend, FakeMessage, load_inventaris
+
+CONNECTORS = ["SC-UPC", "SC-APC", "FC-UPC", "FC-APC", "LC-UPC", "LC-APC"]
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Ambil barang bersamaan, stok tidak boleh negatif")
+    p.add_argument("--users", type=int, default=300, help="jumlah user yang mengambil bersamaan")
+    p.add_argument("--items", type=int, default=4, help="jumlah item Patch Cord yang diperebutkan")
+    p.add_argument("--stock", type=int, default=60, help="stok awal tiap item")
+    p.add_argument("--max-qty", type=int, default=3, help="jumlah ambil per user acak 1..max-qty")
+    p.add_argument("--deletes", type=int, default=30, help="jumlah user yang menghapus baris pengisi")
+    p.add_argument("--latency", type=float, default=50, help="latensi tiap panggilan Google (ms)")
+    p.add_argument("--jitter", type=float, default=50, help="tambahan latensi acak (ms)")
+    p.add_argument("--workers", type=int, default=8, help="GOOGLE_MAX_WORKERS")
+    p.add_argument("--seed", type=int, default=1)
+    return p.parse_args()
+
+def pc_rows(inv, items: int, fillers: int, stock: int, rnd: random.Random) -> list:
+    # Item yang diperebutkan diselipkan di antara baris pengisi (Simplex, ukuran 10m ke atas)
+    keys = [("Duplex", CONNECTORS[i % 6], CONNECTORS[(i // 6) % 6], "1m") for i in range(items)]
+    fill = [("Simplex", CONNECTORS[i % 6], CONNECTORS[(i // 6) % 6], f"{10 + i // 36}m") for i in range(fillers)]
+    rows = [list(k) + [str(stock), "Rak uji", ""] for k in keys] + [list(k) + ["1", "pengisi", ""] for k in fill]
+    rnd.shuffle(rows)
+    return [[str(i + 1)] + r for i, r in enumerate(rows)], keys, fill
+
+def stock_by_key(inv, records: list) -> dict:
+    return {inv.pc_key(r.get("Detail Perangkat", ""), r.get("Konektor 1", ""), r.get("Konektor 2", ""),
+                       r.get("Ukuran (PC)", "")): int(str(r.get("Jumlah", "0")) or 0) for r in records}
+
+def server_records(backend) -> list:
+    with backend._lock:
+        rows = [list(r) for r in backend.spreadsheet._sheets["Patch Cord"].rows]
+    return [dict(zip(rows[0], r)) for r in rows[1:]]
+
+async def take(inv, user_id: int, key: tuple, qty: int, taken: Counter, rejected: Counter):
+    d, k1, k2, uk = key
+    inv.user_states[user_id].append("awaiting_consume_confirm_pc")
+    inv.user_data[user_id].update(
+        consume_ws_name="Patch Cord", consume_qty=qty, consume_detail=d, consume_k1=k1, consume_k2=k2,
+        consume_uk=uk, consume_ket_barang="Rak uji", consume_ket_pemakaian=f"stress {user_id}")
+    msg = FakeMessage(user_id, inv.LABEL_CONFIRM_TAKE)
+    await inv.handle_messages(None, msg)
+    if any(r.startswith("Barang berhasil diambil") for r in msg.replies): taken[key] += qty
+    elif any(r.startswith("Stok tidak cukup") for r in msg.replies): rejected[key] += 1
+    else: raise AssertionError(f"user {user_id}: balasan tak terduga {msg.replies}")
+
+async def delete(inv, user_id: int, key: tuple):
+    ws = inv.schema.worksheet("Patch Cord")
+    _, row_num, rec = await inv.gcall(inv.find_patchcord_row, *key)
+    inv.user_states[user_id].append("awaiting_delete_confirmation")
+    inv.user_data[user_id].update(inv.item_ref(ws, row_num, rec))
+    msg = FakeMessage(user_id, inv.LABEL_CONFIRM_DELETE)
+    await inv.handle_messages(None, msg)
+    if "Data dan foto berhasil dihapus." not in msg.replies:
+        raise AssertionError(f"user {user_id}: hapus gagal {msg.replies}")
+
+async def watch(inv, backend, lowest: dict):
+    # Catat stok terendah yang pernah terlihat di cache bot dan di server
+    while True:
+        peek = inv.sheet_cache.peek("Patch Cord")
+        if peek: lowest["cache"] = min([lowest["cache"]] + list(stock_by_key(inv, peek[2]).values()))
+        lowest["server"] = min([lowest["server"]] + list(stock_by_key(inv, server_records(backend)).values()))
+        await asyncio.sleep(0.005)
+
+async def main() -> int:
+    args = parse_args()
+    rnd = random.Random(args.seed)
+    inv = load_inventaris(GOOGLE_MAX_WORKERS=args.workers)
+    backend = FakeBackend(latency=args.latency / 1000, jitter=args.jitter / 1000, seed=args.seed)
+    rows, keys, fillers = pc_rows(inv, args.items, args.deletes, args.stock, rnd)
+    backend.add_all_sheets(inv, {"Patch Cord": rows})
+    backend.install(inv)
+
+    taken, rejected = Counter(), Counter()
+    lowest = {"cache": args.stock, "server": args.stock}
+    jobs = [take(inv, 1000 + u, rnd.choice(keys), rnd.randint(1, args.max_qty), taken, rejected)
+            for u in range(args.users)]
+    jobs += [delete(inv, 5000 + u, key) for u, key in enumerate(fillers)]
+    rnd.shuffle(jobs)
+
+    worker = asyncio.create_task(inv.journal_worker())
+    watcher = asyncio.create_task(watch(inv, backend, lowest))
+    await asyncio.gather(*jobs)
+    while await asyncio.to_thread(inv.flush_journal, wait=inv.GOOGLE_CALL_TIMEOUT): pass
+    await asyncio.sleep(0.01)
+    worker.cancel(); watcher.cancel()
+
+    final = server_records(backend)
+    stock = stock_by_key(inv, final)
+    with backend._lock:
+        pemakaian = backend.spreadsheet._sheets["Pemakaian"].rows[1:]
+    logged = Counter()
+    for r in pemakaian:
+        logged[next(k for k in keys if inv.join_detail_pc_no_ket(*k) == r[4])] += int(r[5])
+
+    errors = []
+    if lowest["cache"] < 0 or lowest["server"] < 0:
+        errors.append(f"stok negatif terlihat: cache {lowest['cache']}, server {lowest['server']}")
+    if any(inv.pc_key(*k) in stock for k in fillers) or len(final) != args.items:
+        errors.append(f"baris pengisi tersisa / item hilang: {len(final)} baris (harus {args.items})")
+    if [r["No"] for r in final] != [str(i + 1) for i in range(len(final))]:
+        errors.append("kolom No tidak berurutan setelah penghapusan")
+
+    print(f"{args.users} user ambil, {args.deletes} user hapus, {args.items} item x stok {args.stock}, "
+          f"latensi {args.latency:.0f}+{args.jitter:.0f} ms")
+    print(f"{'item':<32}{'akhir':>7}{'diambil':>9}{'pemakaian':>11}{'ditolak':>9}")
+    for k in keys:
+        left = stock.get(inv.pc_key(*k))
+        print(f"{inv.join_detail_pc_no_ket(*k):<32}{left!s:>7}{taken[k]:>9}{logged[k]:>11}{rejected[k]:>9}")
+        if left is None or args.stock - left != taken[k] or taken[k] != logged[k]:
+            errors.append(f"{k}: stok {args.stock} -> {left}, berhasil {taken[k]}, pemakaian {logged[k]}")
+    print(f"stok terendah terlihat: cache {lowest['cache']}, server {lowest['server']}; "
+          f"panggilan Google: {dict(sorted(backend.calls.items()))}")
+    for e in errors: print(f"GAGAL: {e}")
+    print("OK" if not errors else f"{len(errors)} pelanggaran")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,14 +1,23 @@
-import os, re, mimetypes, pickle, logging, gspread
+import time
+_BOOT_T0 = time.perf_counter() # Titik nol pengukuran waktu startup (termasuk impor modul)
+import os, re, io, json, heapq, sqlite3, mimetypes, pickle, logging, gspread, asyncio, functools, threading, contextlib, secrets
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeout
 from datetime import datetime
-from collections import defaultdict
-from typing import Optional, Dict, Any, List, Tuple
-from google.auth.transport.requests import Request
+from collections import defaultdict, OrderedDict, deque
+from typing import Optional, Dict, Any, List, Tuple, Callable
+from bisect import insort, bisect_left, bisect_right
+from google.auth.transport.requests import Request, AuthorizedSession
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaInMemoryUpload
+from gspread.utils import numericise_all, rowcol_to_a1
 from dotenv import load_dotenv
 
+try: # Opsional: hanya dipakai bila normalisasi foto diaktifkan (PHOTO_MAX_DIM > 0)
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -24,6 +33,54 @@ GOOGLE_DRIVE_PARENT_FOLDER_ID = os.getenv("GOOGLE_DRIVE_PARENT_FOLDER_ID")
 CREDENTIALS_FILE = os.getenv("CREDENTIALS_FILE", "credentials.json")
 TOKEN_FILE = os.getenv("TOKEN_FILE", "token.pickle")
 
+# Batas thread & timeout untuk semua panggilan Google API (Sheets/Drive)
+GOOGLE_MAX_WORKERS = int(os.getenv("GOOGLE_MAX_WORKERS", "8"))
+GOOGLE_CALL_TIMEOUT = float(os.getenv("GOOGLE_CALL_TIMEOUT", "30"))
+GOOGLE_SLOW_CALL_LOG = float(os.getenv("GOOGLE_SLOW_CALL_LOG", "2"))
+# Koneksi Google dibuat di latar belakang setelah bot Telegram jalan
+GOOGLE_CONNECT_MAX_BACKOFF = float(os.getenv("GOOGLE_CONNECT_MAX_BACKOFF", "60"))
+GOOGLE_READY_TIMEOUT = float(os.getenv("GOOGLE_READY_TIMEOUT", "20"))
+# Foto hasil pre-upload yang tidak jadi disimpan dihapus dari Drive setelah ini (detik)
+PHOTO_PREUPLOAD_TTL = float(os.getenv("PHOTO_PREUPLOAD_TTL", "1800"))
+# Normalisasi foto sebelum upload (perlu Pillow): sisi terpanjang maks. PHOTO_MAX_DIM px,
+# EXIF dibuang, encode ulang ke PHOTO_FORMAT (jpeg/webp). 0 = nonaktif.
+PHOTO_MAX_DIM = int(os.getenv("PHOTO_MAX_DIM", "0"))
+PHOTO_FORMAT = os.getenv("PHOTO_FORMAT", "jpeg").lower()
+PHOTO_QUALITY = int(os.getenv("PHOTO_QUALITY", "82"))
+PHOTO_NORMALIZE_MIN_BYTES = int(os.getenv("PHOTO_NORMALIZE_MIN_BYTES", "300000"))
+
+# Tabel token callback_data (jumlah maksimum token & umur token dalam detik)
+CALLBACK_TOKEN_MAX = int(os.getenv("CALLBACK_TOKEN_MAX", "20000"))
+CALLBACK_TOKEN_TTL = float(os.getenv("CALLBACK_TOKEN_TTL", "86400"))
+
+# Sesi user: umur sesi tanpa aktivitas (detik), jumlah sesi di memori, kedalaman
+# tumpukan state, dan file SQLite opsional agar sesi bertahan saat restart
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_MAX_STATES = int(os.getenv("SESSION_MAX_STATES", "20"))
+SESSION_FILE = os.getenv("SESSION_FILE", "")
+
+# Mirror SQLite lokal untuk isi sheet (file & interval sinkronisasi dalam detik)
+MIRROR_FILE = os.getenv("MIRROR_FILE", "mirror.sqlite3")
+MIRROR_SYNC_INTERVAL = float(os.getenv("MIRROR_SYNC_INTERVAL", "120"))
+
+# Umur maksimum snapshot worksheet di cache (detik)
+SHEET_CACHE_TTL = float(os.getenv("SHEET_CACHE_TTL", "60"))
+# TTL per sheet, menimpa SHEET_CACHE_TTL (format: "SFP=30,Patch Cord=120")
+SHEET_CACHE_TTL_PER_SHEET = {k.strip(): float(v) for k, v in
+                             (p.split("=", 1) for p in os.getenv("SHEET_CACHE_TTL_PER_SHEET", "").split(",") if "=" in p)}
+# Interval cek perubahan spreadsheet lewat versi file Drive (detik, 0 = nonaktif)
+SHEET_CHANGE_POLL_INTERVAL = float(os.getenv("SHEET_CHANGE_POLL_INTERVAL", "30"))
+# Kolom identitas yang tidak boleh diubah jadi angka (mis. SN "00123")
+TEXT_COLUMNS = {"SN"}
+
+# Jurnal tulis lokal (write-ahead) & worker flush ke Sheets
+JOURNAL_FILE = os.getenv("JOURNAL_FILE", "journal.sqlite3")
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", "1"))
+JOURNAL_BATCH_SIZE = int(os.getenv("JOURNAL_BATCH_SIZE", "50"))
+JOURNAL_MAX_BACKOFF = float(os.getenv("JOURNAL_MAX_BACKOFF", "60"))
+JOURNAL_RETENTION_DAYS = float(os.getenv("JOURNAL_RETENTION_DAYS", "7"))
+
 # =========================
 # "BUKU RESEP" PERANGKAT
 # =========================
@@ -120,27 +177,1094 @@ def get_oauth2_credentials():
 # =========================
 # INISIALISASI
 # =========================
-try:
+# Klien Google tidak lagi dibuat saat impor: bot Telegram langsung jalan, lalu
+# google_startup() menghubungkan klien di latar belakang (dengan backoff).
+# Semua panggilan lewat gcall() menunggu google_ready sebelum dijalankan.
+creds: Optional[Credentials] = None
+gspread_client: Optional[gspread.Client] = None
+drive_service = None
+ss: Optional[gspread.Spreadsheet] = None
+google_ready = asyncio.Event()
+
+def connect_google():
+    global creds, gspread_client, drive_service, ss
     creds = get_oauth2_credentials()
     gspread_client = gspread.authorize(creds)
     drive_service = build("drive", "v3", credentials=creds)
     ss = gspread_client.open_by_key(SPREADSHEET_ID)
     logger.info("Berhasil terhubung ke Google Sheets & Drive.")
-except Exception:
-    logger.exception("Gagal terhubung ke Google API"); raise
+
+_boot_last = _BOOT_T0
+
+def boot_mark(phase: str):
+    # Log durasi tiap fase startup, mirip ringkasan `python -X importtime`
+    global _boot_last
+    now = time.perf_counter()
+    logger.info(f"[startup] {phase}: {now - _boot_last:.2f}s (total {now - _BOOT_T0:.2f}s)")
+    _boot_last = now
+
+# =========================
+# EXECUTOR GOOGLE API
+# =========================
+# Semua I/O gspread/Drive bersifat blocking; jalankan di thread pool terpisah
+# supaya satu round-trip lambat tidak membekukan handler user lain.
+google_executor = ThreadPoolExecutor(max_workers=GOOGLE_MAX_WORKERS, thread_name_prefix="google")
+# Muat ulang snapshot di latar (stale-while-revalidate) punya pool sendiri: pemanggil
+# yang menunggu muatan itu memegang thread google_executor, jadi muatan tsb tidak boleh
+# ikut antre di belakang mereka.
+reload_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sheet-reload")
+
+async def gcall(fn, *args, timeout: Optional[float] = None, **kwargs):
+    if not google_ready.is_set():
+        try:
+            await asyncio.wait_for(google_ready.wait(), GOOGLE_READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RuntimeError("Koneksi Google API belum siap") from None
+    loop = asyncio.get_running_loop()
+    t0 = time.perf_counter()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(google_executor, functools.partial(fn, *args, **kwargs)),
+            timeout or GOOGLE_CALL_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        logger.error(f"Timeout panggilan Google: {getattr(fn, '__qualname__', fn)} (> {timeout or GOOGLE_CALL_TIMEOUT}s)")
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        if elapsed >= GOOGLE_SLOW_CALL_LOG:
+            logger.warning(f"Panggilan Google lambat: {getattr(fn, '__qualname__', fn)} {elapsed:.2f}s")
+
+# =========================
+# LOCK PER ITEM
+# =========================
+# Baca-cek-tulis stok untuk item yang sama (key komposit / SN) dijalankan bergiliran,
+# item berbeda tetap bisa diproses bersamaan. Lock dibuang begitu tidak ada yang memakai.
+class ItemLocks:
+    def __init__(self):
+        self._locks: Dict[tuple, asyncio.Lock] = {}
+        self._users: Dict[tuple, int] = defaultdict(int)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, *key):
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._users[key] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]; self._locks.pop(key, None)
+
+item_locks = ItemLocks()
+
+# =========================
+# CACHE SNAPSHOT WORKSHEET
+# =========================
+# Satu snapshot (header + records) per worksheet, berlaku selama SHEET_CACHE_TTL
+# (atau TTL khusus sheet tsb). Setiap penulisan dari bot memperbarui snapshot di
+# tempat atau membuangnya, jadi pencarian berulang dalam satu interaksi tidak
+# mengunduh ulang seluruh sheet. Pembaca yang boleh basi (rekap & daftar pilihan,
+# stale_ok=True) langsung mendapat snapshot terakhir sementara pemuatan ulang
+# berjalan di latar; jalur tulis selalu memakai snapshot yang masih berlaku.
+# Index hash (key -> daftar nomor baris) dan agregat rekap (grup -> item -> jumlah)
+# dibangun sekali per snapshot lalu dirawat secara inkremental oleh append/update/delete.
+class SheetCache:
+    def __init__(self, ttl: float, ttl_per_sheet: Optional[Dict[str, float]] = None):
+        self.ttl = ttl
+        self.ttl_per_sheet = ttl_per_sheet or {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_hits = 0
+        self._lock = threading.RLock()
+        self._snapshots: Dict[str, Dict[str, Any]] = {}
+        self._index_fns: Dict[str, Dict[str, Callable[[Dict[str, Any]], Optional[tuple]]]] = {}
+        self._agg_fns: Dict[str, Dict[str, Callable[[Dict[str, Any]], Optional[Tuple[tuple, Any, int]]]]] = {}
+        self._pins: Dict[str, int] = defaultdict(int)
+        self._inflight: Dict[str, Future] = {} # Satu unduhan per sheet; pemanggil lain menunggu hasilnya
+        self._versions: Dict[str, int] = defaultdict(int) # Naik setiap snapshot sheet berubah
+        self._settled: Dict[str, int] = defaultdict(int) # Naik setiap entri jurnal sheet selesai dikirim
+        self.on_reload: Optional[Callable[[str, List[str]], None]] = None
+
+    @staticmethod
+    def _to_record(headers: List[str], row: List[Any]) -> Dict[str, Any]:
+        row = [str(v) for v in row] + [""] * (len(headers) - len(row))
+        nums = numericise_all(row)
+        return {h: (row[i] if h in TEXT_COLUMNS else nums[i]) for i, h in enumerate(headers)}
+
+    @staticmethod
+    def _build_index(key_fn, records: List[Dict[str, Any]]) -> Dict[tuple, List[int]]:
+        idx: Dict[tuple, List[int]] = {}
+        for i, r in enumerate(records):
+            k = key_fn(r)
+            if k is not None: idx.setdefault(k, []).append(i + 2)
+        return idx
+
+    # Agregat: fn(record) -> (grup, item, jumlah) atau None. Per item disimpan
+    # (total jumlah, jumlah baris); item hilang saat baris terakhirnya dihapus.
+    @staticmethod
+    def _agg_apply(agg: Dict[tuple, Dict[Any, Tuple[int, int]]], contrib: Optional[Tuple[tuple, Any, int]], sign: int):
+        if contrib is None: return
+        group, item, amount = contrib
+        items = agg.setdefault(group, {})
+        total, rows = items.get(item, (0, 0))
+        if rows + sign > 0: items[item] = (total + sign * amount, rows + sign)
+        else:
+            items.pop(item, None)
+            if not items: del agg[group]
+
+    @classmethod
+    def _build_aggregate(cls, agg_fn, records: List[Dict[str, Any]]) -> Dict[tuple, Dict[Any, Tuple[int, int]]]:
+        agg: Dict[tuple, Dict[Any, Tuple[int, int]]] = {}
+        for r in records: cls._agg_apply(agg, agg_fn(r), 1)
+        return agg
+
+    def register_index(self, title: str, name: str, key_fn: Callable[[Dict[str, Any]], Optional[tuple]]):
+        with self._lock:
+            self._index_fns.setdefault(title, {})[name] = key_fn
+            snap = self._snapshots.get(title)
+            if snap: snap["indexes"][name] = self._build_index(key_fn, snap["records"])
+
+    def register_aggregate(self, title: str, name: str, agg_fn: Callable[[Dict[str, Any]], Optional[Tuple[tuple, Any, int]]]):
+        with self._lock:
+            self._agg_fns.setdefault(title, {})[name] = agg_fn
+            snap = self._snapshots.get(title)
+            if snap: snap["aggregates"][name] = self._build_aggregate(agg_fn, snap["records"])
+
+    def _index_add(self, title: str, snap: Dict[str, Any], row_num: int, rec: Dict[str, Any]):
+        for name, key_fn in self._index_fns.get(title, {}).items():
+            k = key_fn(rec)
+            if k is not None: insort(snap["indexes"][name].setdefault(k, []), row_num)
+        for name, agg_fn in self._agg_fns.get(title, {}).items():
+            self._agg_apply(snap["aggregates"][name], agg_fn(rec), 1)
+
+    def _index_remove(self, title: str, snap: Dict[str, Any], row_num: int, rec: Dict[str, Any]):
+        for name, key_fn in self._index_fns.get(title, {}).items():
+            k = key_fn(rec); rows = snap["indexes"][name].get(k)
+            if rows and row_num in rows:
+                rows.remove(row_num)
+                if not rows: del snap["indexes"][name][k]
+        for name, agg_fn in self._agg_fns.get(title, {}).items():
+            self._agg_apply(snap["aggregates"][name], agg_fn(rec), -1)
+
+    def ttl_for(self, title: str) -> float:
+        return self.ttl_per_sheet.get(title, self.ttl)
+
+    def _fresh(self, title: str, snap: Dict[str, Any]) -> bool:
+        return self._pins[title] > 0 or time.monotonic() - snap["loaded_at"] < self.ttl_for(title)
+
+    def _load(self, ws: gspread.Worksheet, flight: Future) -> Dict[str, Any]:
+        try:
+            headers, records = self._parse(ws.get_all_values())
+            snap = self._install(ws.title, headers, records, time.monotonic())
+            if self.on_reload: self.on_reload(ws.title, headers)
+            flight.set_result(snap)
+            return snap
+        except BaseException as e:
+            flight.set_exception(e); raise
+        finally:
+            with self._lock: self._inflight.pop(ws.title, None)
+
+    def _load_in_background(self, ws: gspread.Worksheet, flight: Future):
+        try:
+            self._load(ws, flight)
+        except Exception as e:
+            logger.warning(f"Muat ulang latar sheet '{ws.title}' gagal: {e}")
+
+    def snapshot(self, ws: gspread.Worksheet, stale_ok: bool = False) -> Dict[str, Any]:
+        with self._lock:
+            snap = self._snapshots.get(ws.title)
+            if snap and self._fresh(ws.title, snap):
+                self.hits += 1
+                return snap
+            if snap and stale_ok:
+                self.stale_hits += 1
+                if ws.title not in self._inflight:
+                    self.misses += 1
+                    flight = self._inflight[ws.title] = Future()
+                    reload_executor.submit(self._load_in_background, ws, flight)
+                return snap
+            flight = self._inflight.get(ws.title)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._inflight[ws.title] = Future()
+            else:
+                self.coalesced += 1
+        if leader: return self._load(ws, flight)
+        try:
+            return flight.result(timeout=GOOGLE_CALL_TIMEOUT)
+        except FutureTimeout:
+            # Muatan yang macet jangan menahan pemanggil berikutnya: lepas agar dimuat ulang
+            with self._lock:
+                if self._inflight.get(ws.title) is flight: self._inflight.pop(ws.title)
+            raise TimeoutError(f"Menunggu muatan sheet '{ws.title}' melebihi {GOOGLE_CALL_TIMEOUT:.0f}s") from None
+
+    @classmethod
+    def _parse(cls, vals: List[List[Any]]) -> Tuple[List[str], List[Dict[str, Any]]]:
+        headers = list(vals[0]) if vals else []
+        return headers, [cls._to_record(headers, r) for r in vals[1:]]
+
+    def _install(self, title: str, headers: List[str], records: List[Dict[str, Any]], loaded_at: float,
+                 confirmed_at: Optional[float] = None) -> Dict[str, Any]:
+        with self._lock:
+            snap = {
+                "headers": headers,
+                "records": records,
+                "indexes": {n: self._build_index(fn, records) for n, fn in self._index_fns.get(title, {}).items()},
+                "aggregates": {n: self._build_aggregate(fn, records) for n, fn in self._agg_fns.get(title, {}).items()},
+                "loaded_at": loaded_at,
+                "confirmed_at": confirmed_at or time.time(), # Waktu (jam dinding) isi terakhir dipastikan sama dengan server
+            }
+            self._snapshots[title] = snap
+            self._versions[title] += 1
+            return snap
+
+    def find(self, ws: gspread.Worksheet, name: str, key: tuple) -> Tuple[Optional[int], Optional[Dict[str, Any]]]:
+        snap = self.snapshot(ws)
+        with self._lock:
+            rows = snap["indexes"].get(name, {}).get(key)
+            if not rows: return None, None
+            return rows[0], snap["records"][rows[0] - 2]
+
+    def aggregate(self, ws: gspread.Worksheet, name: str, stale_ok: bool = False) -> Dict[tuple, Dict[Any, int]]:
+        snap = self.snapshot(ws, stale_ok)
+        with self._lock:
+            return {g: {item: total for item, (total, _) in items.items()}
+                    for g, items in snap["aggregates"].get(name, {}).items()}
+
+    def records(self, ws: gspread.Worksheet, stale_ok: bool = False) -> List[Dict[str, Any]]:
+        snap = self.snapshot(ws, stale_ok)
+        with self._lock:
+            return list(snap["records"])
+
+    def headers(self, ws: gspread.Worksheet) -> List[str]:
+        return list(self.snapshot(ws)["headers"])
+
+    def version(self, ws: gspread.Worksheet, stale_ok: bool = False) -> int:
+        self.snapshot(ws, stale_ok)
+        with self._lock: return self._versions[ws.title]
+
+    def age(self, title: str) -> Optional[float]:
+        # Umur data (detik) sejak terakhir dipastikan sama dengan isi server
+        with self._lock:
+            snap = self._snapshots.get(title)
+            return time.time() - snap["confirmed_at"] if snap else None
+
+    def peek(self, title: str) -> Optional[Tuple[int, List[str], List[Dict[str, Any]], bool]]:
+        # Snapshot yang ada di memori tanpa pernah memanggil API: (versi, headers, records, kedaluwarsa?)
+        with self._lock:
+            snap = self._snapshots.get(title)
+            if not snap: return None
+            expired = not self._fresh(title, snap)
+            return self._versions[title], list(snap["headers"]), list(snap["records"]), expired
+
+    def seed(self, title: str, headers: List[str], records: List[Dict[str, Any]], synced_at: float) -> Optional[int]:
+        # Pasang snapshot dari mirror lokal; ditandai kedaluwarsa agar pembacaan lewat
+        # snapshot() tetap memuat ulang dari server, sementara peek() bisa langsung memakainya
+        with self._lock:
+            if title in self._snapshots: return None
+            self._install(title, headers, records, float("-inf"), synced_at)
+            return self._versions[title]
+
+    def revalidation_token(self, title: str) -> Tuple[int, int]:
+        # Isi server yang dibaca sebelum sebuah flush jurnal selesai tidak boleh menimpa
+        # snapshot sesudahnya (pin sudah dilepas, tapi isi yang dibaca belum memuat flush itu)
+        with self._lock: return self._versions[title], self._settled[title]
+
+    def cached_titles(self) -> List[str]:
+        with self._lock: return list(self._snapshots)
+
+    def touch(self, titles: List[str]):
+        # Isi server terkonfirmasi belum berubah: perpanjang masa berlaku snapshot
+        now, wall = time.monotonic(), time.time()
+        with self._lock:
+            for t in titles:
+                snap = self._snapshots.get(t)
+                if snap: snap["loaded_at"], snap["confirmed_at"] = now, wall
+
+    def expire(self, titles: List[str]):
+        # Paksa snapshot dimuat ulang pada pembacaan berikutnya (kecuali masih di-pin jurnal)
+        with self._lock:
+            for t in titles:
+                snap = self._snapshots.get(t)
+                if snap: snap["loaded_at"] = float("-inf")
+
+    def revalidate(self, title: str, vals: List[List[Any]], token: Tuple[int, int]) -> bool:
+        # Bandingkan isi server dengan snapshot; ganti hanya bila berbeda. Dilewati bila
+        # snapshot berubah / ada flush jurnal sejak vals dibaca, atau masih ada mutasi tertunda.
+        headers, records = self._parse(vals)
+        with self._lock:
+            snap = self._snapshots.get(title)
+            if self._pins[title] > 0 or (self._versions[title], self._settled[title]) != token: return False
+            if snap and snap["headers"] == headers and snap["records"] == records:
+                snap["loaded_at"], snap["confirmed_at"] = time.monotonic(), time.time(); return False
+            self._install(title, headers, records, time.monotonic())
+        if self.on_reload: self.on_reload(title, headers)
+        return True
+
+    def row(self, ws: gspread.Worksheet, row_num: int) -> Optional[Dict[str, Any]]:
+        snap = self.snapshot(ws)
+        with self._lock:
+            i = row_num - 2
+            return snap["records"][i] if 0 <= i < len(snap["records"]) else None
+
+    def record_key(self, title: str, rec: Dict[str, Any]) -> Optional[List[Any]]:
+        # Key utama sebuah baris (index pertama yang terdaftar), dipakai jurnal saat replay
+        for name, key_fn in self._index_fns.get(title, {}).items():
+            k = key_fn(rec)
+            if k is not None: return [name, k]
+        return None
+
+    def row_key(self, ws: gspread.Worksheet, row_num: int) -> Optional[List[Any]]:
+        rec = self.row(ws, row_num)
+        return self.record_key(ws.title, rec) if rec else None
+
+    # Snapshot yang masih punya mutasi tertunda di jurnal tidak boleh di-reload
+    # dari server (isinya belum memuat mutasi tersebut).
+    def pin(self, title: str):
+        with self._lock: self._pins[title] += 1
+
+    def unpin(self, title: str):
+        with self._lock:
+            self._pins[title] = max(0, self._pins[title] - 1)
+            self._settled[title] += 1
+
+    def duplicates(self, name: str) -> Dict[tuple, List[Tuple[str, int]]]:
+        seen: Dict[tuple, List[Tuple[str, int]]] = defaultdict(list)
+        with self._lock:
+            for title, snap in self._snapshots.items():
+                for k, rows in snap["indexes"].get(name, {}).items():
+                    seen[k].extend((title, r) for r in rows)
+        return {k: locs for k, locs in seen.items() if len(locs) > 1}
+
+    def invalidate(self, title: Optional[str] = None):
+        with self._lock:
+            for t in (list(self._snapshots) if title is None else [title]):
+                if self._snapshots.pop(t, None): self._versions[t] += 1
+
+    def on_append(self, title: str, values: List[Any]):
+        with self._lock:
+            snap = self._snapshots.get(title)
+            if not snap: return
+            rec = self._to_record(snap["headers"], values)
+            snap["records"].append(rec)
+            self._index_add(title, snap, len(snap["records"]) + 1, rec)
+            self._versions[title] += 1
+
+    def on_update_cell(self, title: str, row_num: int, col: int, value: Any):
+        with self._lock:
+            snap = self._snapshots.get(title)
+            if not snap: return
+            i = row_num - 2
+            if not (0 <= i < len(snap["records"])) or not (1 <= col <= len(snap["headers"])):
+                self._snapshots.pop(title, None); self._versions[title] += 1; return
+            old = snap["records"][i]
+            rec = dict(old)
+            header = snap["headers"][col - 1]
+            rec[header] = str(value) if header in TEXT_COLUMNS else numericise_all([str(value)])[0]
+            snap["records"][i] = rec
+            self._index_remove(title, snap, row_num, old)
+            self._index_add(title, snap, row_num, rec)
+            self._versions[title] += 1
+
+    def on_insert(self, title: str, row_num: int, values: List[Any]):
+        with self._lock:
+            snap = self._snapshots.get(title)
+            if not snap: return
+            i = row_num - 2
+            if not (0 <= i <= len(snap["records"])):
+                self._snapshots.pop(title, None); self._versions[title] += 1; return
+            for idx in snap["indexes"].values():
+                for rows in idx.values():
+                    rows[:] = [r + 1 if r >= row_num else r for r in rows]
+            rec = self._to_record(snap["headers"], values)
+            snap["records"].insert(i, rec)
+            self._index_add(title, snap, row_num, rec)
+            self._versions[title] += 1
+
+    def on_delete_row(self, title: str, row_num: int):
+        with self._lock:
+            snap = self._snapshots.get(title)
+            if not snap: return
+            i = row_num - 2
+            if not (0 <= i < len(snap["records"])):
+                self._snapshots.pop(title, None); self._versions[title] += 1; return
+            self._index_remove(title, snap, row_num, snap["records"].pop(i))
+            for idx in snap["indexes"].values():
+                for rows in idx.values():
+                    rows[:] = [r - 1 if r > row_num else r for r in rows]
+            self._versions[title] += 1
+
+    def on_renumber(self, title: str, row_num: int, values: List[Any]):
+        # Hanya rentang yang ditulis op: penomoran ulang penghapusan lain yang belum
+        # dijurnal harus tetap terlihat "berubah" oleh _renumber_op
+        with self._lock:
+            snap = self._snapshots.get(title)
+            if not snap or "No" not in snap["headers"]: return
+            records = snap["records"]
+            for i, v in enumerate(values, start=row_num - 2):
+                if 0 <= i < len(records): records[i] = dict(records[i], No=v)
+            self._versions[title] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "stale_hits": self.stale_hits,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+                "sheets": {t: len(s["records"]) for t, s in self._snapshots.items()},
+            }
+
+sheet_cache = SheetCache(SHEET_CACHE_TTL, SHEET_CACHE_TTL_PER_SHEET)
+
+# =========================
+# MIRROR SQLITE LOKAL
+# =========================
+# Salinan isi sheet di disk. Sheet perangkat disimpan utuh dari snapshot SheetCache
+# (oleh mirror_sync) dan dipakai untuk mengisi cache saat start, sebelum Google siap.
+# Sheet Log/Pemakaian hanya bertambah, jadi baris yang pernah dibaca disimpan per
+# nomor baris dan halaman log berikutnya dibaca dari sini tanpa memanggil API.
+class SheetMirror:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sheets ("
+            " sheet TEXT PRIMARY KEY,"
+            " headers TEXT NOT NULL,"
+            " synced_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            " sheet TEXT NOT NULL,"
+            " row_num INTEGER NOT NULL,"
+            " data TEXT NOT NULL,"
+            " PRIMARY KEY (sheet, row_num)) WITHOUT ROWID"
+        )
+        self.saved_versions: Dict[str, int] = {}
+
+    def save_sheet(self, title: str, headers: List[str], records: List[Dict[str, Any]]):
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute("DELETE FROM rows WHERE sheet = ?", (title,))
+                self._db.executemany("INSERT INTO rows (sheet, row_num, data) VALUES (?, ?, ?)",
+                                     ((title, i + 2, json.dumps(r)) for i, r in enumerate(records)))
+                self._db.execute("INSERT OR REPLACE INTO sheets (sheet, headers, synced_at) VALUES (?, ?, ?)",
+                                 (title, json.dumps(headers), time.time()))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK"); raise
+
+    def load_sheet(self, title: str) -> Optional[Tuple[List[str], List[Dict[str, Any]], float]]:
+        with self._lock:
+            meta = self._db.execute("SELECT headers, synced_at FROM sheets WHERE sheet = ?", (title,)).fetchone()
+            if not meta: return None
+            rows = self._db.execute("SELECT data FROM rows WHERE sheet = ? ORDER BY row_num", (title,)).fetchall()
+        return json.loads(meta[0]), [json.loads(r[0]) for r in rows], meta[1]
+
+    def rows_range(self, title: str, start: int, end: int) -> Optional[List[List[str]]]:
+        # Baris start..end (inklusif) bila semuanya sudah ada di mirror, selain itu None
+        with self._lock:
+            rows = self._db.execute("SELECT data FROM rows WHERE sheet = ? AND row_num BETWEEN ? AND ? ORDER BY row_num",
+                                    (title, start, end)).fetchall()
+        return [json.loads(r[0]) for r in rows] if len(rows) == end - start + 1 else None
+
+    def put_rows(self, title: str, start: int, rows: List[List[str]]):
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO rows (sheet, row_num, data) VALUES (?, ?, ?)",
+                                 ((title, start + i, json.dumps(r)) for i, r in enumerate(rows)))
+
+mirror = SheetMirror(MIRROR_FILE)
+
+def seed_cache_from_mirror() -> int:
+    seeded = 0
+    for cfg in DEVICE_CONFIG.values():
+        title = cfg["worksheet_name"]
+        saved = mirror.load_sheet(title)
+        if not saved: continue
+        headers, records, synced_at = saved
+        version = sheet_cache.seed(title, headers, records, synced_at)
+        if version: mirror.saved_versions[title] = version; seeded += 1
+        logger.info(f"Mirror: {title} ({len(records)} baris, sinkron {datetime.fromtimestamp(synced_at):%Y-%m-%d %H:%M}).")
+    return seeded
+
+def persist_mirror() -> int:
+    saved = 0
+    for cfg in DEVICE_CONFIG.values():
+        title = cfg["worksheet_name"]
+        peek = sheet_cache.peek(title)
+        if not peek or mirror.saved_versions.get(title) == peek[0]: continue
+        version, headers, records, _ = peek
+        mirror.save_sheet(title, headers, records)
+        mirror.saved_versions[title] = version; saved += 1
+    return saved
+
+# =========================
+# REGISTRY SCHEMA SHEET
+# =========================
+# Handle Worksheet + peta header->kolom untuk semua sheet yang dipakai bot, dimuat sekali
+# (satu metadata fetch + satu values.batchGet) supaya aksi user tidak perlu ss.worksheet()
+# dan row_values(1) lagi. Peta kolom diperbarui saat snapshot cache memuat header yang
+# berbeda (versi sheet berubah) atau saat kolom yang dicari tidak ada (header mismatch).
+SCHEMA_SHEETS = [cfg["worksheet_name"] for cfg in DEVICE_CONFIG.values()] + ["Log", "Pemakaian"]
+
+class SchemaRegistry:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._handles: Dict[str, gspread.Worksheet] = {}
+        self._headers: Dict[str, List[str]] = {}
+        self._cols: Dict[str, Dict[str, int]] = {}
+        self.version = 0
+
+    def load(self):
+        handles = {ws.title: ws for ws in ss.worksheets()}
+        titles = [t for t in SCHEMA_SHEETS if t in handles]
+        ranges = ss.values_batch_get([f"'{t}'!1:1" for t in titles]).get("valueRanges", []) if titles else []
+        with self._lock:
+            self._handles = handles
+            for t, vr in zip(titles, ranges):
+                self._set_headers(t, (vr.get("values") or [[]])[0])
+            self.version += 1
+        logger.info(f"Schema sheet dimuat (versi {self.version}): {', '.join(titles)}")
+
+    def _set_headers(self, title: str, headers: List[str]):
+        with self._lock:
+            if self._headers.get(title) == headers: return
+            self._headers[title] = list(headers)
+            cols: Dict[str, int] = {}
+            for i, h in enumerate(headers):
+                if h: cols.setdefault(h, i + 1) # Header ganda: pakai kolom pertama, sama seperti list.index
+            self._cols[title] = cols
+
+    def observe(self, title: str, headers: List[str]):
+        if title in self._handles and self._headers.get(title) != headers:
+            if title in self._headers: logger.info(f"Header sheet '{title}' berubah; peta kolom diperbarui.")
+            self._set_headers(title, headers)
+
+    def add(self, ws: gspread.Worksheet, headers: List[str]):
+        with self._lock:
+            self._handles[ws.title] = ws
+            self._set_headers(ws.title, headers)
+
+    def worksheet(self, title: str) -> gspread.Worksheet:
+        ws = self._handles.get(title)
+        if ws: return ws
+        self.load() # Sheet baru / di-rename sejak dimuat
+        ws = self._handles.get(title)
+        if ws: return ws
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def refresh_headers(self, ws: gspread.Worksheet) -> List[str]:
+        headers = ws.row_values(1)
+        if ws.title in self._headers and self._headers[ws.title] != headers:
+            logger.info(f"Header sheet '{ws.title}' berubah; peta kolom & cache dimuat ulang.")
+            sheet_cache.invalidate(ws.title)
+        self._set_headers(ws.title, headers)
+        return headers
+
+    def headers(self, ws: gspread.Worksheet) -> List[str]:
+        if ws.title not in self._headers: return self.refresh_headers(ws)
+        return list(self._headers[ws.title])
+
+    def col(self, ws: gspread.Worksheet, name: str) -> int:
+        cols = self._cols.get(ws.title, {})
+        if name not in cols:
+            self.refresh_headers(ws)
+            cols = self._cols.get(ws.title, {})
+            if name not in cols:
+                raise RuntimeError(f"Kolom '{name}' tidak ada di sheet '{ws.title}'")
+        return cols[name]
+
+schema = SchemaRegistry()
+sheet_cache.on_reload = schema.observe
+
+# =========================
+# BATCH TULIS SHEET
+# =========================
+# Mengumpulkan beberapa mutasi (lintas worksheet) lalu mengirimnya sebagai satu
+# spreadsheets.batchUpdate.
+def _cell_data(value: Any, as_text: bool = False) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)) and not as_text:
+        return {"userEnteredValue": {"numberValue": value}}
+    s = "" if value is None else str(value)
+    if not as_text:
+        if re.fullmatch(r"-?\d+", s.strip()):
+            return {"userEnteredValue": {"numberValue": int(s.strip())}}
+        if re.fullmatch(r"-?\d+\.\d+", s.strip()):
+            return {"userEnteredValue": {"numberValue": float(s.strip())}}
+        if s.startswith("="):
+            return {"userEnteredValue": {"formulaValue": s}}
+    return {"userEnteredValue": {"stringValue": s}}
+
+def _row_data(values: List[Any], headers: Optional[List[str]] = None) -> Dict[str, Any]:
+    headers = headers or []
+    return {"values": [_cell_data(v, i < len(headers) and headers[i] in TEXT_COLUMNS) for i, v in enumerate(values)]}
+
+class SheetBatch:
+    def __init__(self):
+        self.requests: List[Dict[str, Any]] = []
+
+    def append_row(self, sheet_id: int, values: List[Any], headers: Optional[List[str]] = None) -> "SheetBatch":
+        self.requests.append({"appendCells": {
+            "sheetId": sheet_id, "rows": [_row_data(values, headers)], "fields": "userEnteredValue",
+        }})
+        return self
+
+    def insert_row(self, sheet_id: int, row_num: int, values: List[Any], headers: Optional[List[str]] = None) -> "SheetBatch":
+        self.requests.append({"insertDimension": {
+            "range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": row_num - 1, "endIndex": row_num},
+            "inheritFromBefore": row_num > 2,
+        }})
+        self.requests.append({"updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": row_num - 1, "columnIndex": 0},
+            "rows": [_row_data(values, headers)], "fields": "userEnteredValue",
+        }})
+        return self
+
+    def update_cell(self, sheet_id: int, row_num: int, col: int, value: Any, as_text: bool = False) -> "SheetBatch":
+        self.requests.append({"updateCells": {
+            "start": {"sheetId": sheet_id, "rowIndex": row_num - 1, "columnIndex": col - 1},
+            "rows": [{"values": [_cell_data(value, as_text)]}], "fields": "userEnteredValue",
+        }})
+        return self
+
+    def update_column(self, sheet_id: int, col: int, start_row: int, values: List[Any]) -> "SheetBatch":
+        start = {"sheetId": sheet_id, "rowIndex": start_row - 1, "columnIndex": col - 1}
+        if all(isinstance(v, int) for v in values):
+            # Angka saja (penomoran ulang): pasteData satu nilai per baris jauh lebih ringkas
+            # daripada objek CellData per sel
+            self.requests.append({"pasteData": {
+                "coordinate": start, "data": "\n".join(map(str, values)), "type": "PASTE_VALUES", "delimiter": ",",
+            }})
+            return self
+        self.requests.append({"updateCells": {
+            "start": start, "rows": [{"values": [_cell_data(v)]} for v in values], "fields": "userEnteredValue",
+        }})
+        return self
+
+    def delete_row(self, sheet_id: int, row_num: int) -> "SheetBatch":
+        self.requests.append({"deleteDimension": {
+            "range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": row_num - 1, "endIndex": row_num},
+        }})
+        return self
+
+    def add_op(self, op: Dict[str, Any]) -> "SheetBatch":
+        kind, sid = op["kind"], op["sheet_id"]
+        if kind == "append": return self.append_row(sid, op["values"], op.get("headers"))
+        if kind == "insert": return self.insert_row(sid, op["row"], op["values"], op.get("headers"))
+        if kind == "update": return self.update_cell(sid, op["row"], op["col"], op["value"], op.get("as_text", False))
+        if kind == "renumber": return self.update_column(sid, 1, op["row"], op["values"])
+        if kind == "delete": return self.delete_row(sid, op["row"])
+        raise ValueError(f"Jenis operasi jurnal tidak dikenal: {kind}")
+
+    def commit(self):
+        if self.requests:
+            ss.batch_update({"requests": self.requests})
+
+# =========================
+# JURNAL TULIS (WRITE-AHEAD)
+# =========================
+# Setiap mutasi sheet dicatat dulu ke jurnal SQLite lokal (append-only) dan langsung
+# diterapkan ke cache, jadi user mendapat konfirmasi tanpa menunggu Google.
+# Worker latar belakang mengirim entri tertunda secara batch dengan retry/backoff.
+# Satu entri = daftar operasi (op) dari satu aksi; op membawa nomor baris yang dihitung
+# dari cache (urutan FIFO menjamin nomor itu cocok saat dikirim) dan key baris untuk replay.
+class WriteJournal:
+    def __init__(self, path: str):
+        self.lock = threading.RLock()
+        # Satu flush/replay yang mengirim ke Google pada satu waktu. Flush yang kena timeout
+        # gcall tetap berjalan di thread-nya; tanpa kunci ini flush berikutnya membaca entri
+        # yang sama (done_at masih NULL) dan mengirimnya dua kali.
+        self.flush_lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " created_at REAL NOT NULL,"
+            " ops TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " last_error TEXT,"
+            " done_at REAL)"
+        )
+        self._pinned: Dict[int, List[str]] = {}
+        self.needs_replay = False # Ada entri ditolak; sisa entri harus di-resolve ulang dulu
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def submit(self, ops: List[Dict[str, Any]]) -> int:
+        with self.lock:
+            entry_id = self._db.execute(
+                "INSERT INTO journal (created_at, ops) VALUES (?, ?)", (time.time(), json.dumps(ops))
+            ).lastrowid
+            titles = sorted({op["sheet"] for op in ops})
+            for t in titles: sheet_cache.pin(t)
+            self._pinned[entry_id] = titles
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return entry_id
+
+    def pending(self, limit: int) -> List[Tuple[int, List[Dict[str, Any]], int]]:
+        with self.lock:
+            rows = self._db.execute(
+                "SELECT id, ops, attempts FROM journal WHERE done_at IS NULL ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        return [(i, json.loads(ops), attempts) for i, ops, attempts in rows]
+
+    def pending_count(self) -> int:
+        with self.lock:
+            return self._db.execute("SELECT COUNT(*) FROM journal WHERE done_at IS NULL").fetchone()[0]
+
+    def mark_attempt(self, ids: List[int]):
+        with self.lock:
+            self._db.executemany("UPDATE journal SET attempts = attempts + 1 WHERE id = ?", [(i,) for i in ids])
+
+    def mark_done(self, ids: List[int], error: Optional[str] = None):
+        with self.lock:
+            self._db.executemany("UPDATE journal SET done_at = ?, last_error = ? WHERE id = ?",
+                                 [(time.time(), error, i) for i in ids])
+            for i in ids:
+                for t in self._pinned.pop(i, []): sheet_cache.unpin(t)
+
+    def prune(self):
+        with self.lock:
+            self._db.execute("DELETE FROM journal WHERE done_at IS NOT NULL AND done_at < ?",
+                             (time.time() - JOURNAL_RETENTION_DAYS * 86400,))
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        self._loop, self._wakeup = loop, asyncio.Event()
+
+    async def wait(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+journal = WriteJournal(JOURNAL_FILE)
+
+def _op(kind: str, ws: gspread.Worksheet, **fields) -> Dict[str, Any]:
+    return {"kind": kind, "sheet": ws.title, "sheet_id": ws.id, **fields}
+
+def _apply_op_to_cache(op: Dict[str, Any]):
+    kind, title = op["kind"], op["sheet"]
+    if kind == "append": sheet_cache.on_append(title, op["values"])
+    elif kind == "insert": sheet_cache.on_insert(title, op["row"], op["values"])
+    elif kind == "update": sheet_cache.on_update_cell(title, op["row"], op["col"], op["value"])
+    elif kind == "renumber": sheet_cache.on_renumber(title, op["row"], op["values"])
+    elif kind == "delete": sheet_cache.on_delete_row(title, op["row"])
+
+def journal_write(ops: List[Dict[str, Any]]):
+    # Dipanggil dengan journal.lock dipegang bila op dihitung dari cache.
+    with journal.lock:
+        for op in ops: _apply_op_to_cache(op)
+        journal.submit(ops)
+
+def _is_transient(exc: Exception) -> bool:
+    if isinstance(exc, gspread.exceptions.APIError):
+        return getattr(exc.response, "status_code", None) in (408, 429, 500, 502, 503, 504)
+    return isinstance(exc, (OSError, TimeoutError))
+
+def flush_journal(limit: int = JOURNAL_BATCH_SIZE, wait: float = 0) -> int:
+    # wait = detik menunggu flush lain yang masih berjalan; 0 = lewati (flush itu yang mengirim)
+    if not journal.flush_lock.acquire(timeout=wait): return 0
+    try:
+        if journal.needs_replay: replay_journal()
+        entries = journal.pending(limit)
+        if not entries: return 0
+        return _flush_entries(entries)
+    finally:
+        journal.flush_lock.release()
+
+def _commit_entries(entries: List[Tuple[int, List[Dict[str, Any]], int]]) -> Optional[Exception]:
+    # None bila terkirim; error permanen bila ditolak Google (error sementara diteruskan)
+    ids = [e[0] for e in entries]
+    batch = SheetBatch()
+    try:
+        for _, ops, _ in entries:
+            for op in ops: batch.add_op(op)
+        journal.mark_attempt(ids)
+        sheet_changes.own_commit(batch.commit)
+    except Exception as e:
+        if _is_transient(e): raise
+        return e
+    journal.mark_done(ids)
+    return None
+
+def _flush_entries(entries: List[Tuple[int, List[Dict[str, Any]], int]]) -> int:
+    err = _commit_entries(entries)
+    if err is None: return len(entries)
+    n = 0
+    if len(entries) > 1:
+        # batchUpdate bersifat atomik (belum ada yang diterapkan): kirim satu per satu
+        # untuk memisahkan entri yang ditolak dari entri lain di batch yang sama
+        for n, entry in enumerate(entries):
+            err = _commit_entries([entry])
+            if err: break
+        else:
+            return len(entries)
+    entry_id = entries[n][0]
+    logger.error(f"Entri jurnal #{entry_id} ditolak Google dan dibuang: {err}")
+    journal.mark_done([entry_id], error=str(err))
+    journal.needs_replay = True
+    # Nomor baris entri sesudahnya dihitung dengan anggapan entri ini berhasil:
+    # putar ulang sisa jurnal terhadap isi server agar baris di-resolve lewat key-nya.
+    replay_journal()
+    return n + 1
+
+async def journal_worker():
+    journal.attach(asyncio.get_running_loop())
+    await google_ready.wait()
+    delay = JOURNAL_FLUSH_INTERVAL
+    while True:
+        if delay > JOURNAL_FLUSH_INTERVAL:
+            await asyncio.sleep(delay) # Sedang backoff: tulisan baru tidak boleh memicu flush lebih awal
+        else:
+            await journal.wait(delay)
+        try:
+            while await gcall(flush_journal):
+                pass
+            delay = JOURNAL_FLUSH_INTERVAL
+        except Exception as e:
+            delay = min(max(delay, 1) * 2, JOURNAL_MAX_BACKOFF)
+            logger.warning(f"Flush jurnal gagal ({e}); coba lagi dalam {delay:.0f}s. Tertunda: {journal.pending_count()}")
+
+def _tail_contains(ws: gspread.Worksheet, values: List[Any], depth: int = 50) -> bool:
+    # Hanya baris-baris terakhir (lewat log_row_count + range A1), bukan seluruh sheet:
+    # dipanggil per op saat replay, sebelum bot siap dan sambil memegang journal.lock
+    want = [str(v) for v in values]
+    n = log_row_count(ws)
+    if n < 2: return False
+    rows = ws.get(f"A{max(2, n - depth + 1)}:{rowcol_to_a1(n, len(want))}")
+    return any((list(r) + [""] * len(want))[:len(want)] == want for r in rows)
+
+def _resolve_for_replay(op: Dict[str, Any], ws: gspread.Worksheet, maybe_applied: bool) -> Optional[Dict[str, Any]]:
+    # Sesuaikan op dengan kondisi sheet terkini; None = op sudah diterapkan / tidak relevan lagi
+    kind, key = op["kind"], op.get("key")
+    if kind in ("append", "insert"):
+        if key:
+            if maybe_applied and sheet_cache.find(ws, key[0], _as_key(key[1]))[0]: return None
+        elif maybe_applied and _tail_contains(ws, op["values"]):
+            return None
+        if kind == "insert":
+            records = sheet_cache.records(ws)
+            pos = _sorted_position(records, op["sort_col"], op["sort_value"])
+            if pos == len(records): return dict(op, kind="append")
+            return dict(op, row=pos + 2)
+        return op
+    if kind in ("update", "delete"):
+        if not key: return op
+        row_num, _ = sheet_cache.find(ws, key[0], _as_key(key[1]))
+        return dict(op, row=row_num) if row_num else None
+    if kind == "renumber":
+        return _renumber_op(ws)
+    return op
+
+def replay_journal():
+    # Saat startup (dan setelah entri ditolak): kirim ulang entri tertunda satu per satu.
+    # Entri yang mungkin sudah terkirim sebelumnya (attempts > 0) dicek dulu ke sheet
+    # agar tidak dobel. journal.lock dipegang agar tidak ada op baru dihitung dari cache
+    # yang sedang dibangun ulang.
+    with journal.flush_lock, journal.lock:
+        _replay_pending()
+
+def _replay_pending():
+    entries = journal.pending(limit=1_000_000)
+    if not entries:
+        journal.needs_replay = False
+        journal.prune(); return
+    logger.info(f"Memutar ulang {len(entries)} entri jurnal tertunda...")
+    # Snapshot yang sudah memuat op tertunda dibuang; op di-resolve ulang terhadap isi server
+    for t in {op["sheet"] for _, ops, _ in entries for op in ops}: sheet_cache.invalidate(t)
+    handles: Dict[str, gspread.Worksheet] = {}
+    for entry_id, ops, attempts in entries:
+        batch = SheetBatch()
+        try:
+            for op in ops:
+                ws = handles.get(op["sheet"]) or handles.setdefault(op["sheet"], schema.worksheet(op["sheet"]))
+                resolved = _resolve_for_replay(op, ws, attempts > 0)
+                if resolved:
+                    _apply_op_to_cache(resolved); batch.add_op(resolved)
+            journal.mark_attempt([entry_id])
+            sheet_changes.own_commit(batch.commit)
+        except Exception as e:
+            sheet_cache.invalidate()
+            if _is_transient(e): raise
+            logger.error(f"Entri jurnal #{entry_id} gagal diputar ulang dan dibuang: {e}")
+            journal.mark_done([entry_id], error=str(e)); continue
+        journal.mark_done([entry_id])
+    journal.needs_replay = False
+    journal.prune()
+    logger.info("Replay jurnal selesai.")
+
+def _as_key(v: Any) -> Any:
+    return tuple(_as_key(x) for x in v) if isinstance(v, list) else v
+
+# Jalur tulis ke sheet perangkat; selalu lewat jurnal agar cache ikut terbarui.
+# Nomor baris dicari sebelum journal.lock dipegang dan bisa sudah bergeser oleh
+# penghapusan user lain: bila pemanggil memberi record yang dilihatnya, baris
+# dicocokkan ulang lewat key-nya. Nomor baris yang benar-benar ditulis dikembalikan.
+def _current_row(ws: gspread.Worksheet, row_num: int, rec: Optional[Dict[str, Any]]) -> int:
+    key = sheet_cache.record_key(ws.title, rec) if rec else None
+    if not key: return row_num
+    cur = sheet_cache.row(ws, row_num)
+    if cur and sheet_cache.record_key(ws.title, cur) == key: return row_num
+    found, _ = sheet_cache.find(ws, key[0], key[1])
+    if not found: raise LookupError(f"Baris {key[1]} tidak ada lagi di sheet '{ws.title}'")
+    return found
+
+def sheet_update_cell(ws: gspread.Worksheet, row_num: int, col: int, value: Any,
+                      rec: Optional[Dict[str, Any]] = None) -> int:
+    with journal.lock:
+        row_num = _current_row(ws, row_num, rec)
+        headers = sheet_cache.headers(ws)
+        as_text = 1 <= col <= len(headers) and headers[col - 1] in TEXT_COLUMNS
+        journal_write([_op("update", ws, row=row_num, col=col, value=value, as_text=as_text,
+                           key=sheet_cache.row_key(ws, row_num))])
+        return row_num
+
+def sheet_delete_row(ws: gspread.Worksheet, row_num: int, rec: Optional[Dict[str, Any]] = None) -> int:
+    with journal.lock:
+        row_num = _current_row(ws, row_num, rec)
+        journal_write([_op("delete", ws, row=row_num, key=sheet_cache.row_key(ws, row_num))])
+        return row_num
+
+def journal_append_row(ws: gspread.Worksheet, values: List[Any]):
+    journal_write([_op("append", ws, values=values)])
 
 # =========================
 # TELEGRAM
 # =========================
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
 from pyrogram.types import (
     ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove,
     InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message,
+    InlineQuery, InlineQueryResultArticle, InputTextMessageContent,
 )
 
 app = Client("bot-gudang", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
-user_states: dict[int, list[str]] = defaultdict(list)
-user_data: dict[int, dict] = defaultdict(dict)
+
+# =========================
+# SESI USER
+# =========================
+# Satu record ringkas per user: tumpukan state (dibatasi SESSION_MAX_STATES) dan data
+# isian yang hanya berisi nilai JSON (nama sheet & key baris, bukan objek Worksheet).
+# Sesi yang tidak aktif melewati SESSION_TTL dibuang; bila jumlahnya melebihi
+# SESSION_MAX, sesi paling lama dikeluarkan dari memori (dengan SESSION_FILE: dipindah
+# ke disk dan dimuat lagi saat user kembali).
+class SessionStore:
+    def __init__(self, ttl: float, max_size: int, max_states: int, path: str = ""):
+        self.ttl, self.max_size, self.max_states = ttl, max_size, max_states
+        self._sessions: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._dirty: set = set()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " user_id INTEGER PRIMARY KEY,"
+                " touched REAL NOT NULL,"
+                " states TEXT NOT NULL,"
+                " data TEXT NOT NULL)"
+            )
+
+    def _new(self, states: Optional[List[str]] = None, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return {"states": deque(states or (), maxlen=self.max_states), "data": data or {}, "touched": time.time()}
+
+    def _load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        if not self._db: return None
+        row = self._db.execute("SELECT touched, states, data FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        if not row or time.time() - row[0] > self.ttl: return None
+        return self._new(json.loads(row[1]), json.loads(row[2]))
+
+    def _save(self, user_id: int, rec: Dict[str, Any]):
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (user_id, touched, states, data) VALUES (?, ?, ?, ?)",
+                (user_id, rec["touched"], json.dumps(list(rec["states"])), json.dumps(rec["data"])),
+            )
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Sesi user {user_id} tidak bisa disimpan ke disk: {e}")
+
+    def get(self, user_id: int, create: bool = True) -> Optional[Dict[str, Any]]:
+        rec = self._sessions.get(user_id)
+        if rec and time.time() - rec["touched"] > self.ttl:
+            self.drop(user_id); rec = None
+        if rec is None:
+            rec = self._load(user_id)
+            if rec is None:
+                if not create: return None
+                rec = self._new()
+            self._sessions[user_id] = rec
+            self._evict()
+        rec["touched"] = time.time()
+        self._sessions.move_to_end(user_id)
+        self._dirty.add(user_id)
+        return rec
+
+    def drop(self, user_id: int):
+        self._sessions.pop(user_id, None); self._dirty.discard(user_id)
+        if self._db: self._db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def _evict(self):
+        while len(self._sessions) > self.max_size:
+            user_id, rec = self._sessions.popitem(last=False)
+            if self._db: self._save(user_id, rec)
+            self._dirty.discard(user_id)
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        while self._sessions:
+            user_id, rec = next(iter(self._sessions.items()))
+            if rec["touched"] > cutoff: break
+            self.drop(user_id)
+        if self._db: self._db.execute("DELETE FROM sessions WHERE touched < ?", (cutoff,))
+
+    def flush(self):
+        if not self._db: return
+        for user_id in list(self._dirty):
+            rec = self._sessions.get(user_id)
+            if rec: self._save(user_id, rec)
+        self._dirty.clear()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+# Tampilan user_states[uid] / user_data[uid] di atas SessionStore agar handler tetap
+# memakai bentuk akses yang sama seperti dict biasa
+class SessionField:
+    def __init__(self, store: SessionStore, field: str):
+        self.store, self.field = store, field
+
+    def __getitem__(self, user_id: int):
+        return self.store.get(user_id)[self.field]
+
+    def __setitem__(self, user_id: int, value):
+        rec = self.store.get(user_id)
+        rec[self.field] = deque(value, maxlen=self.store.max_states) if self.field == "states" else dict(value)
+
+    def get(self, user_id: int, default=None):
+        rec = self.store.get(user_id, create=False)
+        return rec[self.field] if rec and rec[self.field] else default
+
+sessions = SessionStore(SESSION_TTL, SESSION_MAX, SESSION_MAX_STATES, SESSION_FILE)
+user_states = SessionField(sessions, "states")
+user_data = SessionField(sessions, "data")
+
+async def session_janitor():
+    while True:
+        await asyncio.sleep(60)
+        sessions.expire(); sessions.flush()
 
 # =========================
 # UI LABELS
@@ -204,7 +1328,21 @@ CANCEL_ONLY_KEYBOARD = ReplyKeyboardMarkup([[KeyboardButton(BTN_CANCEL)]], resiz
 # HELPERS
 # =========================
 async def clear_user_session(user_id: int):
-    user_states.pop(user_id, None); user_data.pop(user_id, None)
+    sessions.drop(user_id)
+    pending_photos.discard(user_id)
+
+# Item yang sedang diubah/dihapus disimpan di sesi sebagai nama sheet + key baris;
+# nomor baris hanya cadangan karena bisa bergeser oleh penghapusan user lain.
+def item_ref(ws: gspread.Worksheet, row_num: int, row_data: Dict[str, Any]) -> Dict[str, Any]:
+    return {'worksheet_to_edit': ws.title, 'row_to_edit': row_num, 'row_key': sheet_cache.record_key(ws.title, row_data)}
+
+def resolve_item(data: Dict[str, Any]) -> Tuple[gspread.Worksheet, Optional[int], Optional[Dict[str, Any]]]:
+    # Dipakai tepat sebelum mengubah/menghapus, jadi selalu dicek ke versi server dulu
+    ws = schema.worksheet(data['worksheet_to_edit'])
+    sync_before_write([ws.title])
+    key = data.get('row_key')
+    if key: return (ws, *sheet_cache.find(ws, key[0], _as_key(key[1])))
+    return ws, data.get('row_to_edit'), sheet_cache.row(ws, data.get('row_to_edit') or 0)
 
 def is_non_text_message(msg: Message) -> bool:
     return any([
@@ -221,46 +1359,223 @@ def reply_invalid_choice(message: Message):
     return message.reply_text("Pilihan tidak valid.")
 
 def ensure_headers(ws: gspread.Worksheet, required: List[str]) -> List[str]:
-    headers = ws.row_values(1)
+    headers = schema.headers(ws)
+    if any(h not in headers for h in required):
+        headers = schema.refresh_headers(ws)
     missing = [h for h in required if h not in headers]
     if missing:
         raise RuntimeError(f"Kolom wajib hilang di sheet '{ws.title}': {', '.join(missing)}")
     return headers
 
 def next_no(ws: gspread.Worksheet) -> int:
-    col_a = ws.col_values(1)
-    if len(col_a) <= 1:
+    records = sheet_cache.records(ws)
+    if not records:
         return 1
-    last = col_a[-1]
+    last = records[-1].get("No")
     try:
         return int(last) + 1
     except Exception:
-        return len(col_a) - 1
+        return len(records)
+
+def sniff_image_kind(head: bytes) -> str:
+    # Tebak format dari magic bytes; cukup beberapa byte pertama (chunk pertama)
+    if head.startswith(b'\x89PNG'): return "png"
+    if head.startswith(b'\xff\xd8'): return "jpeg"
+    if head.startswith(b'GIF'): return "gif"
+    if head.startswith(b'WEBP', 8): return "webp"
+    return "jpeg"
+
+def normalize_image(data: bytes) -> Tuple[bytes, str]:
+    kind = sniff_image_kind(data)
+    if kind == "gif": return data, kind # Bisa animasi; biarkan apa adanya
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            im = ImageOps.exif_transpose(im) # Terapkan rotasi EXIF sebelum EXIF-nya dibuang
+            im.thumbnail((PHOTO_MAX_DIM, PHOTO_MAX_DIM))
+            if PHOTO_FORMAT == "jpeg" and im.mode not in ("RGB", "L"): im = im.convert("RGB")
+            out = io.BytesIO()
+            im.save(out, format=PHOTO_FORMAT.upper(), quality=PHOTO_QUALITY, optimize=True)
+    except Exception as e:
+        # Format tak dikenal Pillow (mis. HEIC) atau file terpotong: upload apa adanya
+        logger.warning(f"Normalisasi foto dilewati ({e}); file asli diunggah.")
+        return data, kind
+    return out.getvalue(), PHOTO_FORMAT
+
+def drive_folder_for(jenis_perangkat: str, detail_perangkat: str) -> str:
+    folder_ids = DEVICE_CONFIG.get(jenis_perangkat, {}).get("drive_folder_ids", {})
+    return folder_ids.get(detail_perangkat, GOOGLE_DRIVE_PARENT_FOLDER_ID)
+
+# Upload resumable Drive (protokol REST) yang diisi bertahap: setiap kelipatan 256 KiB
+# langsung dikirim, jadi foto tidak pernah ditampung utuh (apalagi dua kali) di memori.
+DRIVE_UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files"
+DRIVE_UPLOAD_QUANTUM = 256 * 1024
+DRIVE_UPLOAD_RETRIES = 3
+
+class DriveResumableUpload:
+    def __init__(self, file_name: str, mimetype: str, folder_id: str):
+        self._session = AuthorizedSession(creds)
+        r = self._session.post(DRIVE_UPLOAD_URL,
+                               params={"uploadType": "resumable", "supportsAllDrives": "true", "fields": "id"},
+                               json={"name": file_name, "parents": [folder_id]},
+                               headers={"X-Upload-Content-Type": mimetype})
+        r.raise_for_status()
+        self._url = r.headers["Location"]
+        self._buf = bytearray()
+        self.offset = 0
+
+    def write(self, chunk: bytes):
+        self._buf += chunk
+        n = len(self._buf) // DRIVE_UPLOAD_QUANTUM * DRIVE_UPLOAD_QUANTUM
+        if n: self._put(n, None)
+
+    def finish(self) -> str:
+        while True:
+            r = self._put(len(self._buf), self.offset + len(self._buf))
+            if r.status_code in (200, 201): return r.json()["id"]
+
+    def cancel(self):
+        try:
+            self._session.delete(self._url)
+        except Exception as e:
+            logger.warning(f"Gagal membatalkan sesi upload Drive: {e}")
 
-def upload_photo_to_drive(file_data: bytes, file_name: str, jenis_perangkat: str, detail_perangkat: str) -> Optional[str]:
+    def _put(self, n: int, total: Optional[int]):
+        rng = f"bytes {self.offset}-{self.offset + n - 1}/{total if total is not None else '*'}" if n else f"bytes */{total}"
+        for attempt in range(DRIVE_UPLOAD_RETRIES):
+            try:
+                r = self._session.put(self._url, data=bytes(self._buf[:n]), headers={"Content-Range": rng})
+            except OSError:
+                if attempt == DRIVE_UPLOAD_RETRIES - 1: raise
+                time.sleep(2 ** attempt); continue
+            if r.status_code < 500: break
+            if attempt == DRIVE_UPLOAD_RETRIES - 1: r.raise_for_status()
+            time.sleep(2 ** attempt)
+        if r.status_code == 308:
+            # Server bisa menyimpan lebih sedikit dari yang dikirim; sisanya dikirim ulang
+            rng_hdr = r.headers.get("Range")
+            sent = (int(rng_hdr.rsplit("-", 1)[1]) + 1 if rng_hdr else 0) - self.offset
+        elif r.status_code in (200, 201):
+            sent = n
+        else:
+            r.raise_for_status()
+        del self._buf[:sent]; self.offset += sent
+        return r
+
+def share_drive_file(file_id: str) -> str:
+    drive_service.permissions().create(fileId=file_id, body={"role": "reader", "type": "anyone"}, supportsAllDrives=True).execute()
+    return f"https://drive.google.com/file/d/{file_id}/view"
+
+async def stream_photo_to_drive(chat_id: int, message_id: int, file_name: str,
+                                jenis_perangkat: str, detail_perangkat: str) -> Optional[str]:
+    # Chunk dari Telegram dialirkan lewat antrean kecil ke upload Drive, jadi unduh
+    # chunk berikutnya berjalan bersamaan dengan kirim chunk sebelumnya.
+    # Foto besar (mis. dokumen asli kamera) dikumpulkan dulu lalu dinormalisasi bila aktif.
+    upload: Optional[DriveResumableUpload] = None
+    queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+    producer: Optional[asyncio.Task] = None
+    t0 = time.perf_counter()
+
+    async def produce(msg: Message):
+        try:
+            async for chunk in app.stream_media(msg):
+                await queue.put(chunk)
+        finally:
+            await queue.put(None)
+
+    async def open_upload(head: bytes, kind: Optional[str] = None) -> DriveResumableUpload:
+        return await gcall(DriveResumableUpload, file_name, f"image/{kind or sniff_image_kind(head)}",
+                           drive_folder_for(jenis_perangkat, detail_perangkat))
+
+    file_id: Optional[str] = None
+    raw = bytearray()
     try:
-        folder_ids = DEVICE_CONFIG.get(jenis_perangkat, {}).get("drive_folder_ids", {})
-        target_folder_id = folder_ids.get(detail_perangkat, GOOGLE_DRIVE_PARENT_FOLDER_ID)
-        kind = "jpeg"  # default
-        if file_data.startswith(b'\x89PNG'):
-            kind = "png"
-        elif file_data.startswith(b'\xff\xd8'):
-            kind = "jpeg"
-        elif file_data.startswith(b'GIF'):
-            kind = "gif"
-        elif file_data.startswith(b'WEBP', 8):
-            kind = "webp"
-        
-        media = MediaInMemoryUpload(file_data, mimetype=f"image/{kind}", resumable=False)
-        file = drive_service.files().create(
-            body={"name": file_name, "parents": [target_folder_id]},
-            media_body=media, fields="id", supportsAllDrives=True
-        ).execute()
-        drive_service.permissions().create(fileId=file['id'], body={"role": "reader", "type": "anyone"}, supportsAllDrives=True).execute()
-        return f"https://drive.google.com/file/d/{file['id']}/view"
+        msg = await app.get_messages(chat_id, message_id)
+        media = msg.document or msg.photo
+        normalize = Image is not None and PHOTO_MAX_DIM > 0 and (getattr(media, "file_size", 0) or 0) >= PHOTO_NORMALIZE_MIN_BYTES
+        producer = asyncio.create_task(produce(msg))
+        while (chunk := await queue.get()) is not None:
+            if normalize:
+                raw += chunk; continue
+            if upload is None: upload = await open_upload(chunk)
+            await gcall(upload.write, chunk)
+        await producer # Lempar ulang error unduhan Telegram bila ada
+        if normalize and raw:
+            data, kind = await asyncio.get_running_loop().run_in_executor(None, normalize_image, bytes(raw))
+            logger.info(f"Foto dinormalisasi: {len(raw)} -> {len(data)} byte")
+            raw.clear()
+            upload = await open_upload(data, kind)
+            await gcall(upload.write, data)
+        if upload is None: raise ValueError("Foto kosong")
+        file_id = await gcall(upload.finish)
+        link = await gcall(share_drive_file, file_id)
+        logger.info(f"Upload foto '{file_name}': {upload.offset} byte dalam {time.perf_counter() - t0:.2f}s")
+        return link
+    except asyncio.CancelledError:
+        if file_id: google_executor.submit(delete_photo_from_drive, file_id)
+        elif upload: google_executor.submit(upload.cancel)
+        raise
     except Exception:
         logger.exception("Upload ke Drive gagal.")
+        if file_id: await gcall(delete_photo_from_drive, file_id)
+        elif upload: await gcall(upload.cancel)
         return None
+    finally:
+        if producer: producer.cancel()
+
+def start_photo_upload(chat_id: int, message_id: int, jenis_perangkat: str, detail_perangkat: str) -> asyncio.Task:
+    safe_tail = datetime.now().strftime('%Y%m%d%H%M%S')
+    file_name = f"{jenis_perangkat}-{detail_perangkat}-{safe_tail}.jpg"
+    return asyncio.create_task(stream_photo_to_drive(chat_id, message_id, file_name, jenis_perangkat, detail_perangkat))
+
+def _discard_photo_task(task: asyncio.Task):
+    # Upload yang masih jalan dibatalkan (stream_photo_to_drive membereskan sesinya);
+    # yang sudah selesai berarti file yatim di Drive -> hapus.
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled() and not task.exception() and task.result():
+        google_executor.submit(delete_photo_from_drive, extract_drive_id_from_url(task.result()))
+
+# Pre-upload foto: upload dimulai begitu jawaban foto diterima, jadi saat user menekan
+# "Simpan" link biasanya sudah siap. Satu upload tertunda per user, dibuang (dan filenya
+# dihapus) saat sesi dibatalkan/selesai tanpa simpan atau setelah PHOTO_PREUPLOAD_TTL.
+class PendingPhotos:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._pending: Dict[int, Tuple[tuple, asyncio.Task, float]] = {}
+
+    def start(self, user_id: int, message_id: int, jenis_perangkat: str, detail_perangkat: str):
+        self.discard(user_id)
+        task = start_photo_upload(user_id, message_id, jenis_perangkat, detail_perangkat)
+        self._pending[user_id] = ((message_id, jenis_perangkat, detail_perangkat), task, time.monotonic())
+
+    def take(self, user_id: int, message_id: int, jenis_perangkat: str, detail_perangkat: str) -> Optional[asyncio.Task]:
+        # Serahkan task ke pemanggil bila masih cocok dengan jawaban terakhir user
+        entry = self._pending.pop(user_id, None)
+        if not entry: return None
+        if entry[0] != (message_id, jenis_perangkat, detail_perangkat):
+            _discard_photo_task(entry[1]); return None
+        return entry[1]
+
+    def discard(self, user_id: int):
+        entry = self._pending.pop(user_id, None)
+        if entry: _discard_photo_task(entry[1])
+
+    def expire(self):
+        now = time.monotonic()
+        for user_id, (_, _, started) in list(self._pending.items()):
+            if now - started > self.ttl:
+                logger.info(f"Pre-upload foto user {user_id} kedaluwarsa; file dibuang.")
+                self.discard(user_id)
+
+    def discard_all(self):
+        for user_id in list(self._pending): self.discard(user_id)
+
+pending_photos = PendingPhotos(PHOTO_PREUPLOAD_TTL)
+
+async def photo_janitor():
+    while True:
+        await asyncio.sleep(60)
+        pending_photos.expire()
 
 def extract_drive_id_from_url(url: str) -> Optional[str]:
     if not isinstance(url, str): return None
@@ -276,31 +1591,66 @@ def delete_photo_from_drive(file_id: str):
     except Exception as e:
         logger.error(f"Gagal menghapus file Drive ID {file_id}: {e}")
 
-def find_sn_in_all_sheets(sn_to_find: str):
+def sn_key(sn: Any) -> tuple:
+    return (str(sn).strip(),)
+
+# Index SN global: setiap sheet di DEVICE_CONFIG yang punya kolom SN ikut terindeks
+for _cfg in DEVICE_CONFIG.values():
+    sheet_cache.register_index(_cfg["worksheet_name"], "sn",
+                               lambda r: sn_key(r["SN"]) if str(r.get("SN", "")).strip() else None)
+
+def find_sn_in_all_sheets(sn_to_find: str, fresh: bool = False):
+    if fresh: sync_before_write([cfg["worksheet_name"] for cfg in DEVICE_CONFIG.values()])
     for config in DEVICE_CONFIG.values():
         try:
-            ws = ss.worksheet(config["worksheet_name"])
-            headers = ws.row_values(1)
-            if "SN" not in headers: continue
-            cell = ws.find(sn_to_find, in_column=headers.index("SN") + 1)
-            if cell:
-                return ws, cell.row, dict(zip(headers, ws.row_values(cell.row)))
-        except (gspread.exceptions.WorksheetNotFound, ValueError):
+            ws = schema.worksheet(config["worksheet_name"])
+            row_num, r = sheet_cache.find(ws, "sn", sn_key(sn_to_find))
+            if row_num:
+                return ws, row_num, r
+        except gspread.exceptions.WorksheetNotFound:
             continue
     return None, None, None
 
-def _pc_row_match(r: Dict[str, Any], detail: str, k1: str, k2: str, uk: str) -> bool:
-    if r.get("Detail Perangkat") != detail: return False
-    if r.get("Ukuran (PC)") != uk: return False
-    a1, a2 = r.get("Konektor 1"), r.get("Konektor 2")
-    return (a1 == k1 and a2 == k2) or (a1 == k2 and a2 == k1)
+def duplicate_sns() -> Dict[str, List[Tuple[str, int]]]:
+    return {k[0]: locs for k, locs in sheet_cache.duplicates("sn").items()}
 
-def find_patchcord_row(detail: str, k1: str, k2: str, ukuran: str) -> Tuple[Optional[gspread.Worksheet], Optional[int], Optional[Dict[str, Any]]]:
+async def load_sheets(titles: List[str]) -> int:
+    # Muat snapshot beberapa sheet secara paralel (sekaligus membangun index)
+    async def load(title: str) -> bool:
+        try:
+            await gcall(lambda: sheet_cache.snapshot(schema.worksheet(title))); return True
+        except gspread.exceptions.WorksheetNotFound:
+            return False
+        except Exception as e:
+            logger.warning(f"Muat sheet '{title}' gagal: {e}"); return False
+    return sum(await asyncio.gather(*(load(t) for t in titles)))
+
+async def warm_sn_index():
+    t0 = time.perf_counter()
+    done = await load_sheets([cfg["worksheet_name"] for cfg in DEVICE_CONFIG.values()])
+    logger.info(f"Index SN dimuat dari {done} sheet dalam {time.perf_counter() - t0:.2f}s.")
+    for sn, locs in duplicate_sns().items():
+        logger.warning(f"SN duplikat '{sn}': " + ", ".join(f"{t} baris {r}" for t, r in locs))
+
+# Key komposit dinormalisasi; urutan konektor diabaikan (SC-APC->LC-UPC == LC-UPC->SC-APC)
+def pc_key(detail: Any, k1: Any, k2: Any, ukuran: Any) -> tuple:
+    return (str(detail).strip(), tuple(sorted((str(k1).strip(), str(k2).strip()))), str(ukuran).strip())
+
+def subcard_key(jenis: Any, kapasitas: Any, posisi: Any) -> tuple:
+    return (str(jenis).strip(), str(kapasitas).strip(), str(posisi).strip())
+
+sheet_cache.register_index("Patch Cord", "key", lambda r: pc_key(
+    r.get("Detail Perangkat", ""), r.get("Konektor 1", ""), r.get("Konektor 2", ""), r.get("Ukuran (PC)", "")))
+sheet_cache.register_index("Subcard", "key", lambda r: subcard_key(
+    r.get("Jenis Perangkat", ""), r.get("Kapasitas", ""), r.get("Posisi", "")))
+
+def find_patchcord_row(detail: str, k1: str, k2: str, ukuran: str, fresh: bool = False) -> Tuple[Optional[gspread.Worksheet], Optional[int], Optional[Dict[str, Any]]]:
     try:
-        ws = ss.worksheet("Patch Cord")
-        for i, r in enumerate(ws.get_all_records()):
-            if _pc_row_match(r, detail, k1, k2, ukuran):
-                return ws, i + 2, r
+        ws = schema.worksheet("Patch Cord")
+        if fresh: sync_before_write([ws.title])
+        row_num, r = sheet_cache.find(ws, "key", pc_key(detail, k1, k2, ukuran))
+        if row_num:
+            return ws, row_num, r
     except gspread.exceptions.WorksheetNotFound:
         pass
     return None, None, None
@@ -315,18 +1665,13 @@ def join_detail_sfp_no_ket(row: Dict[str, Any]) -> str:
 def join_detail_pc_no_ket(detail: str, k1: str, k2: str, ukuran: str) -> str:
     return f"{detail} | {k1} -> {k2} | {ukuran}"
 
-def _subcard_row_match(r: Dict[str, Any], jenis: str, kapasitas: str, posisi: str) -> bool:
-    if r.get("Jenis Perangkat") != jenis: return False
-    if r.get("Kapasitas") != kapasitas: return False
-    if r.get("Posisi") != posisi: return False
-    return True
-
-def find_subcard_row(jenis: str, kapasitas: str, posisi: str) -> Tuple[Optional[gspread.Worksheet], Optional[int], Optional[Dict[str, Any]]]:
+def find_subcard_row(jenis: str, kapasitas: str, posisi: str, fresh: bool = False) -> Tuple[Optional[gspread.Worksheet], Optional[int], Optional[Dict[str, Any]]]:
     try:
-        ws = ss.worksheet("Subcard")
-        for i, r in enumerate(ws.get_all_records()):
-            if _subcard_row_match(r, jenis, kapasitas, posisi):
-                return ws, i + 2, r
+        ws = schema.worksheet("Subcard")
+        if fresh: sync_before_write([ws.title])
+        row_num, r = sheet_cache.find(ws, "key", subcard_key(jenis, kapasitas, posisi))
+        if row_num:
+            return ws, row_num, r
     except gspread.exceptions.WorksheetNotFound:
         pass
     return None, None, None
@@ -337,6 +1682,101 @@ def join_detail_subcard_no_ket(row: Dict[str, Any]) -> str:
     pos = row.get("Posisi","-")
     return f"{jns} | {kap} | Posisi: {pos}"
 
+# Index pencarian inline (@bot <kata>): prefix kata + trigram atas SN, Posisi dan
+# Keterangan di semua sheet perangkat. Index dibangun dari snapshot SheetCache yang
+# sudah ada di memori dan hanya dibangun ulang per sheet bila versinya berubah,
+# jadi mengetik di kolom inline tidak pernah memanggil Sheets API. Pembangunan ulang
+# (~100 ms untuk 5k baris) berjalan di thread; selama itu index lama tetap dipakai.
+SEARCH_FIELDS = ("SN", "Posisi", "Keterangan")
+SEARCH_MAX_RESULTS = 50 # batas Telegram per jawaban inline query
+SEARCH_WORD_SPLIT = re.compile(r"[\s|,/;()]+")
+
+def _search_norm(value: Any) -> str:
+    return " ".join(str(value).lower().split())
+
+class SearchIndex:
+    def __init__(self, titles: List[str]):
+        self.titles = titles
+        self._sheets: Dict[str, Dict[str, Any]] = {}
+        self._building: Dict[str, int] = {} # Versi yang sedang dibangun per sheet
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _build(version: int, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        docs, tri, words = [], defaultdict(set), []
+        for i, rec in enumerate(records):
+            fields = tuple(_search_norm(rec.get(f, "")) for f in SEARCH_FIELDS)
+            if not any(fields): continue
+            d = len(docs); docs.append((i + 2, rec, fields))
+            for t in filter(None, fields):
+                for j in range(len(t) - 2): tri[t[j:j + 3]].add(d)
+                words.extend((w, d) for w in {t, *SEARCH_WORD_SPLIT.split(t)} if w)
+        words.sort()
+        return {"version": version, "docs": docs, "tri": tri, "words": words}
+
+    def _rebuild(self, title: str, version: int, records: List[Dict[str, Any]]):
+        try:
+            idx = self._build(version, records)
+            with self._lock:
+                cur = self._sheets.get(title)
+                if not cur or cur["version"] < version: self._sheets[title] = idx
+        except Exception as e:
+            logger.warning(f"Index pencarian sheet '{title}' gagal dibangun: {e}")
+        finally:
+            with self._lock:
+                if self._building.get(title) == version: del self._building[title]
+
+    def sync(self) -> List[str]:
+        # Jadwalkan pembangunan ulang index yang tertinggal dari snapshot terbaru (tanpa
+        # menunggu); kembalikan sheet yang perlu dimuat ulang
+        stale = []
+        for title in self.titles:
+            peek = sheet_cache.peek(title)
+            if not peek: stale.append(title); continue
+            version, _, records, expired = peek
+            if expired: stale.append(title)
+            with self._lock:
+                cur = self._sheets.get(title)
+                if (cur and cur["version"] == version) or self._building.get(title) == version: continue
+                self._building[title] = version
+            reload_executor.submit(self._rebuild, title, version, records)
+        return stale
+
+    @staticmethod
+    def _candidates(idx: Dict[str, Any], q: str) -> set:
+        if len(q) >= 3:
+            sets = sorted((idx["tri"].get(q[j:j + 3], set()) for j in range(len(q) - 2)), key=len)
+            return sets[0].intersection(*sets[1:])
+        words, found = idx["words"], set()
+        k = bisect_left(words, (q,))
+        while k < len(words) and words[k][0].startswith(q):
+            found.add(words[k][1]); k += 1
+        return found
+
+    @staticmethod
+    def _score(q: str, t: str) -> int:
+        if t == q: return 0
+        if t.startswith(q): return 1
+        if any(w.startswith(q) for w in SEARCH_WORD_SPLIT.split(t)): return 2
+        return 3
+
+    def search(self, query: str, limit: int = SEARCH_MAX_RESULTS) -> List[Tuple[str, int, Dict[str, Any], str]]:
+        q = _search_norm(query)
+        if not q: return []
+        hits = []
+        for title, idx in list(self._sheets.items()):
+            for d in self._candidates(idx, q):
+                row_num, rec, fields = idx["docs"][d]
+                # Trigram bisa berasal dari field berbeda: pastikan ada field yang memuat q
+                matches = [(self._score(q, t), fi) for fi, t in enumerate(fields) if q in t]
+                if not matches: continue
+                score, fi = min(matches)
+                hits.append((score, fi, title, row_num, rec))
+        return [(title, row_num, rec, SEARCH_FIELDS[fi])
+                for _, fi, title, row_num, rec in heapq.nsmallest(limit, hits, key=lambda h: h[:4])]
+
+search_index = SearchIndex([cfg["worksheet_name"] for cfg in DEVICE_CONFIG.values()])
+
 def build_summary_text(ws_name: str, data: Dict[str, Any]) -> str:
     if ws_name == "Patch Cord":
         qty = str(data.get('Jumlah','')).strip()
@@ -377,68 +1817,338 @@ def bullets_from_detail(_ws_name: str, detail: str) -> str:
     toks = [t.strip() for t in (detail or "").split("|") if t.strip()]
     return "\n".join([f"- {t.strip()}" for t in toks])
 
-def renumber_worksheet(ws: gspread.Worksheet):
+def _renumber_op(ws: gspread.Worksheet, from_row: int = 2) -> Optional[Dict[str, Any]]:
+    # Hanya tulis ulang rentang baris yang nomornya benar-benar berubah
+    # (mis. baris setelah baris yang dihapus), dihitung dari snapshot cache.
+    headers = sheet_cache.headers(ws)
+    if not headers or headers[0] != "No": return None
+    records = sheet_cache.records(ws)
+    changed = [i for i in range(max(from_row, 2) - 2, len(records)) if str(records[i].get("No", "")) != str(i + 1)]
+    if not changed: return None
+    first, last = changed[0], changed[-1]
+    return _op("renumber", ws, row=first + 2, values=list(range(first + 1, last + 2)))
+
+def renumber_worksheet(ws: gspread.Worksheet, from_row: int = 2):
     try:
-        vals = ws.get_all_values()
-        if len(vals) < 2: return
-        if vals[0][0] != "No": return
-        
-        new_no_col = [[i + 1] for i in range(len(vals) - 1)]
-        update_range = f"A2:A{len(vals)}"
-        
-        ws.update(values=new_no_col,
-                  range_name=update_range,
-                  value_input_option="USER_ENTERED")
-        logger.info(f"Berhasil menomori ulang sheet '{ws.title}'.")
+        with journal.lock:
+            op = _renumber_op(ws, from_row)
+            if not op: return
+            journal_write([op])
+        logger.info(f"Penomoran ulang sheet '{ws.title}' dijurnal (baris {op['row']}-{op['row'] + len(op['values']) - 1}).")
     except Exception as e:
         logger.error(f"Gagal menomori ulang sheet '{ws.title}': {e}")
 
-
 def get_or_create_log_ws() -> gspread.Worksheet:
     try:
-        return ss.worksheet("Log")
+        return schema.worksheet("Log")
     except gspread.exceptions.WorksheetNotFound:
+        headers = ["Waktu", "User ID", "Username", "Action", "Worksheet", "Detail", "Keterangan"]
         ws = ss.add_worksheet(title="Log", rows=1000, cols=7)
-        ws.update("A1:G1", [[
-            "Waktu", "User ID", "Username", "Action", "Worksheet", "Detail", "Keterangan"
-        ]])
+        ws.update("A1:G1", [headers])
+        schema.add(ws, headers)
         return ws
 
 
+def log_row(action: str, worksheet_name: str, detail_no_ket: str,
+            user_id: int, username: Optional[str], ket: str) -> List[str]:
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return [ts, str(user_id), username or "", action, worksheet_name, detail_no_ket, ket]
+
 def append_log(action: str, worksheet_name: str, detail_no_ket: str,
                user_id: int, username: Optional[str], ket: str):
-    ws = get_or_create_log_ws()
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    ws.append_row(
-        [ts, str(user_id), username or "", action, worksheet_name, detail_no_ket, ket],
-        value_input_option="USER_ENTERED"
-    )
+    journal_append_row(get_or_create_log_ws(), log_row(action, worksheet_name, detail_no_ket, user_id, username, ket))
+
+def _sheet_sort_key(value: Any) -> tuple:
+    # Meniru urutan sort Sheets: angka dulu, lalu teks tanpa membedakan huruf besar/kecil
+    if isinstance(value, (int, float)): return (0, value, "")
+    return (1, 0, str(value).casefold())
+
+def _sorted_position(records: List[Dict[str, Any]], sort_col: str, value: Any) -> int:
+    keys = [_sheet_sort_key(r.get(sort_col, "")) for r in records]
+    return bisect_right(keys, _sheet_sort_key(numericise_all([str(value)])[0]))
+
+def save_new_row(ws: gspread.Worksheet, headers: List[str], final_map: Dict[str, Any],
+                 keep_sorted: bool, log_values: List[str]):
+    # Satu entri jurnal (dikirim sebagai satu batchUpdate): baris baru + baris log INSERT.
+    # Untuk sheet terurut (kolom B), posisi sisip dihitung dari snapshot lalu disisipkan
+    # langsung (tanpa sort seluruh sheet).
+    log_ws = get_or_create_log_ws()
+    sync_before_write([ws.title])
+    with journal.lock:
+        records = sheet_cache.records(ws)
+        ops: List[Dict[str, Any]] = []
+        if keep_sorted and len(headers) > 1:
+            sort_col = headers[1] # Kolom B = "Detail Perangkat" / "Jenis Perangkat"
+            pos = _sorted_position(records, sort_col, final_map.get(sort_col, ""))
+            row_num = pos + 2
+            final_row = [row_num - 1 if h == "No" else final_map.get(h, "") for h in headers]
+            key = sheet_cache.record_key(ws.title, SheetCache._to_record(headers, final_row))
+            if pos == len(records):
+                ops.append(_op("append", ws, values=final_row, headers=headers, key=key))
+            else:
+                ops.append(_op("insert", ws, row=row_num, values=final_row, headers=headers, key=key,
+                               sort_col=sort_col, sort_value=final_map.get(sort_col, "")))
+                if headers[0] == "No":
+                    ops.append(_op("renumber", ws, row=row_num + 1, values=list(range(row_num, len(records) + 2))))
+        else:
+            final_row = [next_no(ws) if h == "No" else final_map.get(h, "") for h in headers]
+            key = sheet_cache.record_key(ws.title, SheetCache._to_record(headers, final_row))
+            ops.append(_op("append", ws, values=final_row, headers=headers, key=key))
+        ops.append(_op("append", log_ws, values=log_values))
+        journal_write(ops)
 
 def get_or_create_pemakaian_ws() -> gspread.Worksheet:
     try:
-        return ss.worksheet("Pemakaian")
+        return schema.worksheet("Pemakaian")
     except gspread.exceptions.WorksheetNotFound:
+        headers = ["Waktu", "User ID", "Username", "Jenis Perangkat", "Detail",
+                   "Jumlah Ambil", "Keterangan (Barang)", "Keterangan Pemakaian"]
         ws = ss.add_worksheet(title="Pemakaian", rows=1000, cols=8)
-        ws.update("A1:H1", [[
-            "Waktu", "User ID", "Username", "Jenis Perangkat", "Detail",
-            "Jumlah Ambil", "Keterangan (Barang)", "Keterangan Pemakaian"
-        ]])
+        ws.update("A1:H1", [headers])
+        schema.add(ws, headers)
         return ws
 
 
 def append_pemakaian(jenis:str, detail_no_ket:str, qty:str,
                      ket_barang:str, ket_pemakaian:str,
                      user_id:int, username:Optional[str]):
-    ws = get_or_create_pemakaian_ws()
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    ws.append_row([ts, str(user_id), username or "", jenis, detail_no_ket, qty, ket_barang, ket_pemakaian],
-                  value_input_option="USER_ENTERED")
+    journal_append_row(get_or_create_pemakaian_ws(),
+                       [ts, str(user_id), username or "", jenis, detail_no_ket, qty, ket_barang, ket_pemakaian])
+
+# Sheet Log/Pemakaian hanya bertambah: simpan jumlah baris terakhir yang diketahui,
+# kejar baris baru dengan membaca sedikit sel kolom A setelahnya, lalu ambil satu
+# halaman lewat range A1. Biaya tampilan tetap walau log sudah ratusan ribu baris.
+LOG_PAGE_SIZE = 10
+LOG_TAIL_PROBE = 200
+_tail_rows: Dict[str, int] = {}
+_tail_lock = threading.Lock()
+
+def log_row_count(ws: gspread.Worksheet) -> int:
+    with _tail_lock:
+        n = _tail_rows.get(ws.title)
+        if n is None:
+            n = len(ws.col_values(1)) # Sekali per proses
+        while True:
+            added = len(ws.get(f"A{n + 1}:A{n + LOG_TAIL_PROBE}"))
+            n += added
+            if added < LOG_TAIL_PROBE: break
+        _tail_rows[ws.title] = n
+        return n
+
+def _render_log(r: List[str]) -> List[str]:
+    waktu, uid, uname, action, wsn, detail, ket = r
+    lines = [f"[{waktu}] {action} - {wsn}", bullets_from_detail(wsn, detail)]
+    if ket: lines.append(f"- Keterangan: {ket}")
+    return lines + [""]
+
+def _render_pemakaian(r: List[str]) -> List[str]:
+    waktu, uid, uname, jenis, detail, jml, ket_barang, ket = r
+    lines = [f"[{waktu}] {jenis}", bullets_from_detail(jenis, detail)]
+    if jml: lines.append(f"- Jumlah: {jml}")
+    if ket_barang: lines.append(f"- Keterangan Barang: {ket_barang}")
+    if ket: lines.append(f"- Keterangan Pemakaian: {ket}")
+    return lines + [""]
+
+LOG_VIEWS = {
+    "log": (get_or_create_log_ws, 7, "Riwayat Perubahan", _render_log),
+    "pakai": (get_or_create_pemakaian_ws, 8, "Log Pemakaian", _render_pemakaian),
+}
+
+def log_page(kind: str, end_row: Optional[int] = None) -> Tuple[Optional[str], Optional[InlineKeyboardMarkup]]:
+    # Satu halaman log yang berakhir di end_row (default: baris terakhir); None bila log kosong
+    get_ws, ncols, title, render = LOG_VIEWS[kind]
+    ws = get_ws()
+    total = log_row_count(ws)
+    end = min(end_row or total, total)
+    if end < 2: return None, None
+    start = max(2, end - LOG_PAGE_SIZE + 1)
+    rows = mirror.rows_range(ws.title, start, end)
+    if rows is None:
+        rows = [(list(r) + [""] * ncols)[:ncols] for r in ws.get(f"A{start}:{rowcol_to_a1(end, ncols)}")]
+        rows += [[""] * ncols] * (end - start + 1 - len(rows))
+        mirror.put_rows(ws.title, start, rows)
+    blocks = [f"{title} (terbaru di bawah, entri {start - 1}-{end - 1} dari {total - 1}):", ""]
+    for r in rows:
+        blocks += render(r)
+    nav = []
+    if start > 2: nav.append(InlineKeyboardButton("« Lebih lama", callback_data=f"logtail:{kind}:{start - 1}"))
+    if end < total: nav.append(InlineKeyboardButton("Lebih baru »", callback_data=f"logtail:{kind}:{min(end + LOG_PAGE_SIZE, total)}"))
+    return "\n".join(blocks), (InlineKeyboardMarkup([nav]) if nav else None)
+
+# Rekap stok dirender dari agregat di SheetCache (lihat register_aggregate) yang
+# diperbarui oleh setiap input/ambil/ubah jumlah/hapus, bukan dihitung ulang dari
+# seluruh baris setiap kali tombol rekap ditekan.
+RECAP_MAX_SN = 20
+
+def _int_or_zero(value: Any) -> int:
+    try: return int(str(value).strip() or "0")
+    except ValueError: return 0
+
+def _recap_pc(r: Dict[str, Any]) -> Optional[Tuple[tuple, Any, int]]:
+    detail = r.get("Detail Perangkat")
+    if not detail: return None
+    key_parts = [str(r.get(k, "N/A")) for k in DEVICE_CONFIG["Patch Cord"]["display_group_by"]]
+    key_parts[1] = f"{r.get('Konektor 1', 'N/A')} → {r.get('Konektor 2', 'N/A')}"
+    key_parts.pop(2)
+    return (detail,), " / ".join(key_parts), _int_or_zero(r.get("Jumlah", "0"))
+
+def _recap_sfp(r: Dict[str, Any]) -> Optional[Tuple[tuple, Any, int]]:
+    detail = r.get("Detail Perangkat"); sn = r.get("SN")
+    if not detail or not sn: return None
+    combo = " / ".join(str(r.get(k, "N/A")) for k in DEVICE_CONFIG["SFP"]["display_group_by"])
+    return (detail, combo), str(sn), 1
+
+def _recap_subcard(r: Dict[str, Any]) -> Optional[Tuple[tuple, Any, int]]:
+    jenis = r.get("Jenis Perangkat")
+    if not jenis: return None
+    return (jenis,), (r.get("Kapasitas", "N/A"), r.get("Posisi", "N/A")), _int_or_zero(r.get("Jumlah Port", "0"))
+
+def _render_recap_pc(device_type: str, agg: Dict[tuple, Dict[Any, int]]) -> str:
+    if not agg: return f"Tidak ada data untuk {device_type}."
+    lines = [f"📊 Rekapitulasi Stok - {device_type}", ""]
+    for (d,), combos in sorted(agg.items()):
+        lines.append(f"{d}")
+        for c, t in sorted(combos.items()):
+            lines.append(f"  - {c}: {t} unit")
+        lines.append("")
+    return "\n".join(lines)
+
+def _render_recap_sfp(device_type: str, agg: Dict[tuple, Dict[Any, int]]) -> str:
+    if not agg: return "Tidak ada data untuk SFP."
+    lines = [f"📊 Rekapitulasi Stok - {device_type}", ""]
+    by_detail: Dict[Any, List[Tuple[str, Dict[Any, int]]]] = defaultdict(list)
+    for (d, c), sns in agg.items(): by_detail[d].append((c, sns))
+    for d, combos in sorted(by_detail.items()):
+        lines.append(f"{d}")
+        for c, sns in sorted(combos, key=lambda x: x[0]):
+            total = sum(sns.values())
+            lines.append(f"  • {c}: {total} unit")
+            lines.extend(f"    - {sn}" for sn in list(sns)[:RECAP_MAX_SN])
+            if total > RECAP_MAX_SN:
+                lines.append(f"    ( +{total - RECAP_MAX_SN} lainnya )")
+        lines.append("")
+    return "\n".join(lines)
+
+def _render_recap_subcard(device_type: str, agg: Dict[tuple, Dict[Any, int]]) -> str:
+    lines = [f"📊 Rekapitulasi Stok - {device_type}"]
+    if not agg:
+        lines.append("\nTidak ada data untuk ditampilkan.")
+    else:
+        lines.append("")
+        for (jenis,), items in sorted(agg.items()):
+            lines.append(f"{jenis}")
+            # Format: "12 x 10G (di STO Malang)"
+            for rekap in sorted(f"{ports} x {kap} (di {pos})" for (kap, pos), ports in items.items()):
+                lines.append(f"  - {rekap}")
+            lines.append("")
+    return "\n".join(lines)
+
+RECAP_VIEWS = {
+    "Patch Cord": (_recap_pc, _render_recap_pc),
+    "SFP": (_recap_sfp, _render_recap_sfp),
+    "Subcard": (_recap_subcard, _render_recap_subcard),
+}
+for _device, (_agg_fn, _) in RECAP_VIEWS.items():
+    sheet_cache.register_aggregate(DEVICE_CONFIG[_device]["worksheet_name"], "rekap", _agg_fn)
+
+# Teks rekap yang sudah dipecah per halaman di-cache per jenis perangkat dengan
+# kunci versi snapshot; selama sheet tidak berubah, rekap tidak diformat ulang.
+TELEGRAM_TEXT_LIMIT = 4096
+_recap_pages: Dict[str, Tuple[int, List[str]]] = {}
+
+def split_text(text: str, limit: int = TELEGRAM_TEXT_LIMIT) -> List[str]:
+    # Pecah di batas baris; baris yang sendirinya terlalu panjang dipotong paksa
+    chunks, cur, size = [], [], 0
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if cur: chunks.append("\n".join(cur)); cur, size = [], 0
+            chunks.append(line[:limit]); line = line[limit:]
+        if cur and size + 1 + len(line) > limit:
+            chunks.append("\n".join(cur)); cur, size = [], 0
+        size += len(line) + (1 if cur else 0); cur.append(line)
+    if cur: chunks.append("\n".join(cur))
+    return [c for c in chunks if c.strip()] or [text[:limit]]
+
+def format_age(seconds: float) -> str:
+    if seconds < 60: return f"{int(seconds)} detik"
+    if seconds < 3600: return f"{int(seconds // 60)} menit"
+    if seconds < 86400: return f"{int(seconds // 3600)} jam"
+    return f"{int(seconds // 86400)} hari"
+
+def recap_footer(device_type: str) -> str:
+    age = sheet_cache.age(DEVICE_CONFIG[device_type]["worksheet_name"]) if device_type in DEVICE_CONFIG else None
+    return "" if age is None else f"\n\n🕒 Data per {format_age(max(0.0, age))} lalu"
+
+def recap_pages(device_type: str) -> List[str]:
+    view = RECAP_VIEWS.get(device_type)
+    if not view: return [f"Tidak ada data atau konfigurasi rekap untuk {device_type}."]
+    ws = schema.worksheet(DEVICE_CONFIG[device_type]["worksheet_name"])
+    version = sheet_cache.version(ws, stale_ok=True)
+    cached = _recap_pages.get(device_type)
+    if cached and cached[0] == version: return cached[1]
+    pages = split_text(view[1](device_type, sheet_cache.aggregate(ws, "rekap", stale_ok=True)), TELEGRAM_TEXT_LIMIT - 96)
+    if len(pages) > 1:
+        pages = [f"{p}\n\n(Halaman {i + 1}/{len(pages)})" for i, p in enumerate(pages)]
+    _recap_pages[device_type] = (version, pages)
+    return pages
+
+# Telegram membatasi callback_data 64 byte, jadi tombol yang membawa data item (SN, key
+# komposit, Posisi panjang) hanya berisi token pendek "~xxxxxxxx". Token menunjuk ke
+# (aksi, argumen) di tabel memori yang dibatasi jumlahnya (LRU) dan umurnya (TTL).
+class CallbackTokens:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size, self.ttl = max_size, ttl
+        self._entries: "OrderedDict[str, Tuple[str, tuple, float]]" = OrderedDict()
+
+    def issue(self, action: str, args: tuple) -> str:
+        token = "~" + secrets.token_urlsafe(6)
+        self._entries[token] = (action, tuple(args), time.monotonic() + self.ttl)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return token
+
+    def resolve(self, token: str) -> Optional[Tuple[str, tuple]]:
+        entry = self._entries.get(token)
+        if not entry: return None
+        if entry[2] < time.monotonic():
+            del self._entries[token]; return None
+        self._entries.move_to_end(token)
+        return entry[0], entry[1]
+
+callback_tokens = CallbackTokens(CALLBACK_TOKEN_MAX, CALLBACK_TOKEN_TTL)
+
+def cb(action: str, *args: Any) -> str:
+    return callback_tokens.issue(action, tuple(str(a) for a in args))
+
+# Picker item berhalaman: daftar (label, aksi, argumen) dibangun sekali dari snapshot
+# cache lalu disimpan di sesi user; pindah halaman cukup memotong daftar itu dan
+# token callback hanya dibuat untuk tombol di halaman yang tampil.
+PICKER_PAGE_SIZE = 20
+
+def picker_markup(items: List[Tuple[str, str, tuple]], page: int) -> InlineKeyboardMarkup:
+    pages = max(1, -(-len(items) // PICKER_PAGE_SIZE))
+    page = max(0, min(page, pages - 1))
+    rows = [[InlineKeyboardButton(label, callback_data=cb(action, *args))]
+            for label, action, args in items[page * PICKER_PAGE_SIZE:(page + 1) * PICKER_PAGE_SIZE]]
+    if pages > 1:
+        nav = []
+        if page > 0: nav.append(InlineKeyboardButton("« Sebelumnya", callback_data=f"picker:{page - 1}"))
+        nav.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data="noop"))
+        if page < pages - 1: nav.append(InlineKeyboardButton("Berikutnya »", callback_data=f"picker:{page + 1}"))
+        rows.append(nav)
+    return InlineKeyboardMarkup(rows)
+
+async def send_picker(message: Message, user_id: int, items: List[Tuple[str, str, tuple]], text: str = "Daftar item:"):
+    user_data[user_id]["picker_items"] = items
+    await message.reply_text(f"{text} ({len(items)})" if len(items) > PICKER_PAGE_SIZE else text,
+                             reply_markup=picker_markup(items, 0))
 
 def get_device_selection_keyboard(purpose: str):
     buttons = [KeyboardButton(d) for d in DEVICE_CONFIG.keys()]
     rows = [buttons[i:i+2] for i in range(0, len(buttons), 2)]
     
-    inline = [InlineKeyboardButton(d, callback_data=f"display_{d}") for d in DEVICE_CONFIG.keys()]
+    inline = [InlineKeyboardButton(d, callback_data=f"display:{d}") for d in DEVICE_CONFIG.keys()]
     ik = [inline[i:i+2] for i in range(0, len(inline), 2)]
     ik.append([InlineKeyboardButton("Tutup Menu Rekap", callback_data="display_close")])
     return InlineKeyboardMarkup(ik)
@@ -479,13 +2189,12 @@ def pc_values(user_id: int):
 async def pc_find_and_prepare(message: Message, mode: str):
     d, k1, k2, uk = pc_values(message.from_user.id)
     await message.reply_text(f"Mencari Patch Cord: {d} | {k1} -> {k2} | {uk}...", reply_markup=ReplyKeyboardRemove())
-    ws, row_num, row_data = find_patchcord_row(d, k1, k2, uk)
+    ws, row_num, row_data = await gcall(find_patchcord_row, d, k1, k2, uk)
     if not row_num:
         await message.reply_text("Kombinasi tidak ditemukan.", reply_markup=NAVIGATION_KEYBOARD); return False
     summary = build_summary_text(ws.title, row_data)
-    user_data[message.from_user.id].update({'worksheet_to_edit': ws, 'row_to_edit': row_num, 'item_summary': summary, 'item_rowdata': row_data})
+    user_data[message.from_user.id].update(item_ref(ws, row_num, row_data), item_summary=summary)
     if mode == "delete":
-        user_data[message.from_user.id]['row_to_delete'] = row_num
         bullets = bullets_from_detail(ws.title, summary)
         user_states[message.from_user.id].append("awaiting_delete_confirmation")
         await message.reply_text(f"Konfirmasi Hapus - {ws.title}\n\n{bullets}\n\nYakin hapus?", reply_markup=DELETE_CONFIRM_KEYBOARD)
@@ -557,6 +2266,25 @@ async def process_input_confirmation(message: Message):
 async def start_command(client: Client, message: Message):
     await show_main_menu(message)
 
+@app.on_message(filters.command("stats") & filters.private)
+async def stats_command(client: Client, message: Message):
+    st = sheet_cache.stats()
+    lines = [
+        "Statistik Cache Sheet",
+        f"- Hit: {st['hits']}",
+        f"- Miss: {st['misses']}",
+        f"- Baca digabung: {st['coalesced']}",
+        f"- Dilayani basi (muat ulang di latar): {st['stale_hits']}",
+        f"- Rasio hit: {st['hit_ratio']:.0%}",
+        f"- Jurnal tertunda: {journal.pending_count()}",
+    ]
+    lines += [f"- {t}: {n} baris" for t, n in sorted(st["sheets"].items())]
+    dups = duplicate_sns()
+    if dups:
+        lines += ["", f"SN duplikat ({len(dups)}):"]
+        lines += [f"- {sn}: " + ", ".join(f"{t} baris {r}" for t, r in locs) for sn, locs in sorted(dups.items())[:20]]
+    await message.reply_text("\n".join(lines))
+
 # =========================
 # MAIN HANDLER
 # =========================
@@ -608,17 +2336,9 @@ async def handle_messages(client: Client, message: Message):
             return await message.reply_text("Pilih jenis perubahan:", reply_markup=EDIT_SUBMENU_KEYBOARD)
         if text == BTN_LOG:
             try:
-                wslog = get_or_create_log_ws(); rows = wslog.get_all_values()
-                if len(rows) <= 1: return await message.reply_text("Belum ada log perubahan.", reply_markup=MAIN_MENU_KEYBOARD)
-                last = rows[-10:] if len(rows) > 11 else rows[1:]
-                blocks = ["Riwayat Perubahan (terbaru di bawah):", ""]
-                for r in last:
-                    waktu, uid, uname, action, wsn, detail, ket = (r + [""]*7)[:7]
-                    blocks.append(f"[{waktu}] {action} - {wsn}")
-                    blocks.append(bullets_from_detail(wsn, detail))
-                    if ket: blocks.append(f"- Keterangan: {ket}")
-                    blocks.append("")
-                return await message.reply_text("\n".join(blocks), reply_markup=MAIN_MENU_KEYBOARD)
+                page, nav = await gcall(log_page, "log")
+                if not page: return await message.reply_text("Belum ada log perubahan.", reply_markup=MAIN_MENU_KEYBOARD)
+                return await message.reply_text(page, reply_markup=nav or MAIN_MENU_KEYBOARD)
             except Exception:
                 logger.exception("Gagal ambil log"); return await message.reply_text("Gagal memuat log.", reply_markup=MAIN_MENU_KEYBOARD)
         if text == BTN_PEMAKAIAN:
@@ -641,6 +2361,8 @@ async def handle_messages(client: Client, message: Message):
         if q["type"] == "photo":
             if message.photo or (message.document and str(message.document.mime_type).startswith("image/")):
                 ans = message.id
+                detail_key = "Detail Perangkat" if dev in ["SFP", "Patch Cord"] else "Jenis Perangkat"
+                pending_photos.start(user_id, ans, dev, user_data[user_id].get(detail_key, "UNKNOWN"))
             else:
                 return await message.reply_text("Input tidak valid. Kirim foto.")
         else:
@@ -650,6 +2372,10 @@ async def handle_messages(client: Client, message: Message):
                 return await message.reply_text("Jumlah harus angka. Contoh: 3")
             if dev == "Subcard" and q["key"] in ["Jumlah", "Jumlah Port"] and not re.fullmatch(r"\d+", text.strip()):
                 return await message.reply_text("Jumlah harus angka. Contoh: 10")
+            if q["key"] == "SN":
+                dup_ws, dup_row, _ = await gcall(find_sn_in_all_sheets, text.strip())
+                if dup_row:
+                    return await message.reply_text(f"SN {text.strip()} sudah terdaftar di sheet {dup_ws.title} (baris {dup_row}). Ketik SN lain:")
 
         user_data[user_id][q["key"]] = ans
 
@@ -659,14 +2385,9 @@ async def handle_messages(client: Client, message: Message):
             k2 = user_data[user_id].get("Konektor 2")
             uk = ans
 
-            ws, row_num, row_data = find_patchcord_row(d, k1, k2, uk)
+            ws, row_num, row_data = await gcall(find_patchcord_row, d, k1, k2, uk)
 
             if row_num:
-                user_data[user_id].update({
-                    'duplicate_ws': ws,
-                    'duplicate_row_num': row_num,
-                    'duplicate_row_data': row_data,
-                })
                 user_data[user_id].pop("question_index", None)
 
                 user_states[user_id].append("awaiting_add_or_cancel_duplicate")
@@ -682,27 +2403,30 @@ async def handle_messages(client: Client, message: Message):
     if state == "awaiting_input_confirmation":
         if text == LABEL_CONFIRM_SAVE:
             await message.reply_text("Menyimpan data...", reply_markup=ReplyKeyboardRemove())
+            photo_upload: Optional[asyncio.Task] = None
             try:
-                dev = user_data[user_id]["device_type"]; cfg = DEVICE_CONFIG[dev]; ws = ss.worksheet(cfg["worksheet_name"])
-                req_cols = ["No"] + [q["key"] for q in cfg["questions"]]
-                headers = ensure_headers(ws, req_cols)
-
+                dev = user_data[user_id]["device_type"]; cfg = DEVICE_CONFIG[dev]
                 photo_key = next((q['key'] for q in cfg['questions'] if q['type'] == 'photo'), None)
                 photo_msg_id = user_data[user_id].get(photo_key)
                 if not photo_msg_id:
                     await message.reply_text("Foto perangkat wajib. Data tidak disimpan.", reply_markup=ReplyKeyboardRemove())
                     return await show_main_menu(message)
 
+                # Biasanya foto sudah di-upload sejak dikirim (pre-upload); kalau tidak ada,
+                # upload dimulai sekarang dan berjalan bersamaan dengan persiapan baris sheet
+                detail_key = "Detail Perangkat" if dev in ["SFP", "Patch Cord"] else "Jenis Perangkat"
+                detail = user_data[user_id].get(detail_key, "UNKNOWN")
+                t_save = time.perf_counter()
+                photo_upload = pending_photos.take(user_id, photo_msg_id, dev, detail) \
+                    or start_photo_upload(user_id, photo_msg_id, dev, detail)
+
+                ws = await gcall(schema.worksheet, cfg["worksheet_name"])
+                req_cols = ["No"] + [q["key"] for q in cfg["questions"]]
+                headers = await gcall(ensure_headers, ws, req_cols)
+
                 try:
-                    photo_msg = await app.get_messages(user_id, photo_msg_id)
-                    raw = (await app.download_media(photo_msg, in_memory=True)).getvalue()
-                    
-                    detail_key = "Detail Perangkat" if dev in ["SFP", "Patch Cord"] else "Jenis Perangkat"
-                    detail = user_data[user_id].get(detail_key, "UNKNOWN")
-                    
-                    safe_tail = datetime.now().strftime('%Y%m%d%H%M%S')
-                    file_name = f"{dev}-{detail}-{safe_tail}.jpg"
-                    link_to_save = upload_photo_to_drive(raw, file_name, dev, detail)
+                    link_to_save = await photo_upload
+                    t_photo = time.perf_counter() - t_save
                     if not link_to_save:
                         await message.reply_text("Gagal mengunggah foto ke Drive. Data tidak disimpan. Silakan coba lagi.", reply_markup=ReplyKeyboardRemove())
                         return await show_main_menu(message)
@@ -714,50 +2438,25 @@ async def handle_messages(client: Client, message: Message):
                 final_map = {h: (link_to_save if h == "Link Foto" else user_data[user_id].get(h, "N/A")) for h in headers if h != "No"}
 
                 if dev == "Patch Cord":
-                    d  = final_map.get("Detail Perangkat")
-                    k1 = final_map.get("Konektor 1")
-                    k2 = final_map.get("Konektor 2")
-                    uk = final_map.get("Ukuran (PC)")
-                    
-                    nomor_baru = next_no(ws)
-                    final_row = [nomor_baru if h == "No" else final_map.get(h, "") for h in headers]
-                    ws.append_row(final_row, value_input_option='USER_ENTERED')
-                    
-                    try:
-                        ws.sort((2, 'asc')) # Kolom B = "Detail Perangkat"
-                        renumber_worksheet(ws) # Fix the 'No' column
-                        logger.info(f"Worksheet '{ws.title}' diurutkan dan dinomori ulang.")
-                    except Exception as e:
-                        logger.error(f"Gagal mengurutkan/menomori ulang '{ws.title}': {e}")
-
-                    detail_no_ket = join_detail_pc_no_ket(d, k1, k2, uk)
-                    append_log("INSERT", ws.title, detail_no_ket, user_id, username, ket=(final_map.get("Keterangan") or ""))
-                    await message.reply_text("Data baru berhasil disimpan.")
-
+                    detail_no_ket = join_detail_pc_no_ket(final_map.get("Detail Perangkat"), final_map.get("Konektor 1"),
+                                                          final_map.get("Konektor 2"), final_map.get("Ukuran (PC)"))
                 elif dev == "Subcard":
-                    nomor_baru = next_no(ws)
-                    final_row = [nomor_baru if h == "No" else final_map.get(h, "") for h in headers]
-                    ws.append_row(final_row, value_input_option='USER_ENTERED')
-
-                    try:
-                        ws.sort((2, 'asc')) # Kolom B = "Jenis Perangkat"
-                        renumber_worksheet(ws) # Fix the 'No' column
-                        logger.info(f"Worksheet '{ws.title}' diurutkan dan dinomori ulang.")
-                    except Exception as e:
-                        logger.error(f"Gagal mengurutkan/menomori ulang '{ws.title}': {e}")
-                    
-                    detail_no_ket = join_detail_subcard_no_ket(final_map) 
-                    append_log("INSERT", ws.title, detail_no_ket, user_id, username, ket=(final_map.get("Keterangan") or "")) # Keterangan akan kosong
-                    await message.reply_text("Data baru berhasil disimpan.")
+                    detail_no_ket = join_detail_subcard_no_ket(final_map)
                 else:
-                    nomor_baru = next_no(ws)
-                    final_row = [nomor_baru if h == "No" else final_map.get(h, "") for h in headers]
-                    ws.append_row(final_row, value_input_option='USER_ENTERED')
                     detail_no_ket = join_detail_sfp_no_ket(final_map)
-                    append_log("INSERT", ws.title, detail_no_ket, user_id, username, ket=(final_map.get("Keterangan") or ""))
-                    await message.reply_text("Data berhasil disimpan.")
+
+                log_values = log_row("INSERT", ws.title, detail_no_ket, user_id, username, final_map.get("Keterangan") or "")
+                t_sheet = time.perf_counter()
+                await gcall(save_new_row, ws, headers, final_map, dev in ["Patch Cord", "Subcard"], log_values)
+                logger.info(f"Simpan {dev}: tunggu foto {t_photo:.2f}s, tulis sheet {time.perf_counter() - t_sheet:.2f}s, "
+                            f"total {time.perf_counter() - t_save:.2f}s")
+                await message.reply_text("Data berhasil disimpan." if dev == "SFP" else "Data baru berhasil disimpan.")
             except Exception:
                 logger.exception("Gagal menyimpan")
+                if photo_upload and not photo_upload.done():
+                    photo_upload.cancel()
+                elif photo_upload and not photo_upload.cancelled() and not photo_upload.exception() and photo_upload.result():
+                    await gcall(delete_photo_from_drive, extract_drive_id_from_url(photo_upload.result()))
                 await message.reply_text("Gagal menyimpan data.", reply_markup=ReplyKeyboardRemove())
             return await show_main_menu(message)
         await message.reply_text("Dibatalkan.", reply_markup=ReplyKeyboardRemove()); return await show_main_menu(message)
@@ -784,14 +2483,16 @@ async def handle_messages(client: Client, message: Message):
         await message.reply_text("Menambahkan jumlah...", reply_markup=ReplyKeyboardRemove())
         try:
             data = user_data[user_id]
-            ws = data['duplicate_ws']
-            row_num = data['duplicate_row_num']
-            row_data = data['duplicate_row_data']
-
-            qty_col_idx = ws.row_values(1).index("Jumlah") + 1
-            old_qty = int(str(row_data.get("Jumlah", "0")).strip() or "0")
-            new_qty = old_qty + add_qty
-            ws.update_cell(row_num, qty_col_idx, str(new_qty))
+            d, k1, k2, uk = (data.get(k) for k in ("Detail Perangkat", "Konektor 1", "Konektor 2", "Ukuran (PC)"))
+            async with item_locks.hold("Patch Cord", *pc_key(d, k1, k2, uk)):
+                ws, row_num, row_data = await gcall(find_patchcord_row, d, k1, k2, uk, fresh=True)
+                if not row_num:
+                    await message.reply_text("Item tidak ditemukan. Mungkin sudah dihapus oleh user lain.")
+                    return
+                qty_col_idx = await gcall(schema.col, ws, "Jumlah")
+                old_qty = int(str(row_data.get("Jumlah", "0")).strip() or "0")
+                new_qty = old_qty + add_qty
+                await gcall(sheet_update_cell, ws, row_num, qty_col_idx, str(new_qty), row_data)
 
             if ws.title == "Patch Cord":
                 d = row_data.get("Detail Perangkat")
@@ -805,7 +2506,7 @@ async def handle_messages(client: Client, message: Message):
                 detail_no_ket = "N/A"
 
             log_ket = f"Jumlah ditambahkan {add_qty} (dari {old_qty} menjadi {new_qty})"
-            append_log("UPDATE", ws.title, detail_no_ket, user_id, username, ket=log_ket)
+            await gcall(append_log, "UPDATE", ws.title, detail_no_ket, user_id, username, ket=log_ket)
 
             await message.reply_text(f"Jumlah berhasil ditambahkan. Stok sekarang: {new_qty}")
         except Exception:
@@ -831,12 +2532,12 @@ async def handle_messages(client: Client, message: Message):
         sn = text.strip()
         if not sn: return await message.reply_text("SN tidak boleh kosong.")
         await message.reply_text(f"Mencari SN: {sn}...", reply_markup=ReplyKeyboardRemove())
-        ws, row_num, row_data = find_sn_in_all_sheets(sn)
+        ws, row_num, row_data = await gcall(find_sn_in_all_sheets, sn)
         if not row_num or ws.title != "SFP": await message.reply_text("SN tidak ditemukan di sheet SFP.", reply_markup=NAVIGATION_KEYBOARD); return
         summary = build_summary_text(ws.title, row_data)
         bullets = bullets_from_detail(ws.title, summary)
         user_states[user_id].append("awaiting_delete_confirmation")
-        user_data[user_id].update({'worksheet_to_edit': ws, 'row_to_delete': row_num, 'item_summary': summary, 'item_rowdata': row_data})
+        user_data[user_id].update(item_ref(ws, row_num, row_data), item_summary=summary)
         return await message.reply_text(f"Konfirmasi Hapus - {ws.title}\n\n{bullets}\n\nYakin hapus?", reply_markup=DELETE_CONFIRM_KEYBOARD)
 
     if state == "awaiting_pc_detail_delete":
@@ -881,14 +2582,13 @@ async def handle_messages(client: Client, message: Message):
         pos = user_data[user_id]["delete_pos"]
 
         await message.reply_text(f"Mencari: {jns} | {kap} | Posisi: {pos}...", reply_markup=ReplyKeyboardRemove())
-        ws, row_num, row_data = find_subcard_row(jns, kap, pos)
+        ws, row_num, row_data = await gcall(find_subcard_row, jns, kap, pos)
         
         if not row_num:
             await message.reply_text("Kombinasi tidak ditemukan.", reply_markup=NAVIGATION_KEYBOARD); return
         
         summary = build_summary_text(ws.title, row_data)
-        user_data[user_id].update({'worksheet_to_edit': ws, 'row_to_edit': row_num, 'item_summary': summary, 'item_rowdata': row_data})
-        user_data[user_id]['row_to_delete'] = row_num
+        user_data[user_id].update(item_ref(ws, row_num, row_data), item_summary=summary)
         bullets = bullets_from_detail(ws.title, summary)
         user_states[user_id].append("awaiting_delete_confirmation")
         await message.reply_text(f"Konfirmasi Hapus - {ws.title}\n\n{bullets}\n\nYakin hapus?", reply_markup=DELETE_CONFIRM_KEYBOARD)
@@ -896,16 +2596,17 @@ async def handle_messages(client: Client, message: Message):
 
     if state == "awaiting_delete_confirmation":
         if text == LABEL_CONFIRM_DELETE:
-            ws = user_data[user_id]['worksheet_to_edit']
-            row_num = user_data[user_id].get('row_to_delete') or user_data[user_id].get('row_to_edit')
-            row_data = user_data[user_id].get('item_rowdata', {})
             await message.reply_text("Menghapus data dan foto terkait...", reply_markup=ReplyKeyboardRemove())
             try:
+                ws, row_num, row_data = await gcall(resolve_item, user_data[user_id])
+                if not row_num:
+                    await message.reply_text("Item tidak ditemukan. Mungkin sudah dihapus oleh user lain.")
+                    return await show_main_menu(message)
                 photo_link = row_data.get("Link Foto")
                 if photo_link:
                     file_id = extract_drive_id_from_url(photo_link)
                     if file_id:
-                        delete_photo_from_drive(file_id)
+                        await gcall(delete_photo_from_drive, file_id)
                     else:
                         logger.warning(f"Gagal mengekstrak ID Drive dari link: {photo_link}")
 
@@ -919,9 +2620,9 @@ async def handle_messages(client: Client, message: Message):
                 else:
                     detail_no_ket = join_detail_sfp_no_ket(row_data)
 
-                ws.delete_rows(row_num)
-                renumber_worksheet(ws)
-                append_log("DELETE", ws.title, detail_no_ket, user_id, username, ket=row_data.get("Keterangan",""))
+                row_num = await gcall(sheet_delete_row, ws, row_num, row_data)
+                await gcall(renumber_worksheet, ws, row_num)
+                await gcall(append_log, "DELETE", ws.title, detail_no_ket, user_id, username, ket=row_data.get("Keterangan",""))
                 await message.reply_text("Data dan foto berhasil dihapus.")
             except Exception:
                 logger.exception("Gagal hapus"); await message.reply_text("Gagal menghapus data.")
@@ -956,12 +2657,12 @@ async def handle_messages(client: Client, message: Message):
         if text == "Patch Cord":
             user_states[user_id].append("awaiting_item_selection_for_edit_qty")
             try:
-                ws = ss.worksheet("Patch Cord")
-                records = ws.get_all_records()
+                ws = await gcall(schema.worksheet, "Patch Cord")
+                records = await gcall(sheet_cache.records, ws, stale_ok=True)
                 if not records:
                     await message.reply_text("Tidak ada data Patch Cord untuk diubah.", reply_markup=ReplyKeyboardRemove())
                     return await show_main_menu(message)
-                buttons = []
+                items = []
                 grouped = defaultdict(int)
                 for rec in records:
                     key_tuple = (
@@ -976,10 +2677,9 @@ async def handle_messages(client: Client, message: Message):
                     grouped[key] += qty
                 for key, total_qty in sorted(grouped.items()):
                     if total_qty >= 0: 
-                        callback_data = f"editqty_pc_detail::{'::'.join(key)}" 
-                        buttons.append([InlineKeyboardButton(f"{join_detail_pc_no_ket(*key)} (Stok: {total_qty})", callback_data=callback_data)])
+                        items.append((f"{join_detail_pc_no_ket(*key)} (Stok: {total_qty})", "editqty_pc", key))
                 await message.reply_text("Pilih kombinasi Patch Cord yang ingin diubah jumlahnya:", reply_markup=NAVIGATION_KEYBOARD)
-                await message.reply_text("Daftar item:", reply_markup=InlineKeyboardMarkup(buttons))
+                await send_picker(message, user_id, items)
             except Exception:
                 logger.exception("Gagal memuat item PC untuk ubah jumlah.")
                 await message.reply_text("Gagal memuat data. Mohon coba lagi.", reply_markup=ReplyKeyboardRemove())
@@ -988,12 +2688,12 @@ async def handle_messages(client: Client, message: Message):
         elif text == "Subcard":
             user_states[user_id].append("awaiting_item_selection_for_edit_qty")
             try:
-                ws = ss.worksheet("Subcard")
-                records = ws.get_all_records()
+                ws = await gcall(schema.worksheet, "Subcard")
+                records = await gcall(sheet_cache.records, ws, stale_ok=True)
                 if not records:
                     await message.reply_text("Tidak ada data Subcard untuk diubah.", reply_markup=ReplyKeyboardRemove())
                     return await show_main_menu(message)
-                buttons = []
+                items = []
                 for i, rec in enumerate(records):
                     key_tuple = (
                         rec.get("Jenis Perangkat", ""), 
@@ -1003,12 +2703,11 @@ async def handle_messages(client: Client, message: Message):
                     key = tuple(str(k) for k in key_tuple)
                     port_qty = str(rec.get("Jumlah Port", "0")).strip() or "0"
                     
-                    callback_data = f"editqty_jaringan_detail::{'::'.join(key)}" 
                     row_data_mock = {"Jenis Perangkat": key[0], "Kapasitas": key[1], "Posisi": key[2]}
-                    buttons.append([InlineKeyboardButton(f"{join_detail_subcard_no_ket(row_data_mock)} ({port_qty} Port)", callback_data=callback_data)])
+                    items.append((f"{join_detail_subcard_no_ket(row_data_mock)} ({port_qty} Port)", "editqty_jaringan", key))
 
                 await message.reply_text("Pilih item Subcard yang ingin diubah Jumlah Port-nya:", reply_markup=NAVIGATION_KEYBOARD)
-                await message.reply_text("Daftar item:", reply_markup=InlineKeyboardMarkup(buttons))
+                await send_picker(message, user_id, items)
             except Exception:
                 logger.exception("Gagal memuat item Subcard untuk ubah jumlah.")
                 await message.reply_text("Gagal memuat data. Mohon coba lagi.", reply_markup=ReplyKeyboardRemove())
@@ -1023,20 +2722,19 @@ async def handle_messages(client: Client, message: Message):
             await clear_user_session(user_id)
             user_states[user_id].append("awaiting_item_selection_for_edit_ket")
             try:
-                ws = ss.worksheet(DEVICE_CONFIG[text]["worksheet_name"])
-                records = ws.get_all_records()
+                ws = await gcall(schema.worksheet, DEVICE_CONFIG[text]["worksheet_name"])
+                records = await gcall(sheet_cache.records, ws, stale_ok=True)
 
                 if not records:
                     await message.reply_text(f"Tidak ada data {text} untuk diubah.", reply_markup=ReplyKeyboardRemove())
                     return await show_main_menu(message)
                 
-                buttons = []
+                items = []
                 if text == "SFP":
                     for i, rec in enumerate(records):
                         sn = rec.get("SN")
                         if sn:
-                            callback_data = f"editket_sfp_row_{i+2}"
-                            buttons.append([InlineKeyboardButton(f"SN: {sn}", callback_data=callback_data)])
+                            items.append((f"SN: {sn}", "editket_sfp", (str(sn),)))
                 elif text == "Patch Cord":
                     grouped = defaultdict(list)
                     for rec in records:
@@ -1049,10 +2747,9 @@ async def handle_messages(client: Client, message: Message):
                         key = tuple(str(k) for k in key_tuple)
                         grouped[key].append(rec)
                     
-                    for key, items in sorted(grouped.items()):
-                        total_qty = sum(int(str(item.get("Jumlah", "0")).strip() or "0") for item in items)
-                        callback_data = f"editket_pc_detail::{'::'.join(key)}" 
-                        buttons.append([InlineKeyboardButton(f"{join_detail_pc_no_ket(*key)} (Stok: {total_qty})", callback_data=callback_data)])
+                    for key, recs in sorted(grouped.items()):
+                        total_qty = sum(int(str(rec.get("Jumlah", "0")).strip() or "0") for rec in recs)
+                        items.append((f"{join_detail_pc_no_ket(*key)} (Stok: {total_qty})", "editket_pc", key))
                 
                 elif text == "Subcard":
                     grouped = defaultdict(list)
@@ -1068,12 +2765,11 @@ async def handle_messages(client: Client, message: Message):
                     for key, row_nums in sorted(grouped.items()):
                         # Kita hanya ambil row pertama karena Posisi seharusnya unik per kombinasi
                         row_num = row_nums[0]
-                        callback_data = f"editket_jaringan_row::{row_num}"
                         row_data_mock = {"Jenis Perangkat": key[0], "Kapasitas": key[1], "Posisi": key[2]}
-                        buttons.append([InlineKeyboardButton(f"{join_detail_subcard_no_ket(row_data_mock)}", callback_data=callback_data)])
+                        items.append((f"{join_detail_subcard_no_ket(row_data_mock)}", "editket_jaringan", key))
 
                 await message.reply_text(f"Pilih item yang ingin diubah keterangannya:", reply_markup=NAVIGATION_KEYBOARD)
-                await message.reply_text("Daftar item:", reply_markup=InlineKeyboardMarkup(buttons))
+                await send_picker(message, user_id, items)
 
             except Exception:
                 logger.exception("Gagal memuat item untuk edit keterangan.")
@@ -1085,7 +2781,7 @@ async def handle_messages(client: Client, message: Message):
     if state == "awaiting_new_ket":
         if is_non_text_message(message): return await message.reply_text("Keterangan harus teks. Jangan kirim media.")
         user_data[user_id]['new_ket'] = text.strip()
-        ws_name = user_data[user_id]['worksheet_to_edit'].title
+        ws_name = user_data[user_id]['worksheet_to_edit']
         bullets = bullets_from_detail(ws_name, user_data[user_id]['item_summary'])
         old_ket = user_data[user_id].get('old_ket','')
         user_states[user_id].append("awaiting_edit_confirmation")
@@ -1093,14 +2789,16 @@ async def handle_messages(client: Client, message: Message):
 
     if state == "awaiting_edit_confirmation":
         if text == LABEL_CONFIRM_UPDATE:
-            ws = user_data[user_id]['worksheet_to_edit']; row_num = user_data[user_id]['row_to_edit']
             new_ket = user_data[user_id]['new_ket']
             await message.reply_text("Mengubah keterangan...", reply_markup=ReplyKeyboardRemove())
             try:
-                ket_col = ws.row_values(1).index("Posisi") + 1
-                ws.update_cell(row_num, ket_col, new_ket)
-                headers = ws.row_values(1); row_vals = ws.row_values(row_num)
-                row_map = dict(zip(headers, row_vals))
+                ws, row_num, row_data = await gcall(resolve_item, user_data[user_id])
+                if not row_num:
+                    await message.reply_text("Item tidak ditemukan. Mungkin sudah dihapus oleh user lain.")
+                    return await show_main_menu(message)
+                ket_col = await gcall(schema.col, ws, user_data[user_id].get('ket_column_name', 'Keterangan'))
+                row_num = await gcall(sheet_update_cell, ws, row_num, ket_col, new_ket, row_data)
+                row_map = await gcall(sheet_cache.row, ws, row_num) or {}
 
                 if ws.title == "Patch Cord":
                     detail_no_ket = join_detail_pc_no_ket(row_map.get('Detail Perangkat','-'), row_map.get('Konektor 1','-'),
@@ -1110,7 +2808,7 @@ async def handle_messages(client: Client, message: Message):
                 else:
                     detail_no_ket = join_detail_sfp_no_ket(row_map)
                 
-                append_log("UPDATE", ws.title, detail_no_ket, user_id, username, ket=f"Keterangan diubah menjadi: {new_ket}")
+                await gcall(append_log, "UPDATE", ws.title, detail_no_ket, user_id, username, ket=f"Keterangan diubah menjadi: {new_ket}")
                 await message.reply_text("Keterangan berhasil diubah.")
             except Exception:
                 logger.exception("Gagal ubah keterangan"); await message.reply_text("Gagal mengubah keterangan.")
@@ -1120,7 +2818,7 @@ async def handle_messages(client: Client, message: Message):
     if state == "awaiting_new_jumlah":
         if not re.fullmatch(r"\d+", text.strip()): return await message.reply_text("Jumlah harus angka. Contoh: 5", reply_markup=NAVIGATION_KEYBOARD)
         user_data[user_id]['new_qty'] = text.strip()
-        ws_name = user_data[user_id]['worksheet_to_edit'].title
+        ws_name = user_data[user_id]['worksheet_to_edit']
         bullets = bullets_from_detail(ws_name, user_data[user_id]['item_summary'])
         old_qty = user_data[user_id].get('old_qty','0'); new_qty = user_data[user_id]['new_qty']
         user_states[user_id].append("awaiting_edit_jumlah_confirmation")
@@ -1128,7 +2826,6 @@ async def handle_messages(client: Client, message: Message):
 
     if state == "awaiting_edit_jumlah_confirmation":
         if text == LABEL_CONFIRM_UPDATE:
-            ws = user_data[user_id]['worksheet_to_edit']; row_num = user_data[user_id]['row_to_edit']
             new_qty = user_data[user_id]['new_qty']
             old_qty = user_data[user_id].get('old_qty','N/A')
             
@@ -1137,10 +2834,13 @@ async def handle_messages(client: Client, message: Message):
 
             await message.reply_text(f"Mengubah {column_to_update}...", reply_markup=ReplyKeyboardRemove())
             try:
-                qty_col = ws.row_values(1).index(column_to_update) + 1
-                ws.update_cell(row_num, qty_col, new_qty)
-                headers = ws.row_values(1); row_vals = ws.row_values(row_num)
-                row_map = dict(zip(headers, row_vals))
+                ws, row_num, row_data = await gcall(resolve_item, user_data[user_id])
+                if not row_num:
+                    await message.reply_text("Item tidak ditemukan. Mungkin sudah dihapus oleh user lain.")
+                    return await show_main_menu(message)
+                qty_col = await gcall(schema.col, ws, column_to_update)
+                row_num = await gcall(sheet_update_cell, ws, row_num, qty_col, new_qty, row_data)
+                row_map = await gcall(sheet_cache.row, ws, row_num) or {}
                 
                 if ws.title == "Patch Cord":
                     detail_no_ket = join_detail_pc_no_ket(row_map.get('Detail Perangkat','-'), row_map.get('Konektor 1','-'),
@@ -1150,7 +2850,7 @@ async def handle_messages(client: Client, message: Message):
                 else:
                     detail_no_ket = join_detail_sfp_no_ket(row_map)
                 
-                append_log("UPDATE", ws.title, detail_no_ket, user_id, username, ket=f"{column_to_update} diubah dari {old_qty} ke {new_qty}")
+                await gcall(append_log, "UPDATE", ws.title, detail_no_ket, user_id, username, ket=f"{column_to_update} diubah dari {old_qty} ke {new_qty}")
                 await message.reply_text(f"{column_to_update} berhasil diubah.")
             except Exception:
                 logger.exception(f"Gagal ubah {column_to_update}"); await message.reply_text(f"Gagal mengubah {column_to_update}.")
@@ -1160,21 +2860,10 @@ async def handle_messages(client: Client, message: Message):
     if state == "awaiting_pemakaian_menu":
         if text == BTN_PEMAKAIAN_LOG:
             try:
-                ws = get_or_create_pemakaian_ws()
-                rows = ws.get_all_values()
-                if len(rows) <= 1:
+                page, nav = await gcall(log_page, "pakai")
+                if not page:
                     return await message.reply_text("Belum ada log pemakaian.", reply_markup=MAIN_MENU_KEYBOARD)
-                last = rows[-10:] if len(rows) > 11 else rows[1:]
-                blocks = ["Log Pemakaian (terbaru di bawah):",""]
-                for r in last:
-                    waktu, uid, uname, jenis, detail, jml, ket_barang, ket = (r+[""]*8)[:8]
-                    blocks.append(f"[{waktu}] {jenis}")
-                    blocks.append(bullets_from_detail(jenis, detail))
-                    if jml: blocks.append(f"- Jumlah: {jml}")
-                    if ket_barang: blocks.append(f"- Keterangan Barang: {ket_barang}")
-                    if ket: blocks.append(f"- Keterangan Pemakaian: {ket}")
-                    blocks.append("")
-                return await message.reply_text("\n".join(blocks), reply_markup=MAIN_MENU_KEYBOARD)
+                return await message.reply_text(page, reply_markup=nav or MAIN_MENU_KEYBOARD)
             except Exception:
                 logger.exception("Gagal ambil log pemakaian"); await message.reply_text("Gagal memuat log pemakaian.", reply_markup=MAIN_MENU_KEYBOARD)
                 return await show_main_menu(message)
@@ -1194,19 +2883,19 @@ async def handle_messages(client: Client, message: Message):
             if text == "SFP":
                 user_states[user_id].append("awaiting_consume_sfp_type")
                 sfp_types = DEVICE_CONFIG["SFP"]["questions"][0]["options"]
-                buttons = [InlineKeyboardButton(t, callback_data=f"consume_sfp_type_{t}") for t in sfp_types]
+                buttons = [InlineKeyboardButton(t, callback_data=cb("consume_sfp_type", t)) for t in sfp_types]
                 rows = [buttons[i:i+2] for i in range(0, len(buttons), 2)]
                 await message.reply_text("Pilih jenis SFP yang akan diambil:", reply_markup=NAVIGATION_KEYBOARD)
                 return await message.reply_text("Daftar jenis:", reply_markup=InlineKeyboardMarkup(rows))
             else:
                 user_states[user_id].append("awaiting_item_selection_for_consume")
                 try:
-                    ws = ss.worksheet(DEVICE_CONFIG[text]["worksheet_name"])
-                    records = ws.get_all_records()
+                    ws = await gcall(schema.worksheet, DEVICE_CONFIG[text]["worksheet_name"])
+                    records = await gcall(sheet_cache.records, ws, stale_ok=True)
                     if not records:
                         await message.reply_text("Tidak ada stok untuk perangkat ini.", reply_markup=ReplyKeyboardRemove())
                         return await show_main_menu(message)
-                    buttons = []
+                    items = []
                     if text == "Patch Cord":
                         grouped = defaultdict(int)
                         for rec in records:
@@ -1217,8 +2906,7 @@ async def handle_messages(client: Client, message: Message):
                             grouped[key] += qty
                         for key, total_qty in sorted(grouped.items()):
                             if total_qty > 0:
-                                callback_data = f"consume_pc_detail::{'::'.join(key)}" 
-                                buttons.append([InlineKeyboardButton(f"{join_detail_pc_no_ket(*key)} (Stok: {total_qty})", callback_data=callback_data)])
+                                items.append((f"{join_detail_pc_no_ket(*key)} (Stok: {total_qty})", "consume_pc", key))
                     
                     elif text == "Subcard":
                         grouped = defaultdict(int)
@@ -1230,12 +2918,11 @@ async def handle_messages(client: Client, message: Message):
                             grouped[key] += qty
                         for key, total_qty in sorted(grouped.items()):
                             if total_qty > 0:
-                                callback_data = f"consume_jaringan_detail::{'::'.join(key)}" 
                                 row_data_mock = {"Jenis Perangkat": key[0], "Kapasitas": key[1], "Posisi": key[2]}
-                                buttons.append([InlineKeyboardButton(f"{join_detail_subcard_no_ket(row_data_mock)} (Stok: {total_qty})", callback_data=callback_data)])
+                                items.append((f"{join_detail_subcard_no_ket(row_data_mock)} (Stok: {total_qty})", "consume_jaringan", key))
 
                     await message.reply_text(f"Pilih item yang ingin diambil:", reply_markup=NAVIGATION_KEYBOARD)
-                    await message.reply_text("Daftar item:", reply_markup=InlineKeyboardMarkup(buttons))
+                    await send_picker(message, user_id, items)
                 except Exception:
                     logger.exception("Gagal memuat item untuk ambil barang.")
                     await message.reply_text("Gagal memuat data. Mohon coba lagi.", reply_markup=ReplyKeyboardRemove())
@@ -1250,7 +2937,7 @@ async def handle_messages(client: Client, message: Message):
         data = user_data[user_id]
         
         d, k1, k2, uk = data['consume_detail'], data['consume_k1'], data['consume_k2'], data['consume_uk']
-        _, _, row_data = find_patchcord_row(d,k1,k2,uk)
+        _, _, row_data = await gcall(find_patchcord_row, d, k1, k2, uk)
         if not row_data: await message.reply_text("Item tidak ditemukan.", reply_markup=NAVIGATION_KEYBOARD); return
         try:
             stok_lama = int(str(row_data.get("Jumlah","0")).strip() or "0")
@@ -1258,7 +2945,7 @@ async def handle_messages(client: Client, message: Message):
             stok_lama = 0
         if qty > stok_lama: return await message.reply_text(f"Stok tidak cukup. Stok tersedia: {stok_lama}")
         user_data[user_id].update({
-            "consume_qty": qty, "consume_before": stok_lama, "consume_row_data": row_data
+            "consume_qty": qty, "consume_before": stok_lama, "consume_ket_barang": str(row_data.get("Keterangan", ""))
         })
         user_states[user_id].append("awaiting_consume_pc_note")
         return await message.reply_text("Masukkan keterangan pemakaian:", reply_markup=NAVIGATION_KEYBOARD)
@@ -1291,33 +2978,30 @@ async def handle_messages(client: Client, message: Message):
                 detail_no_ket = data["consume_detail_no_ket"]
 
             ket_pemakaian = data["consume_ket_pemakaian"]
-            ket_barang = data["consume_row_data"].get("Keterangan", "")
-            ws = ss.worksheet(ws_name)
+            ket_barang = data["consume_ket_barang"]
             d, k1, k2, uk = data["consume_detail"], data["consume_k1"], data["consume_k2"], data["consume_uk"]
             
             await message.reply_text("Memproses pengambilan...", reply_markup=ReplyKeyboardRemove())
             try:
-                _, row_num, row_data = find_patchcord_row(d, k1, k2, uk)
-                if not row_num:
-                    await message.reply_text("Item tidak ditemukan. Mungkin sudah diambil oleh user lain.")
-                    await clear_user_session(user_id)
-                    return await show_main_menu(message)
-                
-                stok_lama = int(str(row_data.get("Jumlah","0")).strip() or "0")
-                if qty > stok_lama:
-                    await message.reply_text("Stok tidak cukup lagi.")
-                    await clear_user_session(user_id)
-                    return await show_main_menu(message)
+                ws = await gcall(schema.worksheet, ws_name)
+                async with item_locks.hold("Patch Cord", *pc_key(d, k1, k2, uk)):
+                    _, row_num, row_data = await gcall(find_patchcord_row, d, k1, k2, uk, fresh=True)
+                    if not row_num:
+                        await message.reply_text("Item tidak ditemukan. Mungkin sudah diambil oleh user lain.")
+                        await clear_user_session(user_id)
+                        return await show_main_menu(message)
 
-                stok_baru = stok_lama - qty
-                qty_col = ws.row_values(1).index("Jumlah") + 1
-                
-                if stok_baru > 0:
-                    ws.update_cell(row_num, qty_col, str(stok_baru))
-                else:
-                    ws.update_cell(row_num, qty_col, "0")
-                
-                append_pemakaian("Patch Cord", detail_no_ket, str(qty), ket_barang, ket_pemakaian, user_id, username)
+                    stok_lama = int(str(row_data.get("Jumlah","0")).strip() or "0")
+                    if qty > stok_lama:
+                        await message.reply_text(f"Stok tidak cukup lagi. Stok tersedia: {stok_lama}")
+                        await clear_user_session(user_id)
+                        return await show_main_menu(message)
+
+                    stok_baru = stok_lama - qty
+                    qty_col = await gcall(schema.col, ws, "Jumlah")
+                    await gcall(sheet_update_cell, ws, row_num, qty_col, str(stok_baru), row_data)
+
+                await gcall(append_pemakaian, "Patch Cord", detail_no_ket, str(qty), ket_barang, ket_pemakaian, user_id, username)
                 await message.reply_text(f"Barang berhasil diambil dan dicatat di log pemakaian. Sisa stok: {stok_baru}", reply_markup=MAIN_MENU_KEYBOARD)
             except Exception:
                 logger.exception("Gagal proses ambil Patch Cord"); await message.reply_text("Gagal memproses pengambilan.")
@@ -1331,7 +3015,7 @@ async def handle_messages(client: Client, message: Message):
         if not ket_pemakaian: return await message.reply_text("Keterangan pemakaian tidak boleh kosong.", reply_markup=NAVIGATION_KEYBOARD)
         data = user_data[user_id]
         sn = data["consume_sn"]
-        detail_no_ket = join_detail_sfp_no_ket(data["consume_rowdata"])
+        detail_no_ket = data["consume_detail_no_ket"]
         user_data[user_id]["consume_ket_pemakaian"] = ket_pemakaian
         user_data[user_id]["consume_detail_no_ket"] = detail_no_ket
         preview = f"SN: {sn} | Ket: {ket_pemakaian}"
@@ -1345,23 +3029,20 @@ async def handle_messages(client: Client, message: Message):
             sn = data["consume_sn"]
             ket_pemakaian = data["consume_ket_pemakaian"]
             detail_no_ket = data["consume_detail_no_ket"]
-            ket_barang = data["consume_rowdata"].get("Keterangan", "")
-            ws = ss.worksheet(data["consume_ws_name"])
+            ket_barang = data["consume_ket_barang"]
             
             await message.reply_text("Memproses pengambilan...", reply_markup=ReplyKeyboardRemove())
             try:
-                headers = ws.row_values(1)
-                sn_col = headers.index("SN") + 1
-                try:
-                    row_to_delete = ws.find(sn, in_column=sn_col).row
-                    ws.delete_rows(row_to_delete)
-                    renumber_worksheet(ws)
-                    append_pemakaian("SFP", detail_no_ket, "1", ket_barang, ket_pemakaian, user_id, username)
-                    await message.reply_text("Barang berhasil diambil dan dicatat di log pemakaian.", reply_markup=MAIN_MENU_KEYBOARD)
-                except gspread.exceptions.CellNotFound:
-                    await message.reply_text("SN tidak ditemukan atau sudah diambil. Mohon pilih dari daftar.", reply_markup=ReplyKeyboardRemove())
-                    await clear_user_session(user_id)
-                    return await show_main_menu(message)
+                async with item_locks.hold("SN", *sn_key(sn)):
+                    ws, row_to_delete, row_data = await gcall(find_sn_in_all_sheets, sn, fresh=True)
+                    if not row_to_delete or ws.title != data["consume_ws_name"]:
+                        await message.reply_text("SN tidak ditemukan atau sudah diambil. Mohon pilih dari daftar.", reply_markup=ReplyKeyboardRemove())
+                        await clear_user_session(user_id)
+                        return await show_main_menu(message)
+                    row_to_delete = await gcall(sheet_delete_row, ws, row_to_delete, row_data)
+                    await gcall(renumber_worksheet, ws, row_to_delete)
+                await gcall(append_pemakaian, "SFP", detail_no_ket, "1", ket_barang, ket_pemakaian, user_id, username)
+                await message.reply_text("Barang berhasil diambil dan dicatat di log pemakaian.", reply_markup=MAIN_MENU_KEYBOARD)
             except Exception:
                 logger.exception("Gagal proses ambil SFP"); await message.reply_text("Gagal memproses pengambilan.")
             finally:
@@ -1376,7 +3057,7 @@ async def handle_messages(client: Client, message: Message):
         data = user_data[user_id]
         
         jns, kap, pos = data['consume_jenis'], data['consume_kap'], data['consume_pos']
-        _, _, row_data = find_subcard_row(jns, kap, pos)
+        _, _, row_data = await gcall(find_subcard_row, jns, kap, pos)
         if not row_data: await message.reply_text("Item tidak ditemukan.", reply_markup=NAVIGATION_KEYBOARD); return
         try:
             stok_lama = int(str(row_data.get("Jumlah","0")).strip() or "0")
@@ -1384,7 +3065,7 @@ async def handle_messages(client: Client, message: Message):
             stok_lama = 0
         if qty > stok_lama: return await message.reply_text(f"Stok tidak cukup. Stok tersedia: {stok_lama}")
         user_data[user_id].update({
-            "consume_qty": qty, "consume_before": stok_lama, "consume_row_data": row_data
+            "consume_qty": qty, "consume_before": stok_lama, "consume_ket_barang": str(row_data.get("Keterangan", ""))
         })
         user_states[user_id].append("awaiting_consume_jaringan_note")
         return await message.reply_text("Masukkan keterangan pemakaian:", reply_markup=NAVIGATION_KEYBOARD)
@@ -1394,7 +3075,7 @@ async def handle_messages(client: Client, message: Message):
         if not ket_pemakaian: return await message.reply_text("Keterangan pemakaian tidak boleh kosong.", reply_markup=NAVIGATION_KEYBOARD)
         data = user_data[user_id]
         qty = data["consume_qty"]
-        detail_no_ket = join_detail_subcard_no_ket(data["consume_row_data"])
+        detail_no_ket = data["consume_detail_no_ket"]
         user_data[user_id]["consume_ket_pemakaian"] = ket_pemakaian
         user_data[user_id]["consume_detail_no_ket"] = detail_no_ket
         preview = f"{detail_no_ket} | Jumlah: {qty} | Ket: {ket_pemakaian}"
@@ -1409,33 +3090,30 @@ async def handle_messages(client: Client, message: Message):
             qty = data["consume_qty"]
             detail_no_ket = data["consume_detail_no_ket"]
             ket_pemakaian = data["consume_ket_pemakaian"]
-            ket_barang = data["consume_row_data"].get("Keterangan", "") # Akan kosong, tapi tidak error
-            ws = ss.worksheet(ws_name)
+            ket_barang = data["consume_ket_barang"] # Akan kosong, tapi tidak error
             jns, kap, pos = data['consume_jenis'], data['consume_kap'], data['consume_pos']
             
             await message.reply_text("Memproses pengambilan...", reply_markup=ReplyKeyboardRemove())
             try:
-                _, row_num, row_data = find_subcard_row(jns, kap, pos)
-                if not row_num:
-                    await message.reply_text("Item tidak ditemukan. Mungkin sudah diambil oleh user lain.")
-                    await clear_user_session(user_id)
-                    return await show_main_menu(message)
-                
-                stok_lama = int(str(row_data.get("Jumlah","0")).strip() or "0")
-                if qty > stok_lama:
-                    await message.reply_text("Stok tidak cukup lagi.")
-                    await clear_user_session(user_id)
-                    return await show_main_menu(message)
+                ws = await gcall(schema.worksheet, ws_name)
+                async with item_locks.hold("Subcard", *subcard_key(jns, kap, pos)):
+                    _, row_num, row_data = await gcall(find_subcard_row, jns, kap, pos, fresh=True)
+                    if not row_num:
+                        await message.reply_text("Item tidak ditemukan. Mungkin sudah diambil oleh user lain.")
+                        await clear_user_session(user_id)
+                        return await show_main_menu(message)
 
-                stok_baru = stok_lama - qty
-                qty_col = ws.row_values(1).index("Jumlah") + 1
-                
-                if stok_baru > 0:
-                    ws.update_cell(row_num, qty_col, str(stok_baru))
-                else:
-                    ws.update_cell(row_num, qty_col, "0")
-                
-                append_pemakaian("Subcard", detail_no_ket, str(qty), ket_barang, ket_pemakaian, user_id, username)
+                    stok_lama = int(str(row_data.get("Jumlah","0")).strip() or "0")
+                    if qty > stok_lama:
+                        await message.reply_text(f"Stok tidak cukup lagi. Stok tersedia: {stok_lama}")
+                        await clear_user_session(user_id)
+                        return await show_main_menu(message)
+
+                    stok_baru = stok_lama - qty
+                    qty_col = await gcall(schema.col, ws, "Jumlah")
+                    await gcall(sheet_update_cell, ws, row_num, qty_col, str(stok_baru), row_data)
+
+                await gcall(append_pemakaian, "Subcard", detail_no_ket, str(qty), ket_barang, ket_pemakaian, user_id, username)
                 await message.reply_text(f"Barang berhasil diambil dan dicatat di log pemakaian. Sisa stok: {stok_baru}", reply_markup=MAIN_MENU_KEYBOARD)
             except Exception:
                 logger.exception("Gagal proses ambil Subcard"); await message.reply_text("Gagal memproses pengambilan.")
@@ -1444,337 +3122,442 @@ async def handle_messages(client: Client, message: Message):
             return await show_main_menu(message)
         await message.reply_text("Dibatalkan.", reply_markup=ReplyKeyboardRemove()); return await show_main_menu(message)
 
+# =========================
+# INLINE QUERY (PENCARIAN)
+# =========================
+# Hasil yang dipilih dikirim sebagai teks identitas item (SN untuk SFP, Posisi untuk
+# Subcard), jadi bisa langsung dipakai di langkah yang meminta SN/Posisi diketik.
+INLINE_CACHE_TIME = 5
+_search_refresh: Optional[asyncio.Task] = None
+
+def search_result_article(title: str, row_num: int, rec: Dict[str, Any], field: str) -> InlineQueryResultArticle:
+    sn, pos = str(rec.get("SN", "")).strip(), str(rec.get("Posisi", "")).strip()
+    if sn: send, head, detail = sn, f"SN {sn}", join_detail_sfp_no_ket(rec)
+    elif pos: send, head, detail = pos, pos, join_detail_subcard_no_ket(rec)
+    else:
+        send = head = detail = join_detail_pc_no_ket(rec.get("Detail Perangkat", "-"), rec.get("Konektor 1", "-"),
+                                                     rec.get("Konektor 2", "-"), rec.get("Ukuran (PC)", "-"))
+    ket = str(rec.get("Keterangan", "")).strip()
+    return InlineQueryResultArticle(
+        id=f"{title}:{row_num}", title=f"{head} ({title})",
+        description=detail + (f" | Ket: {ket}" if ket else ""),
+        input_message_content=InputTextMessageContent(send),
+    )
+
+@app.on_inline_query()
+async def handle_inline_query(client: Client, iq: InlineQuery):
+    global _search_refresh
+    stale = search_index.sync()
+    if stale and google_ready.is_set() and (not _search_refresh or _search_refresh.done()):
+        _search_refresh = asyncio.create_task(load_sheets(stale))
+    results = [search_result_article(*hit) for hit in search_index.search(iq.query)]
+    await iq.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=True)
 
 # =========================
 # CALLBACK (DISPLAY & EDIT)
 # =========================
+# callback_data berbentuk "aksi[:arg...]" untuk tombol statis, atau "~token" untuk
+# tombol yang membawa data item (lihat CallbackTokens). Aksi didispatch lewat tabel.
+CALLBACK_ACTIONS: Dict[str, Callable[..., Any]] = {}
+
+def callback_action(name: str):
+    def register(fn):
+        CALLBACK_ACTIONS[name] = fn
+        return fn
+    return register
+
 @app.on_callback_query()
 async def handle_display_callback(client: Client, q: CallbackQuery):
-    user_id = q.from_user.id
-    username = q.from_user.username
-    await q.answer() 
-    
-    if q.data == "cancel_inline":
-        await q.message.edit_text("Operasi dibatalkan.", reply_markup=None)
-        await clear_user_session(user_id)
-        await q.message.reply_text("Menu Utama:", reply_markup=MAIN_MENU_KEYBOARD)
-        return
+    await q.answer()
+    if q.data.startswith("~"):
+        entry = callback_tokens.resolve(q.data)
+        if not entry:
+            await q.message.reply_text("Tombol ini sudah kedaluwarsa. Silakan buka menu lagi."); return
+        action, args = entry
+    else:
+        action, *args = q.data.split(":")
+    handler = CALLBACK_ACTIONS.get(action)
+    if not handler:
+        logger.warning(f"Callback tidak dikenal: {q.data!r}"); return
+    await handler(q, *args)
+
+@callback_action("cancel_inline")
+async def cb_cancel_inline(q: CallbackQuery):
+    await q.message.edit_text("Operasi dibatalkan.", reply_markup=None)
+    await clear_user_session(q.from_user.id)
+    await q.message.reply_text("Menu Utama:", reply_markup=MAIN_MENU_KEYBOARD)
+
+@callback_action("consume_back")
+async def cb_consume_back(q: CallbackQuery):
+    await q.message.delete()
+    user_states[q.from_user.id].append("awaiting_pemakaian_menu")
+    await q.message.reply_text("Pilih menu pemakaian:", reply_markup=PEMAKAIAN_KEYBOARD)
+
+@callback_action("noop")
+async def cb_noop(q: CallbackQuery):
+    pass # Tombol penanda halaman
+
+@callback_action("picker")
+async def cb_picker(q: CallbackQuery, page: str):
+    items = user_data.get(q.from_user.id, {}).get("picker_items")
+    if not items:
+        await q.edit_message_text("Daftar sudah kedaluwarsa. Silakan buka menu lagi."); return
+    await q.edit_message_reply_markup(picker_markup(items, int(page)))
+
+@callback_action("logtail")
+async def cb_logtail(q: CallbackQuery, kind: str, end_row: str):
+    try:
+        page, nav = await gcall(log_page, kind, int(end_row))
+        if page: await q.edit_message_text(page, reply_markup=nav)
+    except Exception:
+        logger.exception("Gagal ambil halaman log"); await q.message.reply_text("Gagal memuat log.")
 
-    if q.data == "consume_back":
-        await q.message.delete()
-        user_states[user_id].append("awaiting_pemakaian_menu")
-        await q.message.reply_text("Pilih menu pemakaian:", reply_markup=PEMAKAIAN_KEYBOARD)
-        return
-        
-    if q.data.startswith("display_"):
-        if q.data == "display_close": await q.message.delete(); return
-        if q.data == "display_back_to_select": await q.edit_message_text("Pilih jenis perangkat untuk rekap:", reply_markup=get_device_selection_keyboard("display")); return
-        
-        device_type = q.data.split("_", 1)[1]
-        await q.edit_message_text(f"Menghitung stok untuk {device_type}...")
-        
-        try:
-            config = DEVICE_CONFIG[device_type]
-            ws = ss.worksheet(config["worksheet_name"])
-            records = ws.get_all_records()
-            headers = ws.row_values(1)
-
-            if device_type == "Subcard":
-                # Mengelompokkan list rekap berdasarkan Jenis Perangkat
-                grouped_by_jenis = defaultdict(list)
-                for r in records:
-                    jenis = r.get("Jenis Perangkat")
-                    if not jenis: continue
-
-                    kapasitas = r.get("Kapasitas", "N/A")
-                    posisi = r.get("Posisi", "N/A")
-                    port_count = str(r.get("Jumlah Port", "0")).strip() or "0"
-                    
-                    # Membuat string format: "12 x 10G (di STO Malang)"
-                    rekap_string = f"{port_count} x {kapasitas} (di {posisi})"
-                    grouped_by_jenis[jenis].append(rekap_string)
-                
-                # Membuat teks respons
-                lines = [f"📊 Rekapitulasi Stok - {device_type}"]
-                if not grouped_by_jenis:
-                    lines.append("\nTidak ada data untuk ditampilkan.")
-                else:
-                    lines.append("")
-                    for jenis, rekap_list in sorted(grouped_by_jenis.items()):
-                        lines.append(f"{jenis}")
-                        for item_rekap in sorted(rekap_list):
-                            lines.append(f"  - {item_rekap}")
-                        lines.append("")
+@callback_action("display_close")
+async def cb_display_close(q: CallbackQuery):
+    await q.message.delete()
 
-                resp = "\n".join(lines)
+@callback_action("display_back_to_select")
+async def cb_display_back_to_select(q: CallbackQuery):
+    await q.edit_message_text("Pilih jenis perangkat untuk rekap:", reply_markup=get_device_selection_keyboard("display"))
 
-            elif "Jumlah" in headers: # Untuk Patch Cord
-                totals: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
-                
-                group_by_keys = config["display_group_by"]
-                detail_key = "Detail Perangkat"
+@callback_action("display")
+async def cb_display(q: CallbackQuery, device_type: str, page: Optional[str] = None):
+    if page is None: await q.edit_message_text(f"Menghitung stok untuk {device_type}...")
+    try:
+        pages = await gcall(recap_pages, device_type)
+        n = max(0, min(int(page or 0), len(pages) - 1))
+        markup = get_device_selection_keyboard("display")
+        if len(pages) > 1:
+            nav = []
+            if n > 0: nav.append(InlineKeyboardButton("« Sebelumnya", callback_data=f"display:{device_type}:{n - 1}"))
+            nav.append(InlineKeyboardButton(f"{n + 1}/{len(pages)}", callback_data="noop"))
+            if n < len(pages) - 1: nav.append(InlineKeyboardButton("Berikutnya »", callback_data=f"display:{device_type}:{n + 1}"))
+            markup.inline_keyboard.insert(0, nav)
+        await q.edit_message_text(pages[n] + recap_footer(device_type), reply_markup=markup)
+    except Exception:
+        logger.exception("Gagal ambil data display"); await q.edit_message_text("Gagal mengambil data.")
 
-                for r in records:
-                    detail = r.get(detail_key)
-                    if not detail: continue
-                    
-                    key_parts = [str(r.get(k, "N/A")) for k in group_by_keys]
-                    k1 = r.get("Konektor 1", "N/A")
-                    k2 = r.get("Konektor 2", "N/A")
-                    key_parts[1] = f"{k1} → {k2}"
-                    key_parts.pop(2) 
-                    
-                    key = " / ".join(key_parts)
-                    
-                    try: qty = int(str(r.get("Jumlah", "0")).strip() or "0")
-                    except ValueError: qty = 0
-                    totals[detail][key] += qty
-                
-                lines = [f"📊 Rekapitulasi Stok - {device_type}", ""]
-                for d, combos in sorted(totals.items()):
-                    lines.append(f"{d}") 
-                    for c, t in sorted(combos.items()):
-                        lines.append(f"  - {c}: {t} unit")
-                    lines.append("")
-                resp = "\n".join(lines) if totals else f"Tidak ada data untuk {device_type}."
-
-            elif "SN" in headers: # Untuk SFP
-                grouped: Dict[str, Dict[str, List[str]]] = defaultdict(lambda: defaultdict(list))
-                for r in records:
-                    detail = r.get("Detail Perangkat"); sn = r.get("SN")
-                    if not detail or not sn: continue
-                    key = " / ".join(str(r.get(k, "N/A")) for k in config["display_group_by"])
-                    grouped[detail][key].append(str(sn))
-                
-                if not grouped:
-                    resp = "Tidak ada data untuk SFP."
-                else:
-                    MAX_SN = 20
-                    lines = [f"📊 Rekapitulasi Stok - {device_type}", ""]
-                    for d, combos in sorted(grouped.items()):
-                        lines.append(f"{d}")
-                        for c, lst in sorted(combos.items()):
-                            lines.append(f"  • {c}: {len(lst)} unit")
-                            show = lst[:MAX_SN]
-                            lines.extend([f"    - {s}" for s in show])
-                            if len(lst) > MAX_SN:
-                                lines.append(f"    ( +{len(lst)-MAX_SN} lainnya )")
-                        lines.append("")
-                    resp = "\n".join(lines)
-            else:
-                resp = f"Tidak ada data atau konfigurasi rekap untuk {device_type}."
+async def _start_edit_ket(q: CallbackQuery, ws: gspread.Worksheet, row_num: int, row_data: Dict[str, Any], column: str):
+    user_id = q.from_user.id
+    user_data[user_id].update(item_ref(ws, row_num, row_data))
+    user_data[user_id].update({
+        'old_ket': row_data.get(column, ''),
+        'item_summary': build_summary_text(ws.title, row_data),
+        'ket_column_name': column # Kolom yang akan diubah
+    })
+    user_states[user_id].append("awaiting_new_ket")
+    await q.message.reply_text(f"{column} sekarang: {row_data.get(column) or '(kosong)'}\nKirim {column.lower()} baru:", reply_markup=NAVIGATION_KEYBOARD)
+
+@callback_action("editket_sfp")
+async def cb_editket_sfp(q: CallbackQuery, sn: str):
+    await q.message.delete()
+    ws, row_num, row_data = await gcall(find_sn_in_all_sheets, sn)
+    if not row_num:
+        await q.message.reply_text("Item tidak ditemukan. Mohon coba lagi.", reply_markup=ReplyKeyboardRemove())
+        return await show_main_menu(q.message)
+    await _start_edit_ket(q, ws, row_num, row_data, "Keterangan")
+
+@callback_action("editket_pc")
+async def cb_editket_pc(q: CallbackQuery, d: str, k1: str, k2: str, uk: str):
+    await q.message.delete()
+    ws, row_num, row_data = await gcall(find_patchcord_row, d, k1, k2, uk)
+    if not row_num:
+        await q.message.reply_text("Item tidak ditemukan. Mohon coba lagi.", reply_markup=ReplyKeyboardRemove())
+        return await show_main_menu(q.message)
+    await _start_edit_ket(q, ws, row_num, row_data, "Keterangan")
+
+@callback_action("editket_jaringan")
+async def cb_editket_jaringan(q: CallbackQuery, jns: str, kap: str, pos: str):
+    await q.message.delete()
+    ws, row_num, row_data = await gcall(find_subcard_row, jns, kap, pos)
+    if not row_num:
+        await q.message.reply_text("Item tidak ditemukan. Mohon coba lagi.", reply_markup=ReplyKeyboardRemove())
+        return await show_main_menu(q.message)
+    await _start_edit_ket(q, ws, row_num, row_data, "Posisi") # Subcard: yang diubah kolom Posisi
 
-            await q.edit_message_text(resp, reply_markup=get_device_selection_keyboard("display"))
-        except Exception:
-            logger.exception("Gagal ambil data display"); await q.edit_message_text("Gagal mengambil data.")
-        
-    if q.data.startswith("editket_"):
-        await q.message.delete()
-        parts = q.data.split("::") 
-        device_type = parts[0].split("_")[1]
-        
-        if device_type == "sfp":
-            row_num = int(parts[0].split("_")[3]) 
-            ws = ss.worksheet("SFP")
-            headers = ws.row_values(1)
-            row_data = dict(zip(headers, ws.row_values(row_num)))
-            
-            user_data[user_id].update({
-                'worksheet_to_edit': ws, 
-                'row_to_edit': row_num, 
-                'old_ket': row_data.get('Keterangan',''), 
-                'item_summary': build_summary_text(ws.title, row_data),
-                'ket_column_name': 'Keterangan' # Kolom yang akan diubah
-            })
-            user_states[user_id].append("awaiting_new_ket")
-            await q.message.reply_text(f"Keterangan sekarang: {row_data.get('Keterangan','(kosong)')}\nKirim keterangan baru:", reply_markup=NAVIGATION_KEYBOARD)
-        
-        elif device_type == "pc":
-            d, k1, k2, uk = parts[1], parts[2], parts[3], parts[4]
-            
-            ws, row_num, row_data = find_patchcord_row(d,k1,k2,uk)
-            if not row_num:
-                await q.message.reply_text("Item tidak ditemukan. Mohon coba lagi.", reply_markup=ReplyKeyboardRemove())
-                return await show_main_menu(q.message)
-
-            user_data[user_id].update({
-                'worksheet_to_edit': ws, 
-                'row_to_edit': row_num, 
-                'old_ket': row_data.get('Keterangan',''),
-                'item_summary': build_summary_text(ws.title, row_data),
-                'ket_column_name': 'Keterangan' # Kolom yang akan diubah
-            })
-            user_states[user_id].append("awaiting_new_ket")
-            await q.message.reply_text(f"Keterangan sekarang: {row_data.get('Keterangan','(kosong)')}\nKirim keterangan baru:", reply_markup=NAVIGATION_KEYBOARD)
-        
-        elif device_type == "jaringan":
-            row_num = int(parts[1])
-            ws = ss.worksheet("Subcard")
-            headers = ws.row_values(1)
-            row_data = dict(zip(headers, ws.row_values(row_num)))
-            
-            user_data[user_id].update({
-                'worksheet_to_edit': ws, 
-                'row_to_edit': row_num, 
-                'old_ket': row_data.get('Posisi',''), # Ambil data dari kolom Posisi
-                'item_summary': build_summary_text(ws.title, row_data),
-                'ket_column_name': 'Posisi' # Simpan nama kolom yang akan diubah
-            })
-            user_states[user_id].append("awaiting_new_ket")
-            await q.message.reply_text(f"Posisi sekarang: {row_data.get('Posisi','(kosong)')}\nKirim posisi baru:", reply_markup=NAVIGATION_KEYBOARD)
-
-    if q.data.startswith("editqty_"):
-        await q.message.delete()
-        parts = q.data.split("::") 
-        device_type = parts[0].split("_")[1]
-        
-        if device_type == "pc":
-            d, k1, k2, uk = parts[1], parts[2], parts[3], parts[4] 
-            
-            ws, row_num, row_data = find_patchcord_row(d,k1,k2,uk)
-            if not row_num:
-                await q.message.reply_text("Item tidak ditemukan. Mungkin sudah dihapus.", reply_markup=ReplyKeyboardRemove())
-                await clear_user_session(user_id)
-                return await show_main_menu(q.message)
-            
-            user_data[user_id]['old_qty'] = str(row_data.get('Jumlah','0'))
-            user_data[user_id]['qty_column_name'] = 'Jumlah'
-            prompt_text = f"Jumlah unit sekarang: {row_data.get('Jumlah','0')}\nKirim jumlah baru (angka):"
+async def _start_edit_qty(q: CallbackQuery, ws: gspread.Worksheet, row_num: int, row_data: Dict[str, Any],
+                          column: str, prompt_text: str):
+    user_id = q.from_user.id
+    user_data[user_id].update(item_ref(ws, row_num, row_data))
+    user_data[user_id].update({
+        'old_qty': str(row_data.get(column, '0')),
+        'qty_column_name': column,
+        'item_summary': build_summary_text(ws.title, row_data),
+    })
+    user_states[user_id].append("awaiting_new_jumlah")
+    await q.message.reply_text(prompt_text, reply_markup=NAVIGATION_KEYBOARD)
+
+@callback_action("editqty_pc")
+async def cb_editqty_pc(q: CallbackQuery, d: str, k1: str, k2: str, uk: str):
+    await q.message.delete()
+    ws, row_num, row_data = await gcall(find_patchcord_row, d, k1, k2, uk)
+    if not row_num:
+        await q.message.reply_text("Item tidak ditemukan. Mungkin sudah dihapus.", reply_markup=ReplyKeyboardRemove())
+        await clear_user_session(q.from_user.id)
+        return await show_main_menu(q.message)
+    await _start_edit_qty(q, ws, row_num, row_data, 'Jumlah',
+                          f"Jumlah unit sekarang: {row_data.get('Jumlah','0')}\nKirim jumlah baru (angka):")
+
+@callback_action("editqty_jaringan")
+async def cb_editqty_jaringan(q: CallbackQuery, jns: str, kap: str, pos: str):
+    await q.message.delete()
+    ws, row_num, row_data = await gcall(find_subcard_row, jns, kap, pos)
+    if not row_num:
+        await q.message.reply_text("Item tidak ditemukan. Mungkin sudah dihapus.", reply_markup=ReplyKeyboardRemove())
+        return await show_main_menu(q.message)
+    await _start_edit_qty(q, ws, row_num, row_data, 'Jumlah Port',
+                          f"Jumlah Port sekarang: {row_data.get('Jumlah Port','0')}\nKirim jumlah port baru (angka):")
+
+@callback_action("consume_sfp_type")
+async def cb_consume_sfp_type(q: CallbackQuery, sfp_type: str):
+    await q.message.delete()
+    user_id = q.from_user.id
+    user_data[user_id]["consume_sfp_type"] = sfp_type
+    try:
+        ws = await gcall(schema.worksheet, "SFP")
+        records = await gcall(sheet_cache.records, ws, stale_ok=True)
 
-        elif device_type == "jaringan":
-            if len(parts) < 2: # Seharusnya jadi 4 jika ada data, tapi kita cek minimal
-                await q.message.reply_text("Format data tidak valid.", reply_markup=ReplyKeyboardRemove())
-                return await show_main_menu(q.message)
+        if not records:
+            await clear_user_session(user_id)
+            await q.message.reply_text("Tidak ada stok SFP sama sekali di dalam sheet.", reply_markup=MAIN_MENU_KEYBOARD)
+            return
 
-            jns, kap, pos = parts[1], parts[2], parts[3]
-            
-            ws, row_num, row_data = find_subcard_row(jns, kap, pos)
-            if not row_num:
-                await q.message.reply_text("Item tidak ditemukan. Mungkin sudah dihapus.", reply_markup=ReplyKeyboardRemove())
-                return await show_main_menu(q.message)
-            
-            user_data[user_id]['old_qty'] = str(row_data.get('Jumlah Port','0'))
-            user_data[user_id]['qty_column_name'] = 'Jumlah Port'
-            prompt_text = f"Jumlah Port sekarang: {row_data.get('Jumlah Port','0')}\nKirim jumlah port baru (angka):"
+        filtered_sns = [rec["SN"] for rec in records if rec.get("Detail Perangkat") == sfp_type and rec.get("SN")]
 
-        else:
-            await q.message.reply_text("Tipe perangkat tidak dikenal untuk edit jumlah.", reply_markup=ReplyKeyboardRemove())
-            return await show_main_menu(q.message)
+        if not filtered_sns:
+            await clear_user_session(user_id)
+            await q.message.reply_text(f"Tidak ada stok untuk jenis SFP \"{sfp_type}\".", reply_markup=MAIN_MENU_KEYBOARD)
+            return
 
-        user_data[user_id].update({
-            'worksheet_to_edit': ws,
-            'row_to_edit': row_num,
-            'item_summary': build_summary_text(ws.title, row_data),
-        })
-        
-        user_states[user_id].append("awaiting_new_jumlah")
-        await q.message.reply_text(prompt_text, reply_markup=NAVIGATION_KEYBOARD)
-        
-    if q.data.startswith("consume_"):
-        await q.message.delete()
-        parts = q.data.split("::") 
-        device_type = parts[0].split("_")[1]
-        
-        if device_type == "sfp":
-            sfp_parts = parts[0].split("_") 
-            if sfp_parts[2] == "type":
-                sfp_type = "_".join(sfp_parts[3:]) 
-                user_data[user_id]["consume_sfp_type"] = sfp_type
-                try:
-                    ws = ss.worksheet("SFP")
-                    records = ws.get_all_records()
-                    
-                    if not records:
-                        await clear_user_session(user_id)
-                        await q.message.reply_text("Tidak ada stok SFP sama sekali di dalam sheet.", reply_markup=MAIN_MENU_KEYBOARD)
-                        return
-                    
-                    filtered_sns = [rec["SN"] for rec in records if rec.get("Detail Perangkat") == sfp_type and rec.get("SN")]
-                    
-                    if not filtered_sns:
-                        await clear_user_session(user_id)
-                        await q.message.reply_text(f"Tidak ada stok untuk jenis SFP \"{sfp_type}\".", reply_markup=MAIN_MENU_KEYBOARD)
-                        return
-                    
-                    buttons = [[InlineKeyboardButton(f"SN: {sn}", callback_data=f"consume_sfp_sn_{sfp_type}_{sn}")] for sn in filtered_sns]
-                    await q.message.reply_text(f"Pilih SN {sfp_type} yang akan diambil:", reply_markup=NAVIGATION_KEYBOARD)
-                    await q.message.reply_text("Daftar SN:", reply_markup=InlineKeyboardMarkup(buttons))
-                except gspread.exceptions.WorksheetNotFound:
-                    await clear_user_session(user_id)
-                    await q.message.reply_text("Sheet 'SFP' tidak ditemukan. Stok dianggap kosong.", reply_markup=MAIN_MENU_KEYBOARD)
-                    return
-                except Exception:
-                    logger.exception("Gagal memuat SN SFP."); await q.message.reply_text("Gagal memuat data. Mohon coba lagi.")
-                    await show_main_menu(q.message)
-                    
-            elif sfp_parts[2] == "sn":
-                sn = "_".join(sfp_parts[4:]) 
-                ws, row_num, row_data = find_sn_in_all_sheets(sn)
-                if not row_num:
-                    await q.message.reply_text("SN tidak ditemukan atau sudah diambil.", reply_markup=ReplyKeyboardRemove())
-                    await clear_user_session(user_id)
-                    return await show_main_menu(q.message)
-                    
-                user_data[user_id].update({
-                    "consume_ws_name": "SFP", 
-                    "consume_row": row_num, 
-                    "consume_sn": sn,
-                    "consume_rowdata": row_data
-                })
-                user_states[user_id].append("awaiting_consume_note_sfp")
-                await q.message.reply_text("Masukkan keterangan pemakaian:", reply_markup=NAVIGATION_KEYBOARD)
-        
-        elif device_type == "pc":
-            d, k1, k2, uk = parts[1], parts[2], parts[3], parts[4]
-            
-            ws, row_num, row_data = find_patchcord_row(d,k1,k2,uk)
-            if not row_num:
-                await q.message.reply_text("Kombinasi tidak ditemukan.", reply_markup=ReplyKeyboardRemove())
-                await clear_user_session(user_id)
-                return await show_main_menu(q.message)
-
-            user_data[user_id].update({
-                "consume_ws_name": "Patch Cord",
-                "consume_detail": d,
-                "consume_k1": k1,
-                "consume_k2": k2,
-                "consume_uk": uk,
-                "consume_row_data": row_data,
-                "consume_detail_no_ket": join_detail_pc_no_ket(d, k1, k2, uk)
-            })
-            user_states[user_id].append("awaiting_consume_pc_qty")
-            await q.message.reply_text(f"Masukkan jumlah yang akan diambil (stok tersedia: {row_data.get('Jumlah','0')}):", reply_markup=NAVIGATION_KEYBOARD)
-
-        elif device_type == "jaringan":
-            # Parse callback data: consume_jaringan_detail::jns::kap::pos
-            if len(parts) < 4:
-                await q.message.reply_text("Format data tidak valid.", reply_markup=ReplyKeyboardRemove())
-                await clear_user_session(user_id)
-                return await show_main_menu(q.message)
-            
-            jns, kap, pos = parts[1], parts[2], parts[3]
-            
-            ws, row_num, row_data = find_subcard_row(jns, kap, pos)
-            if not row_num:
-                await q.message.reply_text("Kombinasi tidak ditemukan.", reply_markup=ReplyKeyboardRemove())
-                await clear_user_session(user_id)
-                return await show_main_menu(q.message)
-
-            user_data[user_id].update({
-                "consume_ws_name": "Subcard",
-                "consume_jenis": jns,
-                "consume_kap": kap,
-                "consume_pos": pos,
-                "consume_row_data": row_data,
-                "consume_detail_no_ket": join_detail_subcard_no_ket(row_data)
-            })
-            user_states[user_id].append("awaiting_consume_jaringan_qty")
-            await q.message.reply_text(f"Masukkan jumlah yang akan diambil (stok tersedia: {row_data.get('Jumlah','0')}):", reply_markup=NAVIGATION_KEYBOARD)
+        items = [(f"SN: {sn}", "consume_sfp_sn", (str(sn),)) for sn in filtered_sns]
+        await q.message.reply_text(f"Pilih SN {sfp_type} yang akan diambil:", reply_markup=NAVIGATION_KEYBOARD)
+        await send_picker(q.message, user_id, items, "Daftar SN:")
+    except gspread.exceptions.WorksheetNotFound:
+        await clear_user_session(user_id)
+        await q.message.reply_text("Sheet 'SFP' tidak ditemukan. Stok dianggap kosong.", reply_markup=MAIN_MENU_KEYBOARD)
+    except Exception:
+        logger.exception("Gagal memuat SN SFP."); await q.message.reply_text("Gagal memuat data. Mohon coba lagi.")
+        await show_main_menu(q.message)
+
+@callback_action("consume_sfp_sn")
+async def cb_consume_sfp_sn(q: CallbackQuery, sn: str):
+    await q.message.delete()
+    user_id = q.from_user.id
+    ws, row_num, row_data = await gcall(find_sn_in_all_sheets, sn)
+    if not row_num:
+        await q.message.reply_text("SN tidak ditemukan atau sudah diambil.", reply_markup=ReplyKeyboardRemove())
+        await clear_user_session(user_id)
+        return await show_main_menu(q.message)
+
+    user_data[user_id].update({
+        "consume_ws_name": "SFP",
+        "consume_sn": sn,
+        "consume_detail_no_ket": join_detail_sfp_no_ket(row_data),
+        "consume_ket_barang": str(row_data.get("Keterangan", "")),
+    })
+    user_states[user_id].append("awaiting_consume_note_sfp")
+    await q.message.reply_text("Masukkan keterangan pemakaian:", reply_markup=NAVIGATION_KEYBOARD)
+
+@callback_action("consume_pc")
+async def cb_consume_pc(q: CallbackQuery, d: str, k1: str, k2: str, uk: str):
+    await q.message.delete()
+    user_id = q.from_user.id
+    ws, row_num, row_data = await gcall(find_patchcord_row, d, k1, k2, uk)
+    if not row_num:
+        await q.message.reply_text("Kombinasi tidak ditemukan.", reply_markup=ReplyKeyboardRemove())
+        await clear_user_session(user_id)
+        return await show_main_menu(q.message)
+
+    user_data[user_id].update({
+        "consume_ws_name": "Patch Cord",
+        "consume_detail": d,
+        "consume_k1": k1,
+        "consume_k2": k2,
+        "consume_uk": uk,
+        "consume_detail_no_ket": join_detail_pc_no_ket(d, k1, k2, uk)
+    })
+    user_states[user_id].append("awaiting_consume_pc_qty")
+    await q.message.reply_text(f"Masukkan jumlah yang akan diambil (stok tersedia: {row_data.get('Jumlah','0')}):", reply_markup=NAVIGATION_KEYBOARD)
+
+@callback_action("consume_jaringan")
+async def cb_consume_jaringan(q: CallbackQuery, jns: str, kap: str, pos: str):
+    await q.message.delete()
+    user_id = q.from_user.id
+    ws, row_num, row_data = await gcall(find_subcard_row, jns, kap, pos)
+    if not row_num:
+        await q.message.reply_text("Kombinasi tidak ditemukan.", reply_markup=ReplyKeyboardRemove())
+        await clear_user_session(user_id)
+        return await show_main_menu(q.message)
+
+    user_data[user_id].update({
+        "consume_ws_name": "Subcard",
+        "consume_jenis": jns,
+        "consume_kap": kap,
+        "consume_pos": pos,
+        "consume_detail_no_ket": join_detail_subcard_no_ket(row_data)
+    })
+    user_states[user_id].append("awaiting_consume_jaringan_qty")
+    await q.message.reply_text(f"Masukkan jumlah yang akan diambil (stok tersedia: {row_data.get('Jumlah','0')}):", reply_markup=NAVIGATION_KEYBOARD)
 
 # =========================
 # MAIN
 # =========================
+async def _retry_startup(what: str, fn: Callable[[], Any]):
+    loop = asyncio.get_running_loop(); delay = 1.0
+    while True:
+        try:
+            return await loop.run_in_executor(google_executor, fn)
+        except Exception as e:
+            logger.warning(f"Startup: {what} gagal ({e}); coba lagi dalam {delay:.0f}s.")
+            await asyncio.sleep(delay); delay = min(delay * 2, GOOGLE_CONNECT_MAX_BACKOFF)
+
+# Deteksi perubahan dari luar bot (edit manual di spreadsheet): versi file Drive naik
+# untuk setiap perubahan. Selama versi tetap, semua snapshot dianggap masih segar.
+# Bila naik, semua sheet yang di-cache dibaca dalam satu values_batch_get dan hanya
+# sheet yang isinya berbeda yang snapshot-nya diganti. Kenaikan versi karena flush
+# jurnal bot sendiri tidak memicu unduhan: versi sesudah commit langsung diadopsi
+# bila versi sebelum commit memang sudah diselaraskan.
+def spreadsheet_version() -> str:
+    return drive_service.files().get(fileId=SPREADSHEET_ID, fields="version,modifiedTime").execute()["version"]
+
+def revalidate_cached_sheets() -> List[str]:
+    titles = [t for t in sheet_cache.cached_titles() if t in SCHEMA_SHEETS]
+    if not titles: return []
+    tokens = {t: sheet_cache.revalidation_token(t) for t in titles}
+    try:
+        ranges = ss.values_batch_get([f"'{t}'" for t in titles]).get("valueRanges", [])
+    except gspread.exceptions.APIError as e:
+        if _is_transient(e): raise
+        schema.load(); sheet_cache.invalidate(); return titles # Sheet di-rename/dihapus
+    return [t for t, vr in zip(titles, ranges) if sheet_cache.revalidate(t, vr.get("values", []), tokens[t])]
+
+class SheetChangeTracker:
+    def __init__(self):
+        self.version: Optional[str] = None # Versi file yang isinya sudah diselaraskan dengan cache
+        self._lock = threading.Condition() # Menjaga self.version & _committing
+        self._sync_lock = threading.Lock() # Satu cek versi berjalan pada satu waktu
+        self._synced_at = float("-inf")
+        self._committing: set = set()      # Commit bot yang versi sesudahnya belum tercatat
+        self._next_commit = 0
+
+    def _settle(self, version: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        # Versi berbeda saat commit bot sendiri masih berjalan kemungkinan besar hasil commit
+        # itu: tunggu commit yang sedang berjalan saat ini saja (bukan commit yang datang
+        # sesudahnya) mencatat versinya, lalu baca ulang versi server.
+        with self._lock:
+            busy = set(self._committing)
+            if version == self.version or not busy: return version, self.version
+            known = self.version
+            self._lock.wait_for(lambda: not (busy & self._committing), timeout=GOOGLE_CALL_TIMEOUT)
+            if self.version == known: return version, known
+        return spreadsheet_version(), self.version
+
+    def sync(self) -> List[str]:
+        # Pemanggil yang menunggu cek lain yang dimulai setelah ia meminta memakai hasil cek itu
+        requested = time.monotonic()
+        with self._sync_lock:
+            if self._synced_at >= requested: return []
+            started = time.monotonic()
+            version, known = self._settle(spreadsheet_version())
+            if version == known:
+                sheet_cache.touch(sheet_cache.cached_titles()); changed = []
+            else:
+                changed = revalidate_cached_sheets()
+                with self._lock: self.version = version
+            self._synced_at = started
+            return changed
+
+    def _current(self) -> Optional[str]:
+        try:
+            return spreadsheet_version()
+        except Exception as e:
+            logger.warning(f"Gagal membaca versi spreadsheet: {e}"); return None
+
+    def own_commit(self, commit: Callable[[], Any]):
+        # Tidak memegang lock selama commit agar cek versi di jalur tulis tidak ikut menunggu
+        with self._lock:
+            known, token = self.version, self._next_commit
+            self._next_commit += 1
+            self._committing.add(token)
+        try:
+            before = self._current() if known is not None else None
+            commit()
+            if before is None or before != known: return
+            after = self._current()
+            with self._lock:
+                if after and self.version == known: self.version = after
+        finally:
+            with self._lock:
+                self._committing.discard(token); self._lock.notify_all()
+
+sheet_changes = SheetChangeTracker()
+
+def sync_before_write(titles: List[str]):
+    # Jalur tulis menghitung nomor baris dari snapshot: pastikan dulu tidak ada edit dari
+    # luar sejak snapshot terakhir dikonfirmasi (satu panggilan metadata Drive bila tidak ada)
+    try:
+        sheet_changes.sync()
+    except Exception as e:
+        logger.warning(f"Cek versi spreadsheet sebelum menulis gagal ({e}); sheet dimuat ulang.")
+        sheet_cache.expire(titles)
+
+async def sheet_change_watcher():
+    while SHEET_CHANGE_POLL_INTERVAL > 0:
+        await asyncio.sleep(SHEET_CHANGE_POLL_INTERVAL)
+        if not google_ready.is_set(): continue
+        try:
+            changed = await gcall(sheet_changes.sync)
+            if changed: logger.info(f"Perubahan dari luar bot terdeteksi; cache diperbarui: {', '.join(changed)}")
+        except Exception as e:
+            logger.warning(f"Cek perubahan spreadsheet gagal: {e}")
+
+async def mirror_sync():
+    # Rekonsiliasi berkala: muat ulang sheet perangkat yang kedaluwarsa dari Google,
+    # lalu tulis snapshot yang berubah ke mirror lokal
+    titles = [cfg["worksheet_name"] for cfg in DEVICE_CONFIG.values()]
+    while True:
+        await asyncio.sleep(MIRROR_SYNC_INTERVAL)
+        if not google_ready.is_set(): continue
+        try:
+            await load_sheets(titles)
+            saved = await asyncio.to_thread(persist_mirror)
+            if saved: logger.info(f"Mirror: {saved} sheet disimpan.")
+        except Exception as e:
+            logger.warning(f"Sinkronisasi mirror gagal: {e}")
+
+async def google_startup():
+    await _retry_startup("koneksi Google", connect_google); boot_mark("koneksi Google")
+    await _retry_startup("muat schema", schema.load)
+    await _retry_startup("replay jurnal", replay_journal); boot_mark("schema & replay jurnal")
+    google_ready.set()
+    await warm_sn_index(); search_index.sync(); boot_mark("warm-up cache")
+    await asyncio.to_thread(persist_mirror)
+
 if __name__ == "__main__":
+    boot_mark("impor & inisialisasi modul")
     logger.info("Bot starting...")
-    app.run()
+
+    async def main():
+        if seed_cache_from_mirror(): search_index.sync()
+        boot_mark("mirror lokal")
+        await app.start(); boot_mark("Telegram siap")
+        startup = asyncio.create_task(google_startup())
+        worker = asyncio.create_task(journal_worker())
+        janitor = asyncio.create_task(photo_janitor())
+        session_gc = asyncio.create_task(session_janitor())
+        syncer = asyncio.create_task(mirror_sync())
+        watcher = asyncio.create_task(sheet_change_watcher())
+        await idle()
+        for task in (startup, worker, janitor, session_gc, syncer, watcher): task.cancel()
+        pending_photos.discard_all(); sessions.flush()
+        try:
+            # Tunggu dulu flush worker yang mungkin masih berjalan di thread-nya
+            while await gcall(flush_journal, wait=GOOGLE_CALL_TIMEOUT, timeout=2 * GOOGLE_CALL_TIMEOUT): pass
+            if journal.pending_count():
+                logger.warning("Jurnal belum terkirim semua; akan diputar ulang saat start berikutnya.")
+        except Exception as e:
+            logger.warning(f"Jurnal belum terkirim semua ({e}); akan diputar ulang saat start berikutnya.")
+        await app.stop()
+
+    app.run(main())
     logger.info("Bot stopped.")